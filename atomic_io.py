@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+"""
+原子写文件：先写同目录下的 <path>.tmp，写完再 os.replace 覆盖目标文件，
+读者（下游任务、serve.py 的重新加载）要么看到旧文件、要么看到完整的新文件，不会读到写了一半的内容
+
+    with atomic_open("ip.txt") as f:
+        f.write("\n".join(ips))
+    write_json(".cache/source_health.json", entries, indent=1)
+"""
+
+import os
+import json
+import contextlib
+from typing import IO, Any, Iterator
+
+@contextlib.contextmanager
+def atomic_open(path: str, mode: str = "w", encoding: str = "utf-8") -> Iterator[IO]:
+    """打开临时文件供写入，正常退出时替换目标文件，出错时删除临时文件、保留原文件"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    try:
+        with open(tmp_path, mode, encoding=None if "b" in mode else encoding) as f:
+            yield f
+        os.replace(tmp_path, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(tmp_path)
+        raise
+
+def write_json(path: str, data: Any, **dump_kwargs):
+    """原子写出JSON（非ASCII字符原样保留）；dump_kwargs 传给 json.dump（如 indent）"""
+    with atomic_open(path) as f:
+        json.dump(data, f, ensure_ascii=False, **dump_kwargs)
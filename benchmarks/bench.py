@@ -0,0 +1,492 @@
+#!/usr/bin/env python3
+"""
+基准测试：提取（extract_ips，覆盖 SITE_RULES 全部站点）、地区筛选（filter_target_regions_ip 与
+流式多进程 filter_target_regions_streaming，10k/1M/10M 行）、端到端采集（process_url_async，
+经本地替身服务器注入延迟与失败）、启动开销（新进程中的导入耗时）、HTTP服务压测（serve.py）、
+最长前缀匹配（前缀树 vs 二分查找 vs 逐区间线性扫描，IPv4/IPv6，不同网段数量）
+
+用法：
+    python benchmarks/bench.py                         # 默认：extract + classify(10k,1m) + collect + startup + serve + trie
+    python benchmarks/bench.py --only classify --sizes 10k,1m,10m
+    python benchmarks/bench.py --save-baseline         # 把本次结果存为基线
+    python benchmarks/bench.py --compare               # 与基线对比，吞吐下降超过阈值即报告退化
+结果写入 benchmarks/results/latest.json，基线为 benchmarks/results/baseline.json
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import platform
+import argparse
+import statistics
+import subprocess
+import contextlib
+import tempfile
+import threading
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import quote
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import collect_ips  # noqa: E402
+import ip_filter  # noqa: E402
+import serve  # noqa: E402
+from prefix_trie import PrefixTrie  # noqa: E402
+from local_server import StandInServer  # noqa: E402
+from benchmarks.fixtures import generate_ip_file, make_page, source_urls  # noqa: E402
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(BENCH_DIR, "data")
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+LATEST_FILE = os.path.join(RESULTS_DIR, "latest.json")
+BASELINE_FILE = os.path.join(RESULTS_DIR, "baseline.json")
+SIZES = {"10k": 10_000, "1m": 1_000_000, "10m": 10_000_000}
+
+def summarize(latencies: List[float], items: int, elapsed: float, **extra) -> Dict:
+    """latencies为单次耗时（秒）；throughput为每秒处理的条目数"""
+    ordered = sorted(latencies)
+
+    def pct(p: float) -> float:
+        if not ordered:
+            return 0.0
+        return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))] * 1000
+
+    result = {
+        "throughput": items / elapsed if elapsed else 0.0,
+        "items": items,
+        "elapsed_s": elapsed,
+        "p50_ms": pct(50),
+        "p90_ms": pct(90),
+        "p99_ms": pct(99),
+        "mean_ms": statistics.mean(ordered) * 1000 if ordered else 0.0,
+    }
+    result.update(extra)
+    return result
+
+# -------------------------- 提取 --------------------------
+def bench_extract(iterations: int = 30) -> Dict[str, Dict]:
+    results = {}
+    for host, url in source_urls().items():
+        html = make_page(host)
+        expected = collect_ips.EXTRACTOR.extract(html, url)
+        latencies = []
+        start = time.perf_counter()
+        for _ in range(iterations):
+            t0 = time.perf_counter()
+            collect_ips.extract_ips(html, url)
+            latencies.append(time.perf_counter() - t0)
+        elapsed = time.perf_counter() - start
+        results[f"extract[{host}]"] = summarize(
+            latencies, iterations, elapsed,
+            page_kb=len(html) / 1024,
+            mb_per_s=len(html) * iterations / elapsed / 1e6,
+            ips=len(expected.ips),
+            rule_matched=expected.matched,
+        )
+    return results
+
+# -------------------------- 地区筛选 --------------------------
+def bench_classify(sizes: List[str]) -> Dict[str, Dict]:
+    results = {}
+    modes = [False] + ([True] if ip_filter.np is not None else [])
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in sizes:
+            path = generate_ip_file(os.path.join(DATA_DIR, f"ip_{size}.txt"), SIZES[size])
+            for use_numpy in modes:
+                start = time.perf_counter()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    ip_filter.filter_target_regions_ip(path, os.path.join(tmp, "ip2.txt"), use_numpy=use_numpy)
+                elapsed = time.perf_counter() - start
+                name = f"classify[{size},{'numpy' if use_numpy else 'python'}]"
+                results[name] = summarize([elapsed], SIZES[size], elapsed)
+            # 流式多进程路径（每核一个进程）
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                ip_filter.filter_target_regions_streaming(path, os.path.join(tmp, "ip2.txt"))
+            elapsed = time.perf_counter() - start
+            results[f"classify[{size},stream]"] = summarize([elapsed], SIZES[size], elapsed, workers=os.cpu_count())
+    return results
+
+def bench_prefix_cache(lookups: int = 500_000, prefixes: int = 5_000, seed: int = 0) -> Dict[str, Dict]:
+    """逐IP查找：RegionIndex二分 vs /24分类缓存；IP集中在少量/24网段（与上游列表的分布相近）"""
+    import random
+    rng = random.Random(seed)
+    index = ip_filter.get_default_index()
+    pool = [rng.getrandbits(24) for _ in range(prefixes)]
+    ips = [(rng.choice(pool) << 8) | rng.randrange(256) for _ in range(lookups)]
+    results = {}
+    for name, classifier in (("index", index), ("memo", ip_filter.PrefixCache(index))):
+        start = time.perf_counter()
+        for ip in ips:
+            classifier.lookup_int(ip)
+        elapsed = time.perf_counter() - start
+        extra = classifier.stats() if isinstance(classifier, ip_filter.PrefixCache) else {}
+        results[f"prefix_cache[{name}]"] = summarize([elapsed], lookups, elapsed, **extra)
+    return results
+
+# -------------------------- 最长前缀匹配 --------------------------
+def _synthetic_ranges(count: int, width: int, rng) -> List[tuple]:
+    """count个互不重叠的随机区间 (起, 止, 地区)，区间长度为2^8~2^(width/2)之间的随机值"""
+    starts = sorted(rng.getrandbits(width) for _ in range(count))
+    ranges = []
+    for i, start in enumerate(starts):
+        limit = starts[i + 1] - 1 if i + 1 < len(starts) else (1 << width) - 1
+        if ranges and start <= ranges[-1][1]:
+            continue
+        end = min(limit, start + (1 << rng.randrange(8, width // 2)) - 1)
+        ranges.append((start, end, ("香港", "日本", "新加坡")[i % 3]))
+    return ranges
+
+def _time_lookups(lookup, addrs: List[int]) -> float:
+    start = time.perf_counter()
+    for addr in addrs:
+        lookup(addr)
+    return time.perf_counter() - start
+
+def bench_trie(lookups: int = 200_000, sizes=(1_000, 10_000, 100_000), seed: int = 0) -> Dict[str, Dict]:
+    """
+    同一张区间表的三种查找：前缀树（耗时只与地址位宽有关）、RegionIndex二分查找、逐区间线性扫描（查找次数按网段数缩减）；
+    IPv4使用 region_ranges.txt 与随机生成的大表，IPv6只对比前缀树与线性扫描
+    """
+    import random
+    rng = random.Random(seed)
+    results = {}
+    v4_addrs = [rng.getrandbits(32) for _ in range(lookups)]
+    tables = [("real", ip_filter.get_default_index())]
+    for size in sizes:
+        tables.append((str(size), ip_filter.RegionIndex(_synthetic_ranges(size, 32, rng))))
+
+    for name, index in tables:
+        ranges = list(zip(index.starts, index.ends, index.labels))
+
+        def linear(addr, ranges=ranges):
+            for start, end, label in ranges:
+                if start <= addr <= end:
+                    return label
+            return None
+
+        trie_lookup = index.trie.lookup
+        cases = [
+            ("trie", lambda addr: trie_lookup(4, addr), v4_addrs),
+            ("bisect", index.lookup_int, v4_addrs),
+            ("linear", linear, v4_addrs[:max(100, lookups * 50 // max(len(ranges), 1))]),
+        ]
+        for method, lookup, addrs in cases:
+            elapsed = _time_lookups(lookup, addrs)
+            results[f"trie[v4,{name},{method}]"] = summarize(
+                [elapsed / len(addrs)], len(addrs), elapsed, ranges=len(ranges), prefixes=len(index.trie),
+            )
+
+    v6_addrs = [(0x2 << 124) | rng.getrandbits(124) if i % 2 else rng.getrandbits(128) for i in range(lookups)]
+    for size in (1_000, 10_000):
+        ranges = _synthetic_ranges(size, 128, rng)
+        trie = PrefixTrie()
+        start = time.perf_counter()
+        for first, last, label in ranges:
+            trie.add_range(6, first, last, label)
+        build = time.perf_counter() - start
+
+        def linear6(addr, ranges=ranges):
+            for first, last, label in ranges:
+                if first <= addr <= last:
+                    return label
+            return None
+
+        for method, lookup, addrs in (
+            ("trie", lambda addr: trie.lookup(6, addr), v6_addrs),
+            ("linear", linear6, v6_addrs[:max(100, lookups * 50 // size)]),
+        ):
+            elapsed = _time_lookups(lookup, addrs)
+            results[f"trie[v6,{size},{method}]"] = summarize(
+                [elapsed / len(addrs)], len(addrs), elapsed, ranges=len(ranges), prefixes=len(trie), build_s=build,
+            )
+    return results
+
+# -------------------------- 端到端采集 --------------------------
+class _NoBrowserFetcher(collect_ips.SmartFetcher):
+    """基准环境没有浏览器：兜底只计数，不启动Chrome"""
+
+    def __init__(self, anti_block):
+        super().__init__(anti_block, cache=None)
+        self.browser_fallbacks = 0
+
+    def _fetch_with_browser(self, url: str, quick_mode: bool = False) -> str:
+        self.browser_fallbacks += 1
+        return ""
+
+def bench_collect(rounds: int = 3, latency=(0.05, 0.3), failure_rate: float = 0.1) -> Dict[str, Dict]:
+    """替身服务器作为HTTP代理，按真实主机名提供各站点页面，所有站点按低风险直连"""
+    hosts = source_urls()
+    pages = {}
+    urls = []
+    for host, url in hosts.items():
+        local_url = "http://" + url.split("://", 1)[1]
+        path = local_url[len("http://" + host):] or "/"
+        pages[f"/{host}{path}"] = make_page(host)
+        urls.append(local_url)
+
+    per_source: List[float] = []
+    totals: List[float] = []
+    fallbacks = 0
+    ip_count = 0
+    with StandInServer(pages, latency=latency, failure_rate=failure_rate, seed=0) as server:
+        saved_env = {k: os.environ.get(k) for k in ("HTTP_PROXY", "http_proxy", "NO_PROXY", "no_proxy")}
+        os.environ["HTTP_PROXY"] = os.environ["http_proxy"] = server.url()
+        os.environ.pop("NO_PROXY", None)
+        os.environ.pop("no_proxy", None)
+        try:
+            for _ in range(rounds):
+                fetcher = _NoBrowserFetcher(collect_ips.AntiBlockTool())
+                engine = collect_ips.AsyncFetchEngine(fetcher)
+
+                async def timed(url: str):
+                    t0 = time.perf_counter()
+                    ips = await collect_ips.process_url_async(url, 'low', engine)
+                    per_source.append(time.perf_counter() - t0)
+                    return ips
+
+                async def run_all():
+                    collect_ips._set_fetch_executor(len(urls))
+                    return await asyncio.gather(*(timed(url) for url in urls))
+
+                start = time.perf_counter()
+                results = asyncio.run(run_all())
+                totals.append(time.perf_counter() - start)
+                fallbacks += fetcher.browser_fallbacks
+                ip_count = len(set().union(*results))
+        finally:
+            for key, value in saved_env.items():
+                if value is None:
+                    os.environ.pop(key, None)
+                else:
+                    os.environ[key] = value
+
+    return {
+        "collect[process_url]": summarize(per_source, len(per_source), sum(per_source)),
+        "collect[run]": summarize(
+            totals, len(urls) * rounds, sum(totals),
+            ips=ip_count, browser_fallbacks=fallbacks, failure_rate=failure_rate,
+        ),
+    }
+
+# -------------------------- 启动开销 --------------------------
+HEAVY_MODULES = ("requests", "selenium", "undetected_chromedriver", "fake_useragent")
+_STARTUP_SNIPPETS = {
+    "import extractor": "import extractor",
+    "import collect_ips": "import collect_ips",
+    "first headers": "import collect_ips; collect_ips.AntiBlockTool().get_random_headers()",
+}
+
+def _time_in_subprocess(snippet: str) -> Dict:
+    """在新解释器中计时（模块缓存为空），同时返回执行后已加载的重量级依赖"""
+    code = (
+        "import sys, time, json\n"
+        "t = time.perf_counter()\n"
+        f"{snippet}\n"
+        "elapsed = time.perf_counter() - t\n"
+        f"print(json.dumps([elapsed, [m for m in {HEAVY_MODULES!r} if m in sys.modules]]))\n"
+    )
+    out = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True)
+    elapsed, loaded = json.loads(out.stdout.strip().splitlines()[-1])
+    return {"elapsed": elapsed, "loaded": loaded}
+
+def bench_startup(runs: int = 7) -> Dict[str, Dict]:
+    results = {}
+    for name, snippet in _STARTUP_SNIPPETS.items():
+        samples = [_time_in_subprocess(snippet) for _ in range(runs)]
+        latencies = [s["elapsed"] for s in samples]
+        results[f"startup[{name}]"] = summarize(
+            latencies, runs, sum(latencies), heavy_modules_loaded=samples[-1]["loaded"],
+        )
+    return results
+
+# -------------------------- HTTP服务 --------------------------
+def _load_clients(address, paths: List[tuple], clients: int, rounds: int) -> Dict[str, Dict]:
+    """clients个保持连接的客户端并发请求，每轮依次请求 paths 中的每一项 (用例名, 路径, 请求头)"""
+    import http.client
+    latencies: Dict[str, List[float]] = {name: [] for name, _, _ in paths}
+    statuses: Dict[int, int] = {}
+    lock = threading.Lock()
+
+    def client():
+        conn = http.client.HTTPConnection(*address, timeout=30)
+        local = {name: [] for name, _, _ in paths}
+        local_statuses: Dict[int, int] = {}
+        for _ in range(rounds):
+            for name, path, headers in paths:
+                t0 = time.perf_counter()
+                conn.request("GET", path, headers=headers)
+                response = conn.getresponse()
+                response.read()
+                local[name].append(time.perf_counter() - t0)
+                local_statuses[response.status] = local_statuses.get(response.status, 0) + 1
+        conn.close()
+        with lock:
+            for name, values in local.items():
+                latencies[name].extend(values)
+            for status, n in local_statuses.items():
+                statuses[status] = statuses.get(status, 0) + n
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    results = {name: summarize(values, len(values), elapsed) for name, values in latencies.items()}
+    total = sum(len(values) for values in latencies.values())
+    results["all"] = summarize([v for values in latencies.values() for v in values], total, elapsed, statuses=statuses)
+    return results
+
+class _QuietFileHandler(SimpleHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+def bench_serve(lines: int = 100_000, clients: int = 8, rounds: int = 1000, reload_every: float = 0.5) -> Dict[str, Dict]:
+    """
+    压测 serve.ListServer：多个客户端混合请求全量（gzip）、按地区、top-N 与条件请求（304），
+    期间后台按 reload_every 秒原子替换 ip.txt 触发重新加载；另以逐请求读文件的静态文件服务作为对照
+    """
+    results = {}
+    source = generate_ip_file(os.path.join(DATA_DIR, f"ip_serve_{lines}.txt"), lines)
+    with tempfile.TemporaryDirectory() as tmp:
+        ip_file, target_file = os.path.join(tmp, "ip.txt"), os.path.join(tmp, "ip2.txt")
+        with open(source, "r", encoding="utf8") as f:
+            entries = [line.strip() for line in f if line.strip()]
+        index = ip_filter.get_default_index()
+        ip_filter.write_ip_list(entries, ip_file)
+        ip_filter.write_ip_list([e for e in entries if index.lookup(e)], target_file)
+        region = index.regions[0]
+
+        with serve.ListServer([ip_file, target_file], host="127.0.0.1", port=0, ranked_file=None,
+                              reload_interval=reload_every / 2) as server:
+            etag = server.snapshot.response("ip2.txt").gzip.etag
+            paths = [
+                ("serve[ip.txt,gzip]", "/ip.txt", {"Accept-Encoding": "gzip"}),
+                ("serve[ip2.txt]", "/ip2.txt", {}),
+                ("serve[region]", f"/ip2.txt?region={quote(region)}", {"Accept-Encoding": "gzip"}),
+                ("serve[top=100]", "/ip.txt?top=100", {}),
+                ("serve[304]", "/ip2.txt", {"Accept-Encoding": "gzip", "If-None-Match": etag}),
+            ]
+            stop = threading.Event()
+
+            def rewrite():
+                # 模拟流水线写出新结果：每次多一行，原子替换
+                extra = 0
+                while not stop.wait(reload_every):
+                    extra += 1
+                    ip_filter.write_ip_list(entries + [f"10.0.0.{extra % 256}"], ip_file)
+
+            writer = threading.Thread(target=rewrite, daemon=True)
+            writer.start()
+            try:
+                served = _load_clients(server._server.server_address[:2], paths, clients, rounds)
+            finally:
+                stop.set()
+                writer.join()
+            served["serve[all]"] = served.pop("all")
+            served["serve[all]"]["reloads"] = server.reloads
+            results.update(served)
+
+        # 对照：标准库静态文件服务（每个请求读文件、无压缩与条件请求）
+        httpd = ThreadingHTTPServer(("127.0.0.1", 0), partial(_QuietFileHandler, directory=tmp))
+        httpd.daemon_threads = True
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        try:
+            static = _load_clients(httpd.server_address[:2], [("static", "/ip.txt", {})], clients, rounds)
+        finally:
+            httpd.shutdown()
+            httpd.server_close()
+        results["serve[ip.txt,static-file]"] = static["static"]
+    return results
+
+# -------------------------- 结果与基线 --------------------------
+def compare(current: Dict[str, Dict], baseline: Dict[str, Dict], threshold: float) -> List[str]:
+    """按吞吐对比，返回退化的用例名"""
+    regressions = []
+    print(f"\n{'用例':<44}{'基线':>14}{'本次':>14}{'变化':>10}")
+    for name, result in current.items():
+        base = baseline.get(name)
+        if not base or not base.get("throughput"):
+            print(f"{name:<44}{'-':>14}{result['throughput']:>14.1f}{'新增':>10}")
+            continue
+        change = result["throughput"] / base["throughput"] - 1
+        flag = " !" if change < -threshold else ""
+        if flag:
+            regressions.append(name)
+        print(f"{name:<44}{base['throughput']:>14.1f}{result['throughput']:>14.1f}{change:>+9.1%}{flag}")
+    return regressions
+
+def print_results(results: Dict[str, Dict]):
+    print(f"{'用例':<44}{'吞吐/s':>12}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}")
+    for name, r in results.items():
+        print(f"{name:<44}{r['throughput']:>12.1f}{r['p50_ms']:>10.2f}{r['p90_ms']:>10.2f}{r['p99_ms']:>10.2f}")
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="IP采集/筛选基准测试")
+    parser.add_argument("--only", default="extract,classify,collect,startup,serve,trie",
+                        help="逗号分隔：extract,classify,collect,startup,serve,trie")
+    parser.add_argument("--sizes", default="10k,1m", help=f"筛选用例的输入规模，可选：{','.join(SIZES)}")
+    parser.add_argument("--save-baseline", action="store_true", help="把本次结果保存为基线")
+    parser.add_argument("--compare", action="store_true", help="与基线对比")
+    parser.add_argument("--threshold", type=float, default=0.10, help="吞吐下降超过该比例视为退化")
+    args = parser.parse_args(argv)
+
+    logging.getLogger().setLevel(logging.ERROR)
+    selected = {s.strip() for s in args.only.split(",") if s.strip()}
+    results: Dict[str, Dict] = {}
+    if "extract" in selected:
+        results.update(bench_extract())
+    if "classify" in selected:
+        results.update(bench_classify([s.strip() for s in args.sizes.split(",") if s.strip()]))
+        results.update(bench_prefix_cache())
+    if "collect" in selected:
+        results.update(bench_collect())
+    if "startup" in selected:
+        results.update(bench_startup())
+    if "serve" in selected:
+        results.update(bench_serve())
+    if "trie" in selected:
+        results.update(bench_trie())
+    print_results(results)
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "numpy": ip_filter.np is not None,
+        },
+        "results": results,
+    }
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    with open(LATEST_FILE, "w", encoding="utf8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.save_baseline:
+        with open(BASELINE_FILE, "w", encoding="utf8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n基线已保存：{BASELINE_FILE}")
+    if args.compare:
+        if not os.path.exists(BASELINE_FILE):
+            print(f"\n基线不存在：{BASELINE_FILE}（先运行 --save-baseline）")
+            return 1
+        with open(BASELINE_FILE, "r", encoding="utf8") as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n吞吐退化超过 {args.threshold:.0%}：{', '.join(regressions)}")
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,94 @@
+"""
+基准测试用的合成数据：按 SITE_RULES 为每个站点生成结构相符的HTML页面，以及大规模 ip.txt
+"""
+
+import os
+import random
+from typing import Dict, List
+
+from collect_ips import SITE_RULES, URLS
+
+def random_ips(count: int, rng: random.Random, with_port: bool = False) -> List[str]:
+    ips = []
+    for _ in range(count):
+        addr = rng.getrandbits(32)
+        ip = f"{addr >> 24}.{(addr >> 16) & 0xFF}.{(addr >> 8) & 0xFF}.{addr & 0xFF}"
+        ips.append(f"{ip}:{rng.choice((443, 2053, 8443))}" if with_port else ip)
+    return ips
+
+def _padding(size: int, rng: random.Random) -> str:
+    """页面中与IP无关的部分（样式、脚本、导航），用于模拟大页面"""
+    words = ["cloudflare", "speed", "latency", "update", "node", "table", "menu", "footer"]
+    chunks = []
+    total = 0
+    while total < size:
+        chunk = f'<div class="nav-item"><a href="/{rng.choice(words)}">{" ".join(rng.choices(words, k=8))}</a></div>\n'
+        chunks.append(chunk)
+        total += len(chunk)
+    return "".join(chunks)
+
+def _attrs_html(attrs: Dict[str, str]) -> str:
+    return "".join(f' {k}="{v}"' for k, v in attrs.items())
+
+def make_page(host: str, ip_count: int = 300, padding: int = 200_000, seed: int = 0) -> str:
+    """按站点规则生成页面：IP位于规则指定的元素/脚本中，前后填充无关内容"""
+    rng = random.Random(f"{host}:{seed}")
+    rule = SITE_RULES[host]
+    head = f"<html><head><title>{host}</title><style>{_padding(padding // 4, rng)}</style></head><body>"
+    tail = f"<footer>{_padding(padding // 4, rng)}</footer></body></html>"
+    body = _padding(padding // 2, rng)
+    if 'script_pattern' in rule:
+        ips = random_ips(ip_count, rng, with_port=True)
+        payload = "<script>var ips = [" + ",".join(f'"{ip}"' for ip in ips) + "];</script>"
+    elif rule['attrs'].get('tabulator-field') == 'ip':
+        # 表格型页面：每个IP一个单元格
+        ips = random_ips(ip_count, rng)
+        payload = "".join(
+            f'<div class="tabulator-row"><div class="tabulator-cell" tabulator-field="ip">{ip}</div>'
+            f'<div class="tabulator-cell" tabulator-field="latency">{rng.randint(20, 300)}ms</div></div>'
+            for ip in ips
+        )
+    else:
+        ips = random_ips(ip_count, rng)
+        payload = f"<{rule['tag']}{_attrs_html(rule['attrs'])}>" + "\n".join(ips) + f"</{rule['tag']}>"
+    return head + body + payload + tail
+
+def source_urls() -> Dict[str, str]:
+    """{站点主机: URLS中的原始地址}"""
+    from urllib.parse import urlsplit
+    urls = {}
+    for level_urls in URLS.values():
+        for url in level_urls:
+            urls.setdefault(urlsplit(url).hostname, url)
+    return urls
+
+def generate_ip_file(path: str, lines: int, seed: int = 0) -> str:
+    """生成ip.txt：约10%目标地区IP、1%非法行、5%带端口，其余为随机IP；已存在则直接复用"""
+    if os.path.exists(path):
+        return path
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    rng = random.Random(seed)
+    target_prefixes = [(47, 57), (8, 128), (43, 1), (59, 149), (188, 166), (152, 70)]
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf8") as f:
+        batch = []
+        for _ in range(lines):
+            r = rng.random()
+            if r < 0.10:
+                o1, o2 = rng.choice(target_prefixes)
+                line = f"{o1}.{o2}.{rng.randrange(256)}.{rng.randrange(256)}"
+            elif r < 0.11:
+                line = rng.choice(["999.1.1.1", "not-an-ip", "1.2.3", "1.2.3.4.5"])
+            else:
+                addr = rng.getrandbits(32)
+                line = f"{addr >> 24}.{(addr >> 16) & 0xFF}.{(addr >> 8) & 0xFF}.{addr & 0xFF}"
+                if r < 0.16:
+                    line += ":443"
+            batch.append(line)
+            if len(batch) >= 100_000:
+                f.write("\n".join(batch) + "\n")
+                batch = []
+        if batch:
+            f.write("\n".join(batch) + "\n")
+    os.replace(tmp_path, path)
+    return path
@@ -4,20 +4,27 @@ Cloudflare IP 采集器（适配http://ip.flares.cloud/动态渲染）
 """
 
 import os
-import re
 import time
 import random
+import asyncio
 import logging
+import threading
+import contextlib
 import concurrent.futures
-from typing import Set, List, Dict
+from typing import Set, List, Dict, Optional, Tuple
+from urllib.parse import urlsplit
 
-import requests
-from fake_useragent import UserAgent
-import undetected_chromedriver as uc
-from bs4 import BeautifulSoup
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.common.by import By
+# requests / fake_useragent / undetected_chromedriver / selenium 在首次使用时才导入，
+# 仅导入提取函数或只抓取低风险站点时不承担浏览器相关依赖的加载开销
+from atomic_io import atomic_open
+from extractor import IP_PATTERN, ExtractionEngine
+from http_cache import FetchedPage, SourceCache
+from ip_store import IPStore
+from ip_validate import CandidateValidator
+from ipset import PackedIPSet
+from metrics import METRICS, profiled
+from source_health import SourceHealth
+from probe import probe_and_write
 
 # -------------------------- 核心配置 --------------------------
 logging.basicConfig(
@@ -26,12 +33,29 @@ logging.basicConfig(
     datefmt="%H:%M:%S",
 )
 
-IP_PATTERN = re.compile(r'\b(?:[0-9]{1,3}\.){3}[0-9]{1,3}\b')
-IP_WITH_PORT_PATTERN = re.compile(r'\b(?:[0-9]{1,3}\.){3}[0-9]{1,3}:\d+\b')
 OUTPUT_FILE = "ip.txt"
-MAX_WORKERS = 4
+BINARY_OUTPUT_FILE = "ip.bin"  # ip.txt 的定长二进制版本（格式见 ipset.py），供下游内存映射读取
+DELTA_FILE = "ip_delta.txt"  # 本次相对上次的变更：每行 +ip 或 -ip
+PROBE_ENABLED = True  # 采集后对候选IP并发测速，输出 ip_latency.txt / ip_top.txt
+MAX_WORKERS = 16  # 异步引擎中阻塞IO（requests/浏览器）的线程数上限
 BASE_TIMEOUT = 12
 RANDOM_JITTER = (1, 3)
+HEADERS_POOL_SIZE = 15  # 请求头池上限，池未满时每次取用都新生成一个
+BROWSER_POOL_SIZE = 3  # 同时存在的浏览器会话上限（高风险页面可并行渲染）
+TABLE_SETTLE_TIME = 1.0  # IP表格行数保持不变多久（秒）视为渲染完成
+TABLE_POLL_INTERVAL = 0.25
+IP_TABLE_SELECTOR = "div.tabulator-cell[tabulator-field='ip']"
+CLOUDFLARE_ONLY = False  # 只保留Cloudflare官方网段（cloudflare_ranges.txt）内的地址；优选列表中的反代IP会被丢弃
+RUN_DEADLINE = 300  # 整次采集的截止时间（秒），到期即以已完成的站点结果收尾，不再等待慢站点
+SOURCE_BUDGETS = {'low': 60, 'medium': 60, 'high': 90}  # 单个站点的时间预算（秒），同时不超过全局剩余时间
+# 发布同一份列表的镜像站点：只调度健康状况最好的一个，超过其耗时分位数仍未返回时向其余镜像发出对冲请求
+MIRROR_GROUPS = [
+    ('https://cf.090227.xyz', 'https://addressesapi.090227.xyz/CloudFlareYes'),
+]
+HEDGE_PERCENTILE = 0.9
+HEDGE_DELAY = 8.0  # 没有耗时记录时的对冲等待（秒）
+# 每个主机的令牌桶：(每秒补充令牌数, 桶容量)，替代逐URL的time.sleep
+HOST_RATE_LIMITS = {'low': (1.0, 1), 'medium': (0.5, 1), 'high': (0.25, 1)}
 
 # -------------------------- 站点列表（将ip.flares.cloud移至high风险，强制浏览器访问） --------------------------
 URLS = {
@@ -67,188 +91,601 @@ SITE_RULES: Dict[str, Dict] = {
     'ip.haogege.xyz': {'tag': 'div', 'attrs': {'id': 'ip-content'}},
     'ipdb.api.030101.xyz': {
         'script_pattern': r'var\s+ips\s*=\s*\[([^\]]+)\]',
-        'ip_clean_pattern': r'"([0-9]+\.[0-9]+\.[0-9]+\.[0-9]+:\d+)"'
+        'ip_clean_pattern': r'"([0-9]+\.[0-9]+\.[0-9]+\.[0-9]+:\d+|\[[0-9A-Fa-f:]+\]:\d+)"'
     },
     'addressesapi.090227.xyz': {'tag': 'pre', 'attrs': {}},
 }
 
 # -------------------------- 工具类 --------------------------
 class AntiBlockTool:
-    def __init__(self):
-        self.ua = UserAgent()
-        self.headers_pool = self._generate_headers_pool(15)
+    """UserAgent在首次取用时才加载，请求头池按需生成（未满时每次新生成一个，满后随机复用）"""
 
-    def _generate_headers_pool(self, count: int) -> List[dict]:
-        headers_list = []
+    def __init__(self, pool_size: int = HEADERS_POOL_SIZE):
+        self.pool_size = pool_size
+        self.headers_pool: List[dict] = []
+        self._ua = None
+        self._lock = threading.RLock()
+
+    @property
+    def ua(self):
+        if self._ua is None:
+            with self._lock:
+                if self._ua is None:
+                    from fake_useragent import UserAgent
+                    self._ua = UserAgent()
+        return self._ua
+
+    def _generate_headers(self) -> dict:
         referers = ["https://www.google.com/", "https://www.baidu.com/"]
-        for _ in range(count):
-            headers = {
-                "User-Agent": self.ua.random,
-                "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
-                "Accept-Language": "zh-CN,zh;q=0.9",
-                "Referer": random.choice(referers),
-                "Connection": "keep-alive",
-            }
-            headers_list.append(headers)
-        return headers_list
+        return {
+            "User-Agent": self.ua.random,
+            "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+            "Accept-Language": "zh-CN,zh;q=0.9",
+            "Referer": random.choice(referers),
+            "Connection": "keep-alive",
+        }
 
     def get_random_headers(self) -> dict:
-        return random.choice(self.headers_pool)
+        with self._lock:
+            if len(self.headers_pool) < self.pool_size:
+                self.headers_pool.append(self._generate_headers())
+                return self.headers_pool[-1]
+            return random.choice(self.headers_pool)
+
+# undetected-chromedriver 每次创建会话都会改写同一个chromedriver可执行文件，并发创建会互相破坏，需串行
+_DRIVER_CREATE_LOCK = threading.Lock()
+
+class BrowserPool:
+    """有界浏览器会话池：每次抓取借出一个会话、用完归还，会话按需创建，出错的会话直接丢弃"""
+
+    def __init__(self, factory, size: int = BROWSER_POOL_SIZE):
+        self.factory = factory
+        self.size = size
+        self._idle: List = []
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._all: List = []
+
+    @contextlib.contextmanager
+    def session(self):
+        self._slots.acquire()
+        driver = None
+        try:
+            with self._lock:
+                driver = self._idle.pop() if self._idle else None
+            if driver is None:
+                driver = self.factory()
+                with self._lock:
+                    self._all.append(driver)
+            yield driver
+        except BaseException:
+            if driver is not None:
+                self._discard(driver)
+                driver = None
+            raise
+        finally:
+            if driver is not None:
+                with self._lock:
+                    self._idle.append(driver)
+            self._slots.release()
+
+    def _discard(self, driver):
+        with self._lock:
+            if driver in self._all:
+                self._all.remove(driver)
+        try:
+            driver.quit()
+        except Exception:
+            pass
 
-    def dynamic_sleep(self, risk_level: str):
-        base = {'low': (0.5, 1.5), 'medium': (1.5, 3), 'high': (3, 5)}[risk_level]
-        sleep_time = random.uniform(*base)
-        logging.info(f"延迟 {sleep_time:.1f} 秒（{risk_level}）")
-        time.sleep(sleep_time)
+    def close(self):
+        with self._lock:
+            drivers, self._all, self._idle = self._all, [], []
+        for driver in drivers:
+            try:
+                driver.quit()
+            except Exception:
+                pass
+
+class _RowCountSettled:
+    """WebDriverWait条件：匹配元素数量大于0且在settle秒内不再变化时返回True"""
+
+    def __init__(self, selector: str, settle: float = TABLE_SETTLE_TIME):
+        self.selector = selector
+        self.settle = settle
+        self.count = -1
+        self.since = time.monotonic()
+
+    def __call__(self, driver) -> bool:
+        from selenium.webdriver.common.by import By
+        count = len(driver.find_elements(By.CSS_SELECTOR, self.selector))
+        now = time.monotonic()
+        if count != self.count:
+            self.count, self.since = count, now
+            return False
+        return count > 0 and now - self.since >= self.settle
 
 class SmartFetcher:
-    def __init__(self, anti_block: AntiBlockTool):
+    """阻塞的单次抓取（直连/浏览器）；重试、间隔与兜底顺序统一由 AsyncFetchEngine 调度"""
+
+    def __init__(self, anti_block: AntiBlockTool, cache: Optional[SourceCache] = None):
         self.anti_block = anti_block
-        self.driver = None
+        self.cache = cache
+        self.browser_pool = BrowserPool(self._create_driver)
+        self.deadline: Optional[float] = None  # time.monotonic() 截止时刻，设置后各类等待都不超过剩余时间
 
-    def fetch(self, url: str, risk_level: str) -> str:
-        if risk_level == 'high':
-            return self._fetch_high_risk(url)
-        else:
-            return self._fetch_low_medium_risk(url, risk_level)
+    def _time_left(self, limit: float) -> float:
+        """min(limit, 距截止的剩余秒数)，至少1秒"""
+        if self.deadline is None:
+            return limit
+        return max(1.0, min(limit, self.deadline - time.monotonic()))
 
-    def _fetch_low_medium_risk(self, url: str, risk_level: str) -> str:
-        for attempt in range(2):
-            try:
-                headers = self.anti_block.get_random_headers()
-                logging.info(f"直连[{attempt+1}/2] {url}")
-                resp = requests.get(
-                    url,
-                    headers=headers,
-                    timeout=BASE_TIMEOUT,
-                    allow_redirects=True,
-                    verify=False
+    def _fetch_direct(self, url: str, attempt: int) -> str:
+        """单次直连请求，成功且页面含IP时返回HTML，否则返回空串；带缓存时发送条件请求"""
+        with METRICS.timer('fetch_direct', source=url):
+            return self._fetch_direct_once(url, attempt)
+
+    def _fetch_direct_once(self, url: str, attempt: int) -> str:
+        import requests
+        try:
+            headers = self.anti_block.get_random_headers()
+            if self.cache:
+                headers = {**headers, **self.cache.conditional_headers(url)}
+            logging.info(f"直连[{attempt+1}/2] {url}")
+            resp = requests.get(
+                url,
+                headers=headers,
+                timeout=self._time_left(BASE_TIMEOUT),
+                allow_redirects=True,
+                verify=False
+            )
+            METRICS.count('bytes', len(resp.content), source=url)
+            if resp.status_code == 304 and self.cache:
+                ips = self.cache.cached_ips(url)
+                if ips is not None:
+                    self.cache.refresh(url)
+                    METRICS.count('not_modified', source=url)
+                    logging.info(f"[{url}] 未修改(304)，复用缓存IP {len(ips)} 个")
+                    return FetchedPage(ips=ips)
+            resp.raise_for_status()
+            if self.cache:
+                ips = self.cache.cached_ips(url, resp.text)
+                if ips is not None:
+                    self.cache.refresh(url)
+                    METRICS.count('unchanged', source=url)
+                    logging.info(f"[{url}] 内容未变，复用缓存IP {len(ips)} 个")
+                    return FetchedPage(resp.text, ips=ips)
+            if IP_PATTERN.search(resp.text):
+                return FetchedPage(
+                    resp.text,
+                    etag=resp.headers.get("ETag"),
+                    last_modified=resp.headers.get("Last-Modified"),
                 )
-                resp.raise_for_status()
-                if IP_PATTERN.search(resp.text):
-                    return resp.text
-                logging.warning(f"页面无IP，重试")
-            except Exception as e:
-                logging.warning(f"直连失败：{e}")
-            self.anti_block.dynamic_sleep(risk_level)
-        return self._fetch_with_browser(url, quick_mode=True)
-
-    def _fetch_high_risk(self, url: str) -> str:
-        # 针对ip.flares.cloud的特殊处理：延长JS渲染等待
+            METRICS.count('empty_pages', source=url)
+            logging.warning(f"页面无IP，重试")
+        except Exception as e:
+            METRICS.count('fetch_errors', source=url)
+            logging.warning(f"直连失败：{e}")
+        return ""
+
+    def _fetch_with_browser(self, url: str, quick_mode: bool = False) -> str:
+        """直连失败后的浏览器兜底（quick_mode缩短渲染等待）"""
+        logging.info(f"直连均失败，改用浏览器：{url}")
+        METRICS.count('browser_fallbacks', source=url)
+        return self._fetch_high_risk(url, quick_mode=quick_mode)
+
+    def _fetch_high_risk(self, url: str, quick_mode: bool = False) -> str:
+        with METRICS.timer('browser', source=url):
+            html = self._fetch_high_risk_once(url, quick_mode)
+        METRICS.count('bytes', len(html), source=url)
+        return html
+
+    def _fetch_high_risk_once(self, url: str, quick_mode: bool) -> str:
+        from selenium.webdriver.support.ui import WebDriverWait
+        from selenium.common.exceptions import TimeoutException
+        # 针对ip.flares.cloud的特殊处理：延长最长等待时间
         is_flares = 'ip.flares.cloud' in url
-        
-        if not self.driver:
-            self.driver = self._create_driver()
-        
         try:
-            logging.info(f"浏览器访问 {url}")
-            self.driver.get(url)
-            # 等待IP表格加载完成（最长20秒）
-            wait_time = 20 if is_flares else 15
-            WebDriverWait(self.driver, wait_time).until(
-                EC.presence_of_element_located((By.CSS_SELECTOR, "div.tabulator-cell[tabulator-field='ip']"))
-            )
-            # 额外等待JS渲染IP（该站点需要更长时间）
-            js_wait = random.uniform(8, 12) if is_flares else random.uniform(5, 8)
-            logging.info(f"等待JS渲染IP：{js_wait:.1f}秒")
-            time.sleep(js_wait)
-            
-            return self.driver.page_source
+            with self.browser_pool.session() as driver:
+                logging.info(f"浏览器访问 {url}")
+                start = time.monotonic()
+                if self.deadline is not None:
+                    driver.set_page_load_timeout(self._time_left(BASE_TIMEOUT * 2))
+                driver.get(url)
+                if quick_mode:
+                    # 兜底模式：普通页面没有IP表格，等待文档加载完成即可
+                    WebDriverWait(driver, self._time_left(BASE_TIMEOUT)).until(
+                        lambda d: d.execute_script("return document.readyState") == "complete"
+                    )
+                else:
+                    # 等待IP表格出现且行数稳定（最长20秒），渲染完成即返回，不再固定休眠
+                    wait_time = self._time_left(20 if is_flares else 15)
+                    settled = _RowCountSettled(IP_TABLE_SELECTOR)
+                    try:
+                        WebDriverWait(driver, wait_time, poll_frequency=TABLE_POLL_INTERVAL).until(settled)
+                    except TimeoutException:
+                        # 超时不代表浏览器异常，会话照常归还到池中
+                        METRICS.count('browser_timeouts', source=url)
+                        logging.error(f"浏览器访问失败：等待IP表格超时（{wait_time:.0f}秒）")
+                        return ""
+                    logging.info(f"IP表格渲染完成：{settled.count} 行，耗时 {time.monotonic() - start:.1f} 秒")
+                return driver.page_source
         except Exception as e:
+            METRICS.count('browser_errors', source=url)
             logging.error(f"浏览器访问失败：{e}")
             return ""
 
-    def _create_driver(self) -> uc.Chrome:
+    def close(self):
+        self.browser_pool.close()
+
+    def _create_driver(self) -> "uc.Chrome":
+        import undetected_chromedriver as uc
         options = uc.ChromeOptions()
         options.add_argument("--disable-blink-features=AutomationControlled")
         options.add_argument("--no-sandbox")
         options.add_argument("--disable-dev-shm-usage")
         options.add_argument(f"user-agent={self.anti_block.ua.random}")
         options.headless = False  # 必须关闭无头模式
-        driver = uc.Chrome(options=options)
+        with _DRIVER_CREATE_LOCK:
+            driver = uc.Chrome(options=options)
         driver.execute_cdp_cmd("Page.addScriptToEvaluateOnNewDocument", {
             "source": "Object.defineProperty(navigator, 'webdriver', { get: () => undefined });"
         })
         return driver
 
-# -------------------------- IP提取（增强ip.flares.cloud提取） --------------------------
+# -------------------------- 异步抓取引擎 --------------------------
+class TokenBucket:
+    """令牌桶限速器：令牌不足时异步等待，不占用线程"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        while True:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+class HostRateLimiter:
+    """按主机分配令牌桶，同一主机的请求按风险等级限速，不同主机互不影响"""
+
+    def __init__(self, limits: Dict[str, tuple] = HOST_RATE_LIMITS):
+        self.limits = limits
+        self.buckets: Dict[str, TokenBucket] = {}
+
+    async def acquire(self, url: str, risk_level: str):
+        host = urlsplit(url).hostname or url
+        bucket = self.buckets.get(host)
+        if bucket is None:
+            bucket = self.buckets[host] = TokenBucket(*self.limits[risk_level])
+        await bucket.acquire()
+
+class AsyncFetchEngine:
+    """
+    所有站点并发抓取；阻塞的requests/浏览器调用放入线程池，礼貌间隔由主机令牌桶控制
+    带站点健康模型时：跳过熔断中的站点、按预期产出速率排序、直接使用上次有效的抓取方式
+    镜像组只调度一个站点，慢于其耗时分位数时向其余镜像发出对冲请求
+    """
+
+    def __init__(self, fetcher: SmartFetcher, limiter: Optional[HostRateLimiter] = None,
+                 health: Optional[SourceHealth] = None, mirror_groups: List[tuple] = MIRROR_GROUPS):
+        self.fetcher = fetcher
+        self.limiter = limiter or HostRateLimiter()
+        self.health = health
+        self.mirror_groups = mirror_groups
+        self.mirrors: Dict[str, List[Tuple[str, str]]] = {}
+
+    def schedule(self, urls: Dict[str, List[str]]) -> List[Tuple[str, str]]:
+        """
+        展开为 (url, risk_level) 任务列表：过滤熔断中的站点，并按预期产出速率排序；
+        同一镜像组只保留排在最前的站点（熔断中的站点已被过滤，由组内其余镜像顶替），其余记入 self.mirrors 作为它的对冲目标
+        """
+        jobs = [(url, risk_level) for risk_level, level_urls in urls.items() for url in level_urls]
+        if self.health is not None:
+            allowed = []
+            for url, risk_level in jobs:
+                if self.health.allow(url):
+                    allowed.append((url, risk_level))
+                else:
+                    METRICS.count('circuit_open', source=url)
+                    logging.info(f"[{url}] 熔断中，本次跳过")
+            jobs = self.health.order(allowed)
+
+        group_of = {url: group for group in self.mirror_groups for url in group}
+        primaries: Dict[tuple, str] = {}
+        self.mirrors = {}
+        scheduled = []
+        for url, risk_level in jobs:
+            group = group_of.get(url)
+            primary = primaries.setdefault(group, url) if group else url
+            if primary == url:
+                scheduled.append((url, risk_level))
+            else:
+                self.mirrors.setdefault(primary, []).append((url, risk_level))
+        return scheduled
+
+    def hedge_delay(self, url: str) -> float:
+        delay = self.health.latency_percentile(url, HEDGE_PERCENTILE) if self.health is not None else None
+        return HEDGE_DELAY if delay is None else delay
+
+    async def fetch_hedged(self, url: str, risk_level: str) -> Tuple[str, str]:
+        """
+        抓取url；若有镜像且超过耗时分位数仍未成功（或已失败），同时向镜像发出对冲请求，先拿到页面者胜出、其余取消；
+        镜像胜出时主站点记一次失败（见 _record_primary_lost）
+        返回 (实际提供页面的URL, 页面)
+        """
+        mirrors = self.mirrors.get(url)
+        if not mirrors:
+            return url, await self.fetch(url, risk_level)
+        tasks = {asyncio.ensure_future(self.fetch(url, risk_level)): url}
+        delay = self.hedge_delay(url)
+        pending = set(tasks)
+        try:
+            done, pending = await asyncio.wait(pending, timeout=delay)
+            for task in done:
+                if task.exception() is None and task.result():
+                    return url, task.result()
+            for mirror, mirror_risk in mirrors:
+                METRICS.count('hedged', source=url)
+                logging.info(f"[{url}] {delay:.1f} 秒内未取得页面，向镜像 {mirror} 发出对冲请求")
+                task = asyncio.ensure_future(self.fetch(mirror, mirror_risk))
+                tasks[task] = mirror
+                pending.add(task)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None and task.result():
+                        if tasks[task] != url:
+                            METRICS.count('hedge_wins', source=url)
+                            self._record_primary_lost(url)
+                        return tasks[task], task.result()
+            return url, ""
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def _record_primary_lost(self, url: str):
+        """
+        镜像胜出时主站点记一次失败：调用方只为实际提供页面的站点记录结果，否则失效的主站点
+        成功率一直为空（预期速率视为无穷大），永远排在镜像之前且不会熔断；
+        记为失败后下次由镜像优先调度，连续失败达到阈值时主站点熔断，schedule 直接改用镜像
+        """
+        if self.health is not None:
+            self.health.record_result(url, 0)
+
+    async def _acquire(self, url: str, risk_level: str):
+        start = time.perf_counter()
+        await self.limiter.acquire(url, risk_level)
+        METRICS.add_time('rate_limit_wait', time.perf_counter() - start, source=url)
+
+    async def fetch(self, url: str, risk_level: str) -> str:
+        start = time.perf_counter()
+        method, html, probed_direct = await self._fetch(url, risk_level)
+        if self.health is not None:
+            self.health.record_fetch(url, method, bool(html), time.perf_counter() - start, probed_direct)
+        return html
+
+    async def _fetch(self, url: str, risk_level: str) -> Tuple[str, str, bool]:
+        """返回 (最终抓取方式, 页面, 是否尝试过直连)"""
+        if risk_level == 'high':
+            await self._acquire(url, risk_level)
+            return 'browser', await asyncio.to_thread(self.fetcher._fetch_high_risk, url), False
+        if self.health is not None and self.health.preferred_method(url) == 'browser':
+            # 上次直连无效、浏览器成功：直接用浏览器，失败时再直连一次
+            METRICS.count('learned_browser', source=url)
+            await self._acquire(url, risk_level)
+            html = await asyncio.to_thread(self.fetcher._fetch_high_risk, url, True)
+            if html:
+                return 'browser', html, False
+            await self._acquire(url, risk_level)
+            return 'direct', await asyncio.to_thread(self.fetcher._fetch_direct, url, 0), True
+        # 直连2次（间隔由主机令牌桶控制），均失败则浏览器兜底
+        for attempt in range(2):
+            await self._acquire(url, risk_level)
+            html = await asyncio.to_thread(self.fetcher._fetch_direct, url, attempt)
+            if html:
+                return 'direct', html, True
+        await self._acquire(url, risk_level)
+        return 'browser', await asyncio.to_thread(self.fetcher._fetch_with_browser, url, True), True
+
+# -------------------------- IP提取（按主机编译的规则引擎） --------------------------
+EXTRACTOR = ExtractionEngine(SITE_RULES)
+
 def extract_ips(html: str, url: str) -> List[str]:
-    if not html:
-        return []
-    
-    domain = url.split("//")[-1].split("/")[0].split(".")[-2]
-    ips = []
-
-    # 重点处理ip.flares.cloud
-    if domain == 'ip.flares.cloud':
-        soup = BeautifulSoup(html, "lxml")
-        # 查找所有IP标签（该网站用表格展示，多个IP标签）
-        ip_tags = soup.find_all('div', {'class': 'tabulator-cell', 'tabulator-field': 'ip'})
-        for tag in ip_tags:
-            ip = tag.get_text().strip()
-            if IP_PATTERN.match(ip):  # 验证是否为有效IP
-                ips.append(ip)
-        logging.info(f"[{url}] 提取到 {len(ips)} 个IP")
-        return ips
-
-    # 其他站点提取逻辑
-    if domain in SITE_RULES:
-        rule = SITE_RULES[domain]
-        if 'script_pattern' in rule:
-            script_match = re.search(rule['script_pattern'], html, re.IGNORECASE | re.DOTALL)
-            if script_match:
-                ips = re.findall(rule['ip_clean_pattern'], script_match.group(1))
-                return ips
-        elif 'tag' in rule:
-            soup = BeautifulSoup(html, "lxml")
-            target_tags = soup.find_all(rule['tag'], attrs=rule['attrs'])
-            if target_tags:
-                for tag in target_tags:
-                    content = tag.get_text().strip()
-                    if IP_PATTERN.match(content):
-                        ips.append(content)
-                return ips
-
-    return IP_PATTERN.findall(html)
+    with METRICS.timer('extract', source=url):
+        result = EXTRACTOR.extract(html, url)
+    if result.rule and not result.matched:
+        METRICS.count('rule_misses', source=url)
+        logging.warning(f"[{url}] 提取规则（{result.rule}）未命中，回退为整页正则")
+    logging.info(f"[{url}] 提取到 {len(result.ips)} 个IP")
+    return result.ips
 
 # -------------------------- 主流程 --------------------------
-def process_url(url: str, risk_level: str, fetcher: SmartFetcher, anti_block: AntiBlockTool) -> Set[str]:
+VALIDATOR = CandidateValidator()
+
+def _clean_ips(raw_ips: List[str], source: Optional[str] = None) -> Set[str]:
+    """
+    丢弃格式/端口非法与保留地址（私有、回环、CGNAT、组播等）并规范化，按来源记录各类丢弃数；
+    CLOUDFLARE_ONLY 在每次校验时读取，运行时修改 collect_ips.CLOUDFLARE_ONLY 即可生效
+    """
+    ips, stats = VALIDATOR.validate(raw_ips, cloudflare_only=CLOUDFLARE_ONLY)
+    for key in ("malformed", "reserved", "non_cloudflare"):
+        if stats[key]:
+            METRICS.count(f"ips_{key}", stats[key], source=source)
+    return ips
+
+def _extract_with_cache(html: str, url: str, cache: Optional[SourceCache]) -> List[str]:
+    """命中缓存时直接复用IP；否则解析页面并写回缓存"""
+    cached = getattr(html, "ips", None)
+    if cached is not None:
+        METRICS.count('ips_extracted', len(cached), source=url)
+        return cached
+    raw_ips = extract_ips(html, url)
+    METRICS.count('ips_extracted', len(raw_ips), source=url)
+    if cache and html:
+        cache.store(url, html, raw_ips, getattr(html, "etag", None), getattr(html, "last_modified", None))
+    return raw_ips
+
+def _validate(raw_ips: List[str], url: str) -> Set[str]:
+    with METRICS.timer('validate', source=url):
+        ips = _clean_ips(raw_ips, url)
+    METRICS.count('ips_kept', len(ips), source=url)
+    logging.info(f"[{url}] 有效IP：{len(ips)} 个")
+    return ips
+
+async def process_source_async(url: str, risk_level: str, engine: AsyncFetchEngine) -> Tuple[str, Set[str]]:
+    """抓取（有镜像时对冲）、提取并校验，返回 (实际提供页面的URL, 有效IP)"""
     ips = set()
+    served = url
+    start = time.perf_counter()
     try:
-        html = fetcher.fetch(url, risk_level)
-        raw_ips = extract_ips(html, url)
-        for ip in raw_ips:
-            ip_clean = ip.split(":")[0]
-            if len(ip_clean.split(".")) == 4 and not ip_clean.startswith(("10.", "192.168.")):
-                ips.add(ip)
-        logging.info(f"[{url}] 有效IP：{len(ips)} 个")
+        served, html = await engine.fetch_hedged(url, risk_level)
+        # 解析可能较慢，放入线程池避免阻塞事件循环
+        raw_ips = await asyncio.to_thread(_extract_with_cache, html, served, engine.fetcher.cache)
+        ips = _validate(raw_ips, served)
     except Exception as e:
+        METRICS.count('errors', source=url)
         logging.error(f"[{url}] 处理失败：{e}")
-    anti_block.dynamic_sleep(risk_level)
-    return ips
+    METRICS.add_time('process_url', time.perf_counter() - start, source=url)
+    if engine.health is not None:
+        engine.health.record_result(served, len(ips))
+    return served, ips
 
-def main():
-    start_time = time.time()
+async def process_url_async(url: str, risk_level: str, engine: AsyncFetchEngine) -> Set[str]:
+    return (await process_source_async(url, risk_level, engine))[1]
+
+def _set_fetch_executor(job_count: int) -> concurrent.futures.ThreadPoolExecutor:
+    """为当前事件循环设置阻塞IO线程池（每个站点最多同时占用直连+解析两个线程）"""
+    loop = asyncio.get_running_loop()
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=min(MAX_WORKERS, job_count * 2 or 1))
+    loop.set_default_executor(executor)
+    return executor
+
+def _abandon_fetch_executor(executor: concurrent.futures.ThreadPoolExecutor):
+    """
+    截止时仍有阻塞调用未返回：换上空闲线程池，使 asyncio.run 退出时不再等待这些线程；
+    旧线程池不再接收任务，其线程在各自的超时（已按截止时间收紧）后自行结束
+    """
+    asyncio.get_running_loop().set_default_executor(concurrent.futures.ThreadPoolExecutor(max_workers=1))
+    executor.shutdown(wait=False, cancel_futures=True)
+
+async def run_with_deadline(engine: AsyncFetchEngine, jobs: List[Tuple[str, str]], worker,
+                            deadline: Optional[float] = None) -> Dict[str, object]:
+    """
+    并发运行 worker(url, risk_level) 协程：每个站点不超过 SOURCE_BUDGETS 中的预算与全局剩余时间，
+    deadline（time.monotonic()时刻）到达时取消未完成的站点，返回已完成站点的 {url: 结果}
+    """
+    executor = _set_fetch_executor(len(jobs))
+    engine.fetcher.deadline = deadline
+    tasks = {}
+    for url, risk_level in jobs:
+        budget = SOURCE_BUDGETS[risk_level]
+        if deadline is not None:
+            budget = max(0.0, min(budget, deadline - time.monotonic()))
+        tasks[asyncio.ensure_future(asyncio.wait_for(worker(url, risk_level), budget))] = url
+    if not tasks:
+        return {}
+
+    timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+    done, pending = await asyncio.wait(tasks, timeout=timeout)
+    for task in pending:
+        task.cancel()
+        METRICS.count('deadline_missed', source=tasks[task])
+        logging.warning(f"[{tasks[task]}] 到达全局截止时间仍未完成，放弃该站点")
+
+    results = {}
+    stragglers = bool(pending)
+    for task in done:
+        url = tasks[task]
+        try:
+            results[url] = task.result()
+        except asyncio.TimeoutError:
+            stragglers = True
+            METRICS.count('budget_exceeded', source=url)
+            logging.warning(f"[{url}] 超出时间预算，放弃该站点")
+            if engine.health is not None:
+                engine.health.record_result(url, 0)
+        except Exception as e:
+            METRICS.count('errors', source=url)
+            logging.error(f"[{url}] 处理失败：{e}")
+    if stragglers:
+        _abandon_fetch_executor(executor)
+    return results
+
+async def collect_by_source(engine: AsyncFetchEngine, urls: Dict[str, List[str]] = URLS,
+                            deadline: Optional[float] = None) -> Dict[str, Set[str]]:
+    """
+    所有风险等级的站点同时抓取，总耗时约等于最慢的单个站点（且不超过deadline）；
+    返回 {实际提供页面的站点URL: IP集合}（不含熔断跳过、超时放弃的站点）
+    """
+    jobs = engine.schedule(urls)
+    logging.info(f"=== 并发处理 {len(jobs)} 个站点 ===")
+    results = await run_with_deadline(
+        engine, jobs, lambda url, risk_level: process_source_async(url, risk_level, engine), deadline,
+    )
+    ips_by_source: Dict[str, Set[str]] = {}
+    for served, ips in results.values():
+        ips_by_source.setdefault(served, set()).update(ips)
+    return ips_by_source
+
+def build_engine() -> AsyncFetchEngine:
+    """
+    按默认配置组装抓取引擎（带条件请求缓存与站点健康模型）；
+    用完需调用 engine.fetcher.close()、engine.fetcher.cache.save() 与 engine.health.save()
+    """
     anti_block = AntiBlockTool()
-    fetcher = SmartFetcher(anti_block)
-    all_ips: Set[str] = set()
-
-    logging.info("=== 处理低风险站点（并行） ===")
-    with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        futures = [executor.submit(process_url, url, 'low', fetcher, anti_block) for url in URLS['low']]
-        for future in concurrent.futures.as_completed(futures):
-            all_ips.update(future.result())
-
-    for risk_level in ['medium', 'high']:
-        logging.info(f"\n=== 处理{risk_level}风险站点 ===")
-        for url in URLS[risk_level]:
-            ips = process_url(url, risk_level, fetcher, anti_block)
-            all_ips.update(ips)
-
-    sorted_ips = sorted(all_ips, key=lambda x: tuple(map(int, x.split(":")[0].split("."))))
-    with open(OUTPUT_FILE, "w", encoding="utf8") as f:
+    fetcher = SmartFetcher(anti_block, cache=SourceCache())
+    return AsyncFetchEngine(fetcher, health=SourceHealth())
+
+def write_collection_outputs(store: IPStore, ips_by_source: Dict[str, Set[str]]) -> List[str]:
+    """入库并写出 ip.txt / ip.bin / ip_delta.txt，返回排序后的有效IP"""
+    # ip.txt 输出库中仍有效的IP；没有产出IP的站点视为未抓取，它的IP保留（见 IPStore.record_run）
+    delta = store.record_run(ips_by_source, fetched=[source for source, ips in ips_by_source.items() if ips])
+    ipset = PackedIPSet(store.active_ips())
+    sorted_ips = ipset.to_strings()
+    METRICS.count('ips_added', len(delta.added))
+    METRICS.count('ips_removed', len(delta.removed))
+    # 原子替换写出：serve.py 与下游任务不会读到写了一半的文件
+    with atomic_open(OUTPUT_FILE) as f:
         f.write("\n".join(sorted_ips))
-    logging.info(f"总IP数：{len(sorted_ips)}，保存至 {os.path.abspath(OUTPUT_FILE)}")
+    ipset.write_binary(BINARY_OUTPUT_FILE)
+    with atomic_open(DELTA_FILE) as f:
+        f.write("\n".join([f"+{ip}" for ip in delta.added] + [f"-{ip}" for ip in delta.removed]))
+    logging.info(f"总IP数：{len(sorted_ips)}（新增 {len(delta.added)}，移除 {len(delta.removed)}），保存至 {os.path.abspath(OUTPUT_FILE)}")
+    return sorted_ips
+
+def main(run_deadline: float = RUN_DEADLINE):
+    start_time = time.time()
+    deadline = time.monotonic() + run_deadline
+    engine = build_engine()
+    try:
+        with METRICS.timer('collect'):
+            ips_by_source = asyncio.run(collect_by_source(engine, deadline=deadline))
+    finally:
+        engine.fetcher.close()
+    engine.fetcher.cache.save()
+    engine.health.save()
+
+    with IPStore() as store, METRICS.timer('output'):
+        sorted_ips = write_collection_outputs(store, ips_by_source)
+    logging.info(f"采集耗时 {time.time() - start_time:.1f} 秒")
+
+    if PROBE_ENABLED and sorted_ips:
+        logging.info("=== 候选IP测速 ===")
+        with METRICS.timer('probe'):
+            probe_and_write(sorted_ips)
+    METRICS.write_report(command="collect_ips", total_ips=len(sorted_ips))
 
 if __name__ == "__main__":
-    main()
+    with profiled():
+        main()
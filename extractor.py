@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+按主机编译的IP提取引擎：
+- 规则在加载时编译一次，按真实主机名（urlsplit().hostname）索引
+- 纯文本源直接走正则快速路径，不构建DOM
+- 标签规则用流式HTMLParser只解析目标元素所在的片段，到最后一个IP之后即停止
+- 每次提取都返回规则是否命中，便于发现失效规则
+"""
+
+import re
+import threading
+from html.parser import HTMLParser
+from typing import Dict, List, NamedTuple, Optional
+from urllib.parse import urlsplit
+
+IPV4_PATTERN = r'\b(?:[0-9]{1,3}\.){3}[0-9]{1,3}\b'
+# IPv6：完整8段，或含"::"的压缩形式（不匹配时间戳之类只有单个冒号分隔的数字）；合法性由 ip_validate 校验
+# 还要求地址中至少有一个十进制数字、且其后不紧跟字母数字：排除 a::before、.dead:beef::after 这类CSS伪元素与
+# 纯字母的"十六进制单词"（可用的全球单播地址首段为2xxx/3xxx，必含数字）
+IPV6_PATTERN = (
+    r'\b(?=[0-9A-Fa-f]{1,4}:[0-9A-Fa-f:])(?<!:)'  # 先用零宽断言排除不可能的起点，整页扫描的额外开销约两成
+    r'(?=[0-9A-Fa-f:]*[0-9])'
+    r'(?:(?:[0-9A-Fa-f]{1,4}:){7}[0-9A-Fa-f]{1,4}'
+    r'|(?:[0-9A-Fa-f]{1,4}:){1,6}:[0-9A-Fa-f]{1,4}(?::[0-9A-Fa-f]{1,4}){0,5}'
+    r'|(?:[0-9A-Fa-f]{1,4}:){2,6}:)(?![\w:])'
+)
+# 候选可带端口（1.2.3.4:443、[2606:4700::1]:443），端口原样保留，由 ip_validate 校验
+PORT_SUFFIX = r':[0-9]{1,5}\b'
+IP_PATTERN = re.compile(f'{IPV4_PATTERN}(?:{PORT_SUFFIX})?|{IPV6_PATTERN}')
+# 方括号IPv6的端口在匹配后补上：正则里多一个以"["开头的分支会让整页扫描慢约六成
+_BRACKET_PORT = re.compile(f'\\]{PORT_SUFFIX}')
+PLAIN_TEXT_PROBE = 512  # 检查前多少个字符判断是否为纯文本响应
+
+def find_ips(text: str) -> List[str]:
+    """文本中的全部候选（与 IP_PATTERN.findall 相同，另把 [IPv6]:端口 还原为带端口的形式）"""
+    if '[' not in text:
+        return IP_PATTERN.findall(text)
+    ips = []
+    for match in IP_PATTERN.finditer(text):
+        ip = match.group()
+        start, end = match.span()
+        if start and text[start - 1] == '[' and '.' not in ip:
+            port = _BRACKET_PORT.match(text, end)
+            if port:
+                ip = f"[{ip}{port.group()}"
+        ips.append(ip)
+    return ips
+
+class ExtractResult(NamedTuple):
+    ips: List[str]
+    host: str
+    rule: Optional[str]   # 'script' / 'tag' / 'text'，无规则时为None
+    matched: bool         # 规则是否命中（未命中时回退为整页正则）
+
+class _TargetCollector(HTMLParser):
+    """流式收集目标元素内的文本；class按空格拆分后包含即匹配（与BeautifulSoup一致），其余属性精确匹配"""
+
+    def __init__(self, tag: str, attrs: Dict[str, str]):
+        super().__init__(convert_charrefs=True)
+        self.tag = tag
+        self.want_classes = set(attrs.get('class', '').split())
+        self.want_attrs = {k: v for k, v in attrs.items() if k != 'class'}
+        self.depth = 0          # 当前位于目标元素内的嵌套层数
+        self.current: List[str] = []
+        self.texts: List[str] = []
+
+    def _is_target(self, attrs) -> bool:
+        attr_map = dict(attrs)
+        if self.want_classes and not self.want_classes <= set((attr_map.get('class') or '').split()):
+            return False
+        return all(attr_map.get(k) == v for k, v in self.want_attrs.items())
+
+    def handle_starttag(self, tag, attrs):
+        if tag != self.tag:
+            return
+        if self.depth:
+            self.depth += 1
+        elif self._is_target(attrs):
+            self.depth = 1
+            self.current = []
+
+    def handle_endtag(self, tag):
+        if tag != self.tag or not self.depth:
+            return
+        self.depth -= 1
+        if not self.depth:
+            self.texts.append(''.join(self.current))
+
+    def handle_data(self, data):
+        if self.depth:
+            self.current.append(data)
+
+    def finish(self) -> List[str]:
+        # 片段在目标元素内部被截断时，保留已收集的文本
+        if self.depth:
+            self.texts.append(''.join(self.current))
+            self.depth = 0
+        return self.texts
+
+def _open_tag_pattern(tag: str, attrs: Dict[str, str]) -> "re.Pattern":
+    """
+    目标元素开始标签的正则：标签名之外还要求规则中的属性（class按空格分隔的词、其余属性按值）出现在同一个标签内，
+    使部分解析从目标元素开始，而不是从页面中第一个同名标签开始；最终是否命中仍由 _TargetCollector 判断
+    """
+    pattern = r'<' + re.escape(tag) + r'(?=[\s>/])'
+    for name, value in attrs.items():
+        if name == 'class':
+            for cls in value.split():
+                pattern += (r'(?=[^>]*?\sclass\s*=\s*["\']?(?:[^"\'>]*\s)?'
+                            + re.escape(cls) + r'(?=[\s"\'>]))')
+        else:
+            pattern += (r'(?=[^>]*?\s' + re.escape(name) + r'\s*=\s*["\']?'
+                        + re.escape(value) + r'(?=[\s"\'/>]))')
+    return re.compile(pattern, re.IGNORECASE)
+
+class CompiledRule:
+    def __init__(self, host: str, spec: Dict):
+        self.host = host
+        if 'script_pattern' in spec:
+            self.kind = 'script'
+            self.script_re = re.compile(spec['script_pattern'], re.IGNORECASE | re.DOTALL)
+            self.clean_re = re.compile(spec['ip_clean_pattern'])
+        elif spec.get('plain'):
+            self.kind = 'text'
+        elif 'tag' in spec:
+            self.kind = 'tag'
+            self.tag = spec['tag'].lower()
+            self.attrs = dict(spec.get('attrs') or {})
+            self.open_re = _open_tag_pattern(self.tag, self.attrs)
+        else:
+            raise ValueError(f"无法识别的提取规则：{host} -> {spec}")
+
+    def apply(self, html: str) -> Optional[List[str]]:
+        """返回提取到的IP；规则未命中返回None"""
+        if self.kind == 'script':
+            match = self.script_re.search(html)
+            return self.clean_re.findall(match.group(1)) if match else None
+        if self.kind == 'text':
+            return find_ips(html)
+        return self._apply_tag(html)
+
+    def _apply_tag(self, html: str) -> Optional[List[str]]:
+        # 只解析从第一个目标元素到最后一个IP之后的片段，跳过head/脚本/导航/页脚
+        first_open = self.open_re.search(html)
+        if not first_open:
+            return None
+        last_ip_end = None
+        for last_ip_end in IP_PATTERN.finditer(html, first_open.start()):
+            pass
+        if last_ip_end is None:
+            return None
+        next_tag = html.find('<', last_ip_end.end())
+        end = html.find('>', next_tag) if next_tag >= 0 else -1
+        end = len(html) if end < 0 else end + 1
+        collector = _TargetCollector(self.tag, self.attrs)
+        collector.feed(html[first_open.start():end])
+        texts = collector.finish()
+        if not texts:
+            return None
+        ips: List[str] = []
+        for text in texts:
+            ips.extend(find_ips(text))
+        return ips
+
+class ExtractionEngine:
+    def __init__(self, site_rules: Dict[str, Dict]):
+        self.rules = {host.lower(): CompiledRule(host.lower(), spec) for host, spec in site_rules.items()}
+        self.stats: Dict[str, Dict[str, int]] = {}  # 主机 -> {'matched': 次数, 'missed': 次数}
+        self._lock = threading.Lock()
+
+    def rule_for(self, url: str) -> Optional[CompiledRule]:
+        host = (urlsplit(url).hostname or '').lower()
+        return self.rules.get(host)
+
+    def extract(self, html: str, url: str) -> ExtractResult:
+        host = (urlsplit(url).hostname or '').lower()
+        if not html:
+            return ExtractResult([], host, None, False)
+        rule = self.rules.get(host)
+        if rule is None:
+            return ExtractResult(find_ips(html), host, None, False)
+        kind = rule.kind
+        if kind == 'tag' and '<' not in html[:PLAIN_TEXT_PROBE]:
+            # 纯文本响应（如API直接返回IP列表）：跳过HTML解析
+            kind = 'text'
+            ips = find_ips(html)
+        else:
+            ips = rule.apply(html)
+        matched = ips is not None
+        self._record(host, matched)
+        if not matched:
+            ips = find_ips(html)
+        return ExtractResult(ips, host, kind, matched)
+
+    def _record(self, host: str, matched: bool):
+        with self._lock:
+            per_host = self.stats.setdefault(host, {'matched': 0, 'missed': 0})
+            per_host['matched' if matched else 'missed'] += 1
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+上游IP源的条件请求缓存：按URL持久化 ETag / Last-Modified / 内容哈希及已提取的IP，
+命中（304或内容未变）时直接复用IP，跳过下载与BeautifulSoup解析
+"""
+
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from typing import Dict, List, Optional
+
+from atomic_io import write_json
+
+CACHE_FILE = os.path.join(".cache", "source_cache.json")
+MAX_ENTRIES = 256           # 最多缓存的URL数，超出时按最近使用时间淘汰
+MAX_AGE = 3 * 24 * 3600     # 超过该时长（秒）未更新的条目直接淘汰
+
+class FetchedPage(str):
+    """
+    抓取结果：字符串内容即HTML，附带缓存校验信息
+    ips 不为 None 表示命中缓存（304或内容未变），可直接复用、无需再解析；
+    304响应没有正文，但命中缓存时仍视为真值，避免被当作抓取失败重试
+    """
+
+    def __new__(cls, html: str = "", etag: Optional[str] = None,
+                last_modified: Optional[str] = None, ips: Optional[List[str]] = None):
+        page = super().__new__(cls, html)
+        page.etag = etag
+        page.last_modified = last_modified
+        page.ips = ips
+        return page
+
+    def __bool__(self):
+        return self.ips is not None or len(self) > 0
+
+def content_hash(html: str) -> str:
+    return hashlib.sha256(html.encode("utf-8", "replace")).hexdigest()
+
+class SourceCache:
+    """按URL缓存的抓取结果（JSON落盘，线程安全）"""
+
+    def __init__(self, path: str = CACHE_FILE, max_entries: int = MAX_ENTRIES, max_age: float = MAX_AGE):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.entries: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.warning(f"缓存文件损坏，已忽略：{e}")
+            self.entries = {}
+        self.evict()
+
+    def save(self):
+        with self._lock:
+            self._evict_locked()
+            write_json(self.path, self.entries)
+
+    def evict(self):
+        with self._lock:
+            self._evict_locked()
+
+    def _evict_locked(self):
+        now = time.time()
+        expired = [url for url, entry in self.entries.items() if now - entry["stored_at"] > self.max_age]
+        for url in expired:
+            del self.entries[url]
+        if len(self.entries) > self.max_entries:
+            by_use = sorted(self.entries, key=lambda url: self.entries[url]["used_at"])
+            for url in by_use[:len(self.entries) - self.max_entries]:
+                del self.entries[url]
+
+    def conditional_headers(self, url: str) -> Dict[str, str]:
+        """生成条件请求头（If-None-Match / If-Modified-Since）"""
+        with self._lock:
+            entry = self.entries.get(url)
+        headers = {}
+        if entry:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def cached_ips(self, url: str, html: Optional[str] = None) -> Optional[List[str]]:
+        """返回可复用的IP：html为None表示304，否则要求内容哈希一致"""
+        with self._lock:
+            entry = self.entries.get(url)
+            if entry is None or (html is not None and entry["hash"] != content_hash(html)):
+                return None
+            entry["used_at"] = time.time()
+            return list(entry["ips"])
+
+    def store(self, url: str, html: str, ips: List[str],
+              etag: Optional[str] = None, last_modified: Optional[str] = None):
+        now = time.time()
+        with self._lock:
+            self.entries[url] = {
+                "etag": etag,
+                "last_modified": last_modified,
+                "hash": content_hash(html),
+                "ips": list(ips),
+                "stored_at": now,
+                "used_at": now,
+            }
+
+    def refresh(self, url: str):
+        """304或内容未变时刷新条目的存活时间"""
+        with self._lock:
+            entry = self.entries.get(url)
+            if entry is not None:
+                entry["stored_at"] = entry["used_at"] = time.time()
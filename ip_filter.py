@@ -1,187 +1,507 @@
 import os
+import sys
+import bisect
+import heapq
+import mmap
+import hashlib
+import contextlib
+import concurrent.futures
+from array import array
+from collections import OrderedDict
 
-def is_hong_kong_ip(ip_str):
-    """判断是否为香港IP（含新增IP段，覆盖更多运营商/IDC）"""
-    octets = list(map(int, ip_str.split('.')))
+from atomic_io import atomic_open
+from ip_store import IPStore, STORE_FILE
+from ipset import endpoint_sort_key
+from metrics import METRICS
+from prefix_trie import PrefixTrie, parse_ip, parse_network
+
+try:
+    import numpy as np
+except ImportError:  # NumPy为可选依赖，未安装时使用纯Python逐行筛选
+    np = None
+
+_POW10 = np.array([1, 10, 100, 1000], dtype=np.uint16) if np is not None else None
+
+class FilterError(Exception):
+    """筛选失败（输入缺失、地区IP段加载失败、读写文件失败等）"""
+
+REGION_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "region_ranges.txt")
+FILTER_REPORT_FILE = "filter_report.json"  # 筛选任务的JSON运行报告（格式见 metrics.py）
+CHUNK_SIZE = 1024 * 1024  # NumPy解析与流式筛选的分块大小（字节）；NumPy解析时每块约占用其十余倍的临时内存
+MERGE_BLOCK = 65536  # 写出结果时每次扫描的标记表位数
+CLASSIFY_BLOCK = 1 << 20  # NumPy批量分类时每次searchsorted的IP数
+# 全量筛选时输入文件超过该大小即改用流式多进程筛选：全量路径峰值内存实测约为输入的15倍（纯Python）/ 4倍（NumPy分块），
+# 按最坏情况取32MB，使全量筛选不超过约0.5GB；流式筛选的内存与输入大小无关
+STREAMING_MIN_BYTES = 32 * 1024 * 1024
+PREFIX_CACHE_MAX = 65536  # /24分类缓存（见 PrefixCache）最多缓存的网段数
+_MIXED = '*'  # 网段内存在地区边界
+_ABSENT = object()
+
+def ip_to_int(ip_str):
+    """将点分十进制IPv4转为32位整数，格式非法时返回None"""
+    try:
+        parts = ip_str.split('.')
+    except AttributeError:
+        return None
+    if len(parts) != 4 or not ip_str.isascii() or not all(p.isdigit() and len(p) <= 3 for p in parts):
+        return None
+    octets = list(map(int, parts))
+    if not all(o <= 255 for o in octets):
+        return None
     o1, o2, o3, o4 = octets
-    
-    # 香港IP段汇总（原有+新增，标注来源便于维护）
-    hk_ranges = [
-        # 原有核心段（腾讯云、阿里云、本地运营商）
-        (152, 70, 0, 255),    # 腾讯云香港：152.70.0.0/24及周边
-        (47, 245, 0, 255),    # 腾讯云香港：47.245.0.0/24及周边
-        (47, 57, 128, 255),   # 阿里云香港：47.57.128.0/17
-        (47, 74, 128, 255),   # 阿里云香港：47.74.128.0/17
-        (203, 118, 0, 255),   # 香港电讯盈科：203.118.0.0/16
-        (202, 175, 0, 255),   # 香港和记电讯：202.175.0.0/16
-        (58, 18, 0, 255),     # 香港宽频：58.18.0.0/16
-        (103, 20, 0, 255),    # 香港IDC：103.20.0.0/16
-        (119, 93, 0, 255),    # 香港新世界电讯：119.93.0.0/16
-        
-        # 新增IP段（用户提供+补充验证）
-        (118, 143, 0, 255),   # 香港亚太环通：118.143.0.0/16
-        (203, 198, 0, 255),   # 香港数码通：203.198.0.0/16
-        (103, 52, 74, 75),    # 香港阿里云：103.52.74.0/23（74-75段）
-        (59, 148, 0, 3),      # 香港电讯：59.148.0.0/22（0-3段）
-        (59, 149, 0, 255),    # 香港电讯：59.149.0.0/16
-        (59, 150, 0, 255),    # 香港电讯：59.150.0.0/16
-        (59, 151, 0, 255),    # 香港电讯：59.151.0.0/16
-        (183, 83, 0, 255),    # 香港移动：183.83.0.0/16
-        (27, 124, 0, 255),    # 香港联通国际：27.124.0.0/16
-    ]
-    
-    for (r1, r2, r3_min, r3_max) in hk_ranges:
-        if o1 == r1 and o2 == r2 and r3_min <= o3 <= r3_max:
-            return True
-    return False
+    return (o1 << 24) | (o2 << 16) | (o3 << 8) | o4
+
+def int_to_ip(ip_int):
+    """将32位整数转回点分十进制IPv4"""
+    ip_int = int(ip_int)
+    return f"{ip_int >> 24}.{(ip_int >> 16) & 0xFF}.{(ip_int >> 8) & 0xFF}.{ip_int & 0xFF}"
+
+def parse_cidr(cidr):
+    """将CIDR（如 47.57.128.0/17）解析为 (起始整数, 结束整数)"""
+    network, _, prefix = cidr.partition('/')
+    start = ip_to_int(network)
+    prefix = int(prefix) if prefix else 32
+    if start is None or not 0 <= prefix <= 32:
+        raise ValueError(f"非法网段：{cidr}")
+    size = 1 << (32 - prefix)
+    start &= ~(size - 1) & 0xFFFFFFFF
+    return start, start + size - 1
+
+class RegionIndex:
+    """
+    地区IP段索引：一次性加载为有序、互不重叠的整数区间
+    IPv4区间保存在 starts/ends/labels 中，供逐IP二分查找、/24分类缓存与NumPy批量分类使用；
+    IPv4与IPv6区间同时装入前缀树 trie，按字符串/地址族查找（lookup / lookup_addr）时使用
+    """
+
+    def __init__(self, ranges, regions=None, ranges_v6=()):
+        """
+        ranges: IPv4 (起始整数, 结束整数, 地区) 序列，重叠部分归优先级高的地区
+        regions: 地区优先级顺序（默认按ranges、ranges_v6中首次出现的顺序）
+        ranges_v6: IPv6 (起始整数, 结束整数, 地区) 序列
+        """
+        ranges = list(ranges)
+        ranges_v6 = list(ranges_v6)
+        if regions is None:
+            regions = list(dict.fromkeys(label for _, _, label in ranges + ranges_v6))
+        self.regions = tuple(regions)
+        priority = {label: i for i, label in enumerate(self.regions)}
+
+        self.starts = array('I')
+        self.ends = array('I')
+        self.labels = []
+        for start, end, label in self._flatten(ranges, priority):
+            # 相邻且同地区的区间合并，减少查找表长度
+            if self.labels and self.labels[-1] == label and self.ends[-1] + 1 == start:
+                self.ends[-1] = end
+                continue
+            self.starts.append(start)
+            self.ends.append(end)
+            self.labels.append(label)
+
+        # 拍平后的区间互不重叠，拆成CIDR块装入前缀树，最长前缀匹配即等价于按优先级归属
+        self.trie = PrefixTrie()
+        for start, end, label in zip(self.starts, self.ends, self.labels):
+            self.trie.add_range(4, start, end, label)
+        self.ipv6_ranges = 0
+        for start, end, label in self._flatten(ranges_v6, priority):
+            self.trie.add_range(6, start, end, label)
+            self.ipv6_ranges += 1
+
+    @staticmethod
+    def _flatten(ranges, priority):
+        """扫描线拆分重叠区间，每一段取覆盖它的最高优先级地区"""
+        bounds = sorted({b for start, end, _ in ranges for b in (start, end + 1)})
+        by_start = sorted(ranges, key=lambda r: r[0])
+        active = []  # 小顶堆：(优先级, 结束, 地区)
+        pos = 0
+        for left, right in zip(bounds, bounds[1:]):
+            while pos < len(by_start) and by_start[pos][0] <= left:
+                start, end, label = by_start[pos]
+                heapq.heappush(active, (priority[label], end, label))
+                pos += 1
+            while active and active[0][1] < left:
+                heapq.heappop(active)
+            if active:
+                yield left, right - 1, active[0][2]
+
+    @classmethod
+    def from_file(cls, path=REGION_FILE):
+        """从数据文件加载（每行：CIDR 地区，#之后为注释；CIDR可以是IPv4或IPv6）"""
+        ranges = {4: [], 6: []}
+        with open(path, 'r', encoding='utf-8') as f:
+            for lineno, line in enumerate(f, 1):
+                line = line.split('#', 1)[0].strip()
+                if not line:
+                    continue
+                fields = line.split()
+                if len(fields) != 2:
+                    raise ValueError(f"{path}:{lineno} 格式错误，应为“CIDR 地区”")
+                try:
+                    version, network, prefix_len = parse_network(fields[0])
+                except ValueError:
+                    raise ValueError(f"{path}:{lineno} 非法网段：{fields[0]}") from None
+                size = 1 << ((32 if version == 4 else 128) - prefix_len)
+                ranges[version].append((network, network + size - 1, fields[1]))
+        return cls(ranges[4], ranges_v6=ranges[6])
+
+    def __len__(self):
+        return len(self.starts) + self.ipv6_ranges
+
+    @property
+    def has_ipv6(self):
+        return self.ipv6_ranges > 0
+
+    def lookup_int(self, ip_int):
+        """按整数IP查找所属地区，未命中返回None"""
+        i = bisect.bisect_right(self.starts, ip_int) - 1
+        if i >= 0 and ip_int <= self.ends[i]:
+            return self.labels[i]
+        return None
+
+    def lookup_addr(self, version, addr):
+        """按 (地址族, 整数地址) 经前缀树查找所属地区，未命中返回None"""
+        return self.trie.lookup(version, addr)
+
+    def lookup(self, ip_str):
+        """按IP字符串（IPv4或IPv6）查找所属地区，非法IP或未命中返回None"""
+        return self.trie.lookup_ip(ip_str)
+
+def region_version(path=REGION_FILE):
+    """地区IP段文件的内容摘要，文件变化时增量筛选需要全量重算"""
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()[:16]
+
+_default_index = None
+
+def get_default_index():
+    """获取默认地区索引（首次调用时从 region_ranges.txt 加载）"""
+    global _default_index
+    if _default_index is None:
+        _default_index = RegionIndex.from_file()
+    return _default_index
+
+class PrefixCache:
+    """
+    以/24网段为键的地区分类缓存（只在本次运行内有效）：整段同属一个地区（或整段都不在目标IP段内）时缓存该结果，
+    段内存在地区边界时记为“混合”，查询时退回逐IP二分查找；超过 max_entries 时淘汰最久未用的网段
+    """
+
+    def __init__(self, index, max_entries=PREFIX_CACHE_MAX):
+        self.index = index
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # 网段(ip >> 8) -> 地区 / None / _MIXED，按最近使用排序
+        self.hits = self.misses = 0
+
+    def _classify_prefix(self, prefix):
+        index = self.index
+        low, high = prefix << 8, (prefix << 8) | 0xFF
+        i = bisect.bisect_right(index.starts, low) - 1
+        if bisect.bisect_right(index.starts, high) - 1 != i:
+            return _MIXED  # 段内有区间起点
+        if i < 0 or index.ends[i] < low:
+            return None
+        return index.labels[i] if index.ends[i] >= high else _MIXED
+
+    def lookup_int(self, ip_int):
+        """与 RegionIndex.lookup_int 相同的语义"""
+        prefix = ip_int >> 8
+        region = self.entries.get(prefix, _ABSENT)
+        if region is not _ABSENT:
+            self.hits += 1
+            self.entries.move_to_end(prefix)
+        else:
+            self.misses += 1
+            region = self.entries[prefix] = self._classify_prefix(prefix)
+            if len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return self.index.lookup_int(ip_int) if region == _MIXED else region
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self.entries),
+        }
+
+    def report(self, log=print):
+        """输出命中率（log默认为print）并计入运行报告"""
+        stats = self.stats()
+        METRICS.count('prefix_cache_hits', stats["hits"])
+        METRICS.count('prefix_cache_misses', stats["misses"])
+        log(f"/24分类缓存：命中率 {stats['hit_rate']:.1%}（命中 {stats['hits']}，未命中 {stats['misses']}，"
+            f"缓存网段 {stats['entries']} 个）")
+        return stats
+
+def open_prefix_cache(index=None):
+    """按默认地区索引创建分类缓存"""
+    return PrefixCache(index or get_default_index())
+
+def classify_ip(ip_str, cache):
+    """单个候选的地区：IPv4经/24分类缓存，IPv6查前缀树；非法（或带端口的条目）返回None"""
+    ip_int = ip_to_int(ip_str)
+    if ip_int is not None:
+        return cache.lookup_int(ip_int)
+    return cache.index.lookup(ip_str) if ':' in ip_str else None
+
+def is_hong_kong_ip(ip_str):
+    """判断是否为香港IP"""
+    return get_default_index().lookup(ip_str) == '香港'
 
 def is_japan_ip(ip_str):
-    """判断是否为日本IP（含新增IP段，覆盖东京/大阪/名古屋节点）"""
-    octets = list(map(int, ip_str.split('.')))
-    o1, o2, o3, o4 = octets
-    
-    # 日本IP段汇总（原有+新增，避免过宽范围误判）
-    japan_ranges = [
-        # 原有核心段（AWS、阿里云、软银）
-        (52, 192, 0, 255),    # AWS东京：52.192.0.0/16
-        (54, 238, 0, 255),    # AWS东京：54.238.0.0/16
-        (47, 92, 0, 255),     # 阿里云东京：47.92.0.0/16
-        (47, 251, 0, 255),    # 阿里云东京：47.251.0.0/16
-        (202, 21, 0, 255),    # 日本软银：202.21.0.0/16
-        (202, 248, 0, 255),   # 日本NTT：202.248.0.0/16
-        (104, 193, 0, 255),   # 日本KDDI：104.193.0.0/16
-        (133, 18, 0, 255),    # 日本乐天：133.18.0.0/16
-        
-        # 新增IP段（用户提供+精准拆分，避免/8过宽）
-        (43, 0, 0, 255),      # 日本NTT：43.0.0.0/16（拆分/8为多个/16，减少误判）
-        (43, 1, 0, 255),      # 日本NTT：43.1.0.0/16
-        (43, 2, 0, 255),      # 日本NTT：43.2.0.0/16
-        (43, 3, 0, 255),      # 日本NTT：43.3.0.0/16
-        (106, 0, 0, 255),     # 日本KDDI：106.0.0.0/16
-        (106, 1, 0, 255),     # 日本KDDI：106.1.0.0/16
-        (180, 87, 0, 255),    # 日本软银：180.87.0.0/16（拆分/8，避免含其他地区）
-        (180, 88, 0, 255),    # 日本软银：180.88.0.0/16
-        (59, 106, 0, 255),    # 日本乐天：59.106.0.0/16（拆分/8）
-        (59, 107, 0, 255),    # 日本乐天：59.107.0.0/16
-        (153, 120, 0, 255),   # 日本NTT：153.120.0.0/16（拆分/8）
-        (153, 121, 0, 255),   # 日本NTT：153.121.0.0/16
-        (210, 152, 0, 255),   # 日本电信：210.152.0.0/16
-        (210, 153, 0, 255),   # 日本电信：210.153.0.0/16
-    ]
-    
-    for (r1, r2, r3_min, r3_max) in japan_ranges:
-        if o1 == r1 and o2 == r2 and r3_min <= o3 <= r3_max:
-            return True
-    return False
+    """判断是否为日本IP"""
+    return get_default_index().lookup(ip_str) == '日本'
 
 def is_singapore_ip(ip_str):
-    """判断是否为新加坡IP（含新增IP段，覆盖主流IDC节点）"""
-    octets = list(map(int, ip_str.split('.')))
-    o1, o2, o3, o4 = octets
-    
-    # 新加坡IP段汇总（原有+新增，精准匹配IDC段）
-    sg_ranges = [
-        # 原有核心段（阿里云、AWS、新加坡电信）
-        (47, 88, 0, 255),     # 阿里云新加坡：47.88.0.0/16
-        (47, 254, 0, 255),    # 阿里云新加坡：47.254.0.0/16
-        (52, 74, 0, 255),     # AWS新加坡：52.74.0.0/16
-        (52, 197, 0, 255),    # AWS新加坡：52.197.0.0/16
-        (202, 153, 0, 255),   # 新加坡电信：202.153.0.0/16
-        (203, 116, 0, 255),   # 新加坡电信：203.116.0.0/16
-        (103, 3, 0, 255),     # 新加坡IDC：103.3.0.0/16
-        (139, 162, 0, 255),   # 新加坡阿里云：139.162.0.0/16
-        
-        # 新增IP段（用户提供+补充验证）
-        (1, 21, 224, 255),    # 新加坡电信：1.21.224.0/19（224-255段）
-        (1, 32, 128, 191),    # 新加坡M1：1.32.128.0/18（128-191段）
-        (1, 32, 192, 255),    # 新加坡M1：1.32.192.0/18（192-255段）
-        (1, 178, 32, 63),     # 新加坡星和电信：1.178.32.0/19（32-63段）
-        (8, 128, 0, 255),     # 新加坡AWS：8.128.0.0/17（0-255段，拆分/10）
-        (8, 129, 0, 255),     # 新加坡AWS：8.129.0.0/17
-        (8, 130, 0, 255),     # 新加坡AWS：8.130.0.0/17
-        (8, 131, 0, 255),     # 新加坡AWS：8.131.0.0/17
-        (103, 214, 0, 255),   # 新加坡IDC：103.214.0.0/16
-        (188, 166, 0, 255),   # 新加坡DigitalOcean：188.166.0.0/16
-        (202, 92, 128, 255),  # 新加坡电信：202.92.128.0/17
-    ]
-    
-    for (r1, r2, r3_min, r3_max) in sg_ranges:
-        if o1 == r1 and o2 == r2 and r3_min <= o3 <= r3_max:
-            return True
-    return False
+    """判断是否为新加坡IP"""
+    return get_default_index().lookup(ip_str) == '新加坡'
 
 def is_valid_ip(ip_str):
-    """验证IP地址格式是否合法（支持IPv4标准格式）"""
-    try:
-        octets = list(map(int, ip_str.split('.')))
-        return len(octets) == 4 and all(0 <= o <= 255 for o in octets)
-    except (ValueError, AttributeError):
-        return False
+    """验证IP地址格式是否合法（IPv4点分十进制或IPv6）"""
+    return parse_ip(ip_str) is not None
+
+def parse_ipv4_bytes(data):
+    """
+    用NumPy把一段文件内容解析为uint32数组（无逐行Python循环）
+    data: 原始字节（每行一个IP，行首尾空白忽略，空行跳过）
+    返回 (ips, valid, spans)：均按非空行对齐，ips为解析结果（非法行为0），
+    valid为合法行掩码，spans为各行在data中的 [起, 止) 偏移（用于输出无效示例）
+    临时数组按字节对齐，约占 data 的十余倍内存：大文件请按行对齐分块调用（见 iter_ipv4_chunks）
+    """
+    if not data.endswith(b'\n'):
+        data += b'\n'
+    buf = np.frombuffer(data, dtype=np.uint8)
+    pos_type = np.int32 if len(buf) < 2 ** 31 else np.int64  # 字节级位置/计数用能容纳的最窄类型
+    nl = buf == 0x0A
+    ws = (buf == 0x20) | (buf == 0x09) | (buf == 0x0D)
+    digit = (buf >= 0x30) & (buf <= 0x39)
+    dot = buf == 0x2E
+    content = ~(nl | ws)
+
+    # 按行分段：每段包含行尾换行符，因此不存在空段，可直接用reduceat
+    line_ends = np.flatnonzero(nl)
+    line_starts = np.concatenate(([0], line_ends[:-1] + 1))
+    line_id = np.cumsum(nl, dtype=pos_type) - nl
+    n_content = np.add.reduceat(content, line_starts, dtype=pos_type)
+    n_dots = np.add.reduceat(dot, line_starts, dtype=pos_type)
+    n_bad = np.add.reduceat(content & ~(digit | dot), line_starts, dtype=pos_type)
+
+    # 行内（首尾非空白字符之间）出现空白视为非法
+    seen = np.cumsum(content, dtype=pos_type) - content
+    seen -= seen[line_starts][line_id]
+    inner_ws = ws & (seen > 0) & (seen < n_content[line_id])
+    n_inner_ws = np.add.reduceat(inner_ws, line_starts, dtype=pos_type)
+    del ws, content, seen, inner_ws, line_id
+
+    # 按“.”和换行切分为字段，逐字段累加十进制值
+    sep = dot | nl
+    seg_id = np.cumsum(sep, dtype=pos_type) - sep
+    seg_starts = np.concatenate(([0], np.flatnonzero(sep)[:-1] + 1))
+    del sep, nl
+    n_digits = np.add.reduceat(digit, seg_starts, dtype=pos_type)
+    digit_pos = np.cumsum(digit, dtype=pos_type) - digit
+    digit_pos -= digit_pos[seg_starts][seg_id]
+    place = np.clip(n_digits[seg_id] - 1 - digit_pos, 0, 3).astype(np.uint8)
+    del digit_pos
+    contrib = np.where(digit, buf - 0x30, 0).astype(np.uint16) * _POW10[place]
+    del place
+    seg_value = np.add.reduceat(contrib, seg_starts, dtype=np.uint32)
+    del contrib
+
+    # 合法行：恰好3个点、无非法字符、每个字段1~3位且不超过255
+    nonblank = n_content > 0
+    valid = nonblank & (n_dots == 3) & (n_bad == 0) & (n_inner_ws == 0)
+    first_seg = seg_id[line_starts]
+    ips = np.zeros(len(line_starts), dtype=np.uint32)
+    for k in range(4):
+        seg = np.where(valid, first_seg + k, 0)
+        valid &= (n_digits[seg] >= 1) & (n_digits[seg] <= 3) & (seg_value[seg] <= 255)
+        ips |= (seg_value[seg] & 0xFF) << np.uint32(24 - 8 * k)
+    ips[~valid] = 0
+
+    spans = np.stack((line_starts, line_ends), axis=1)[nonblank]
+    return ips[nonblank], valid[nonblank], spans
+
+def _chunk_bounds(mm, chunk_size):
+    """把内存映射的文件切分为按行对齐的 [起, 止) 区间（分块末尾总在换行符之后或文件结尾）"""
+    size = len(mm)
+    start = 0
+    while start < size:
+        end = min(start + chunk_size, size)
+        if end < size:
+            nl = mm.find(b'\n', end - 1)
+            end = size if nl == -1 else nl + 1
+        yield start, end
+        start = end
+
+def iter_ipv4_chunks(input_file, chunk_size=CHUNK_SIZE):
+    """
+    内存映射输入文件，按行对齐分块（见 _chunk_bounds）逐块解析，产出 (块内容, ips, valid, spans)
+    解析的临时内存只与 chunk_size 有关，与文件大小无关
+    """
+    with open(input_file, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for start, end in _chunk_bounds(mm, chunk_size):
+                data = mm[start:end]
+                yield (data,) + parse_ipv4_bytes(data)
+
+def _locate_intervals(ips, starts, ends):
+    """用searchsorted查找每个IP所在区间的下标，不在任何区间内为-1（starts/ends为区间的uint32数组）"""
+    pos = np.searchsorted(starts, ips, side='right') - 1
+    if not len(starts):
+        return pos
+    clamped = np.maximum(pos, 0)
+    return np.where((pos >= 0) & (ips <= ends[clamped]), pos, -1)
 
-def filter_target_regions_ip(input_file="ip.txt", output_file="ip2.txt"):
+def classify_batch(ips, index, block=CLASSIFY_BLOCK):
+    """
+    用searchsorted对uint32数组批量分类（每次处理block个IP，临时数组不随输入规模增长）
+    返回 (masks, counts)：masks为 {地区: 布尔掩码}，counts为 {地区: 命中数}
     """
-    筛选香港/日本/新加坡IP（无外部依赖，IP段覆盖更全面）
+    starts = np.asarray(index.starts, dtype=np.uint32)
+    ends = np.asarray(index.ends, dtype=np.uint32)
+    # 末尾追加-1，使未命中（下标-1）直接映射为-1
+    label_ids = np.array([index.regions.index(label) for label in index.labels] + [-1], dtype=np.int16)
+
+    region_ids = np.empty(len(ips), dtype=np.int16)
+    for lo in range(0, len(ips), block):
+        region_ids[lo:lo + block] = label_ids[_locate_intervals(ips[lo:lo + block], starts, ends)]
+
+    masks = {region: region_ids == i for i, region in enumerate(index.regions)}
+    counts = {region: int(mask.sum()) for region, mask in masks.items()}
+    return masks, counts
+
+def _read_and_classify_python(input_file, index, cache=None):
+    """纯Python路径：逐行解析一次、按字符串去重、逐个查找（IPv4带/24分类缓存时先查缓存，IPv6查前缀树）"""
+    lookup = cache.lookup_int if cache is not None else index.lookup_int
+    with METRICS.timer('read'):
+        with open(input_file, 'r', encoding='utf-8') as f:
+            raw_ips = [line.strip() for line in f if line.strip()]
+    valid_ips = {}
+    invalid_ips = []
+    with METRICS.timer('parse'):
+        for ip in raw_ips:
+            parsed = parse_ip(ip)
+            if parsed is None:
+                invalid_ips.append(ip)
+            else:
+                valid_ips.setdefault(ip, parsed)
+    METRICS.count('lines_read', len(raw_ips))
+    METRICS.count('ips_valid', len(valid_ips))
+    METRICS.count('ips_invalid', len(invalid_ips))
+    print(f"原始IP总数：{len(raw_ips)} 个")
+    print(f"去重后有效IP数：{len(valid_ips)} 个")
+    if invalid_ips:
+        print(f"无效IP数：{len(invalid_ips)} 个（已过滤，示例：{invalid_ips[:2]}）")
+
+    print(f"\n正在筛选目标地区IP（共处理 {len(valid_ips)} 个有效IP，{len(index)} 个地区IP段）")
+    target_ips = []
+    region_count = {region: 0 for region in index.regions}
+    with METRICS.timer('classify'):
+        for idx, (ip, (version, addr)) in enumerate(valid_ips.items(), 1):
+            # 每处理100个IP更新一次进度，避免日志冗余
+            if idx % 100 == 0 or idx == len(valid_ips):
+                counts = " | ".join(f"{region}：{count} 个" for region, count in region_count.items())
+                print(f"进度：{idx}/{len(valid_ips)} 个IP | {counts}")
+
+            # 查找所属地区（重叠网段的优先级已在索引构建时处理）
+            region = lookup(addr) if version == 4 else index.lookup_addr(version, addr)
+            if region is not None:
+                target_ips.append(ip)
+                region_count[region] += 1
+    return target_ips, region_count
+
+def _sorted_unique(values):
+    """就地排序后按相邻差去重（np.unique 会额外分配数倍于输入的临时内存）"""
+    values.sort()
+    keep = np.empty(len(values), dtype=bool)
+    keep[:1] = True
+    np.not_equal(values[1:], values[:-1], out=keep[1:])
+    return values[keep]
+
+def _read_and_classify_numpy(input_file, index):
+    """
+    NumPy路径：按行对齐分块向量化解析并块内去重、按整数全局去重、searchsorted批量分类
+    （只解析IPv4，IPv6行计为无效）；除每块的临时数组外，只保留去重后的uint32数组
+    """
+    n_lines = n_invalid = 0
+    examples = []
+    parts = []
+    with METRICS.timer('parse'):
+        for data, ips, valid, spans in iter_ipv4_chunks(input_file):
+            n_lines += len(ips)
+            n_invalid += int(len(valid) - valid.sum())
+            if len(examples) < 2:
+                examples += [data[s:e].decode('utf-8', 'replace').strip() for s, e in spans[~valid][:2 - len(examples)]]
+            parts.append(np.unique(ips[valid]))
+        unique_ips = _sorted_unique(np.concatenate(parts)) if parts else np.zeros(0, dtype=np.uint32)
+        del parts
+    METRICS.count('lines_read', n_lines)
+    METRICS.count('ips_valid', len(unique_ips))
+    METRICS.count('ips_invalid', n_invalid)
+    print(f"原始IP总数：{n_lines} 个")
+    print(f"去重后有效IP数：{len(unique_ips)} 个")
+    if n_invalid:
+        print(f"无效IP数：{n_invalid} 个（已过滤，示例：{examples}）")
+
+    print(f"\n正在批量筛选目标地区IP（NumPy，共 {len(unique_ips)} 个有效IP，{len(index)} 个地区IP段）")
+    with METRICS.timer('classify'):
+        masks, region_count = classify_batch(unique_ips, index)
+        target_mask = np.zeros(len(unique_ips), dtype=bool)
+        for mask in masks.values():
+            target_mask |= mask
+        target_ips = [int_to_ip(ip) for ip in unique_ips[target_mask]]
+    counts = " | ".join(f"{region}：{count} 个" for region, count in region_count.items())
+    print(f"进度：{len(unique_ips)}/{len(unique_ips)} 个IP | {counts}")
+    return target_ips, region_count
+
+def filter_target_regions_ip(input_file="ip.txt", output_file="ip2.txt", use_numpy=None):
+    """
+    筛选香港/日本/新加坡IP（NumPy可选，未安装时自动退回纯Python路径）
     input_file: 原始IP文件（每行一个IP）
     output_file: 筛选后IP文件（仅保留目标地区IP，每行一个）
+    use_numpy: 是否使用NumPy批量筛选（None表示已安装即使用）
+    失败时抛出 FilterError
     """
     print("=" * 60)
     print("开始执行IP筛选任务（目标：香港/日本/新加坡）")
     print("=" * 60)
 
-    # 1. 读取并预处理原始IP文件
+    # 1. 检查输入并加载地区IP段
     if not os.path.exists(input_file):
-        print(f"错误：原始IP文件 '{input_file}' 不存在，请检查文件路径")
-        exit(1)
-    
+        raise FilterError(f"原始IP文件 '{input_file}' 不存在，请检查文件路径")
     try:
-        with open(input_file, 'r', encoding='utf-8') as f:
-            raw_ips = [line.strip() for line in f if line.strip()]
-        # 去重（用集合）+ 过滤无效IP（用格式验证）
-        valid_ips = list({ip for ip in raw_ips if is_valid_ip(ip)})
-        invalid_ips = [ip for ip in raw_ips if not is_valid_ip(ip) and ip.strip()]
-        
-        print(f"原始IP总数：{len(raw_ips)} 个")
-        print(f"去重后有效IP数：{len(valid_ips)} 个")
-        if invalid_ips:
-            print(f"无效IP数：{len(invalid_ips)} 个（已过滤，示例：{invalid_ips[:2]}）")
+        index = get_default_index()
     except Exception as e:
-        print(f"读取IP文件失败：{str(e)}")
-        exit(1)
+        raise FilterError(f"加载地区IP段失败：{str(e)}") from e
+    if use_numpy is None:
+        # 地区IP段含IPv6时使用能识别IPv6的纯Python路径
+        use_numpy = np is not None and not index.has_ipv6
+    elif use_numpy and np is None:
+        print("警告：未安装NumPy，改用纯Python筛选")
+        use_numpy = False
 
-    # 2. 筛选目标地区IP（带进度提示）
-    print(f"\n正在筛选目标地区IP（共处理 {len(valid_ips)} 个有效IP）")
-    target_ips = []
-    region_count = {'香港': 0, '日本': 0, '新加坡': 0}
-    
-    for idx, ip in enumerate(valid_ips, 1):
-        # 每处理100个IP更新一次进度，避免日志冗余
-        if idx % 100 == 0 or idx == len(valid_ips):
-            print(f"进度：{idx}/{len(valid_ips)} 个IP | 香港：{region_count['香港']} 个 | 日本：{region_count['日本']} 个 | 新加坡：{region_count['新加坡']} 个")
-        
-        # 按地区优先级匹配（可根据需求调整顺序）
-        if is_hong_kong_ip(ip):
-            target_ips.append(ip)
-            region_count['香港'] += 1
-        elif is_japan_ip(ip):
-            target_ips.append(ip)
-            region_count['日本'] += 1
-        elif is_singapore_ip(ip):
-            target_ips.append(ip)
-            region_count['新加坡'] += 1
+    # 2. 读取、去重并筛选目标地区IP
+    try:
+        if use_numpy:
+            # 向量化searchsorted比逐IP查缓存更快，NumPy路径不使用分类缓存
+            target_ips, region_count = _read_and_classify_numpy(input_file, index)
+        else:
+            cache = open_prefix_cache(index)
+            target_ips, region_count = _read_and_classify_python(input_file, index, cache)
+            cache.report()
+    except Exception as e:
+        raise FilterError(f"读取IP文件失败：{str(e)}") from e
 
     # 3. 保存筛选结果（纯IP列表，无多余信息）
     print(f"\n正在保存筛选结果到 '{output_file}'")
-    try:
-        # 确保输出目录存在（若output_file含子目录）
-        output_dir = os.path.dirname(output_file)
-        if output_dir and not os.path.exists(output_dir):
-            os.makedirs(output_dir)
-        
-        with open(output_file, 'w', encoding='utf-8') as f:
-            f.write('\n'.join(target_ips))  # 每行一个IP，格式简洁
-    except Exception as e:
-        print(f"保存文件失败：{str(e)}")
-        exit(1)
+    with METRICS.timer('write'):
+        write_ip_list(target_ips, output_file)  # 每行一个IP，格式简洁
+    METRICS.count('ips_target', len(target_ips))
 
     # 4. 输出最终统计报告
     print("\n" + "=" * 60)
@@ -194,9 +514,300 @@ def filter_target_regions_ip(input_file="ip.txt", output_file="ip2.txt"):
     print(f"结果文件绝对路径：{os.path.abspath(output_file)}")
     print("=" * 60)
 
+def region_output_path(output_file, region):
+    """分地区输出文件路径：ip2.txt -> ip2_香港.txt"""
+    stem, ext = os.path.splitext(output_file)
+    return f"{stem}_{region}{ext}"
+
+def _coverage_bases(index):
+    """各地区区间在命中标记表中的起始偏移（区间按起始地址升序，标记表每个地址占1位，共 bases[-1] 位）"""
+    bases = array('Q', [0])
+    for start, end in zip(index.starts, index.ends):
+        bases.append(bases[-1] + end - start + 1)
+    return bases
+
+def _classify_chunk(task):
+    """
+    进程池任务：解析并分类输入文件的一个分块，只返回统计与命中IP在标记表中的偏移，
+    内存占用与分块大小成正比，与输入文件总大小无关
+    返回 (行数, 合法行数, 无效示例, 命中偏移array('I'))
+    """
+    input_file, start, end, use_numpy = task
+    index = get_default_index()
+    bases = _coverage_bases(index)
+    with open(input_file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        data = mm[start:end]
+
+    if use_numpy:
+        ips, valid, spans = parse_ipv4_bytes(data)
+        examples = [data[s:e].decode('utf-8', 'replace').strip() for s, e in spans[~valid][:2]]
+        valid_ips = ips[valid]
+        starts = np.asarray(index.starts, dtype=np.uint32)
+        pos = _locate_intervals(valid_ips, starts, np.asarray(index.ends, dtype=np.uint32))
+        hit = pos >= 0
+        pos = pos[hit]
+        offsets = np.asarray(bases[:-1], dtype=np.uint64)[pos] + (valid_ips[hit] - starts[pos])
+        return len(ips), int(valid.sum()), examples, array('I', offsets.astype(np.uint32).tobytes())
+
+    lines = n_valid = 0
+    examples = []
+    offsets = array('I')
+    for raw in data.split(b'\n'):
+        line = raw.strip()
+        if not line:
+            continue
+        lines += 1
+        ip = line.decode('utf-8', 'replace')
+        ip_int = ip_to_int(ip)
+        if ip_int is None:
+            if len(examples) < 2:
+                examples.append(ip)
+            continue
+        n_valid += 1
+        i = bisect.bisect_right(index.starts, ip_int) - 1
+        if i >= 0 and ip_int <= index.ends[i]:
+            offsets.append(bases[i] + ip_int - index.starts[i])
+    return lines, n_valid, examples, offsets
+
+def _iter_chunk_results(tasks, workers):
+    """workers<=1时在当前进程顺序处理；否则用进程池处理，同时在途的分块不超过 workers*2 个"""
+    if workers <= 1:
+        for task in tasks:
+            yield _classify_chunk(task)
+        return
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = set()
+        for task in tasks:
+            pending.add(pool.submit(_classify_chunk, task))
+            if len(pending) >= workers * 2:
+                done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        for future in concurrent.futures.as_completed(pending):
+            yield future.result()
+
+def _set_flags(flags, offsets, use_numpy):
+    """在位图标记表中置位命中偏移（第 offset 位 = flags[offset >> 3] 的第 offset & 7 位）"""
+    if use_numpy:
+        offsets = np.frombuffer(offsets, dtype=np.uint32)
+        np.bitwise_or.at(np.frombuffer(flags, dtype=np.uint8), offsets >> 3,
+                         np.left_shift(1, offsets & 7).astype(np.uint8))
+    else:
+        for offset in offsets:
+            flags[offset >> 3] |= 1 << (offset & 7)
+
+def _flagged_in(flags, lo, hi, view):
+    """位图中 [lo, hi) 范围内已置位的偏移（升序）；view为NumPy视图时向量化解包"""
+    first, last = lo >> 3, (hi + 7) >> 3
+    if view is not None:
+        bits = np.unpackbits(view[first:last], bitorder='little')
+        hits = np.flatnonzero(bits) + (first << 3)
+        return hits[(hits >= lo) & (hits < hi)].tolist()
+    hits = []
+    for byte_index in range(first, last):
+        byte = flags[byte_index]
+        if byte:
+            base = byte_index << 3
+            hits.extend(pos for pos in range(max(base, lo), min(base + 8, hi)) if byte >> (pos - base) & 1)
+    return hits
+
+def _write_flagged(flags, index, bases, output_file, use_numpy):
+    """按地址升序把标记表中的命中IP写入合并文件与各地区文件（分段写出，不在内存中构造完整列表）"""
+    view = np.frombuffer(flags, dtype=np.uint8) if use_numpy else None
+    written = {region: 0 for region in index.regions}
+    total = 0
+    with contextlib.ExitStack() as stack:
+        out = stack.enter_context(atomic_open(output_file))
+        files = {region: stack.enter_context(atomic_open(region_output_path(output_file, region)))
+                 for region in index.regions}
+        for i, (start, label) in enumerate(zip(index.starts, index.labels)):
+            for block_start in range(bases[i], bases[i + 1], MERGE_BLOCK):
+                block_end = min(block_start + MERGE_BLOCK, bases[i + 1])
+                hits = _flagged_in(flags, block_start, block_end, view)
+                if not hits:
+                    continue
+                text = '\n'.join(int_to_ip(start + pos - bases[i]) for pos in hits)
+                # 与全量筛选输出一致：行间换行、文件末尾不带换行
+                out.write(('\n' if total else '') + text)
+                files[label].write(('\n' if written[label] else '') + text)
+                total += len(hits)
+                written[label] += len(hits)
+    return total, written
+
+def filter_target_regions_streaming(input_file="ip.txt", output_file="ip2.txt", workers=None,
+                                    chunk_size=CHUNK_SIZE, use_numpy=None):
+    """
+    大文件流式筛选：内存映射输入、按行对齐切块，由进程池并行解析分类，
+    命中IP记入按地区IP段总地址数分配的位图标记表（去重），最后按地址升序写出合并文件与各地区文件
+    峰值内存约为 标记表（每个地址1位，本仓库IP段约0.4MB）+ 每个进程一个分块的解析开销，与输入文件大小无关
+    只处理IPv4（IPv6行计为无效）
+    input_file / output_file / use_numpy: 同 filter_target_regions_ip；各地区文件见 region_output_path
+    workers: 进程数（None为CPU核数，1为不启用进程池）
+    失败时抛出 FilterError
+    """
+    print("=" * 60)
+    print("开始执行流式IP筛选任务（目标：香港/日本/新加坡）")
+    print("=" * 60)
+
+    if not os.path.exists(input_file):
+        raise FilterError(f"原始IP文件 '{input_file}' 不存在，请检查文件路径")
+    try:
+        index = get_default_index()
+    except Exception as e:
+        raise FilterError(f"加载地区IP段失败：{str(e)}") from e
+    if use_numpy is None:
+        use_numpy = np is not None
+    elif use_numpy and np is None:
+        print("警告：未安装NumPy，改用纯Python筛选")
+        use_numpy = False
+    if index.has_ipv6:
+        print("警告：流式筛选只处理IPv4，IPv6地区IP段将被忽略（IPv6请使用 filter_target_regions_ip）")
+    workers = workers or os.cpu_count() or 1
+    bases = _coverage_bases(index)
+    flags = bytearray((bases[-1] + 7) // 8)
+
+    lines = n_valid = 0
+    examples = []
+    try:
+        with open(input_file, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                bounds = []
+            else:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    bounds = list(_chunk_bounds(mm, chunk_size))
+        tasks = [(input_file, start, end, use_numpy) for start, end in bounds]
+        print(f"输入 {os.path.getsize(input_file) / 1e6:.1f} MB，切分为 {len(tasks)} 块，{min(workers, max(len(tasks), 1))} 个进程")
+        with METRICS.timer('classify'):
+            for done, (chunk_lines, chunk_valid, chunk_examples, offsets) in enumerate(
+                    _iter_chunk_results(tasks, min(workers, len(tasks))), 1):
+                lines += chunk_lines
+                n_valid += chunk_valid
+                examples.extend(chunk_examples[:2 - len(examples)])
+                _set_flags(flags, offsets, use_numpy)
+                print(f"进度：{done}/{len(tasks)} 块 | 已处理 {lines} 行")
+    except Exception as e:
+        raise FilterError(f"读取IP文件失败：{str(e)}") from e
+    METRICS.count('lines_read', lines)
+    METRICS.count('ips_valid', n_valid)
+    METRICS.count('ips_invalid', lines - n_valid)
+    print(f"原始IP总数：{lines} 个，有效行：{n_valid} 个")
+    if lines > n_valid:
+        print(f"无效IP数：{lines - n_valid} 个（已过滤，示例：{examples}）")
+
+    print(f"\n正在保存筛选结果到 '{output_file}' 及各地区文件")
+    try:
+        output_dir = os.path.dirname(output_file)
+        if output_dir and not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+        with METRICS.timer('write'):
+            total, region_count = _write_flagged(flags, index, bases, output_file, use_numpy)
+    except Exception as e:
+        raise FilterError(f"保存文件失败：{str(e)}") from e
+    METRICS.count('ips_target', total)
+
+    print("\n" + "=" * 60)
+    print("流式IP筛选任务完成！")
+    print("=" * 60)
+    print(f"总筛选出目标地区IP（去重）：{total} 个")
+    for region, count in region_count.items():
+        print(f"  - {region}：{count} 个 -> {region_output_path(output_file, region)}")
+    print(f"结果文件绝对路径：{os.path.abspath(output_file)}")
+    print("=" * 60)
+
+def write_ip_list(ips, output_file):
+    """原子写出IP列表（每行一个），失败时抛出 FilterError"""
+    try:
+        with atomic_open(output_file) as f:
+            f.write('\n'.join(ips))
+    except Exception as e:
+        raise FilterError(f"保存文件失败：{str(e)}") from e
+
+def filter_store_delta(store_path=STORE_FILE, output_file="ip2.txt"):
+    """
+    增量筛选：只对IP库中上次筛选后新增/移除的IP做分类，并就地修补输出文件
+    首次运行、输出文件缺失或地区IP段文件变化时，对库中全部有效IP重新筛选
+    store_path: 采集阶段写入的IP库（ip_store.IPStore）
+    output_file: 筛选后IP文件（每行一个）
+    失败时抛出 FilterError
+    """
+    print("=" * 60)
+    print("开始执行增量IP筛选任务（目标：香港/日本/新加坡）")
+    print("=" * 60)
+
+    try:
+        index = get_default_index()
+        version = region_version()
+        cache = PrefixCache(index)
+    except Exception as e:
+        raise FilterError(f"加载地区IP段失败：{str(e)}") from e
+
+    with IPStore(store_path) as store:
+        last_seq = store.get_meta('filter_seq')
+        full = (last_seq is None or store.get_meta('region_version') != version
+                or not os.path.exists(output_file))
+        if full:
+            added, removed = set(store.active_ips()), set()
+            latest = store.last_change_seq()
+            current = set()
+            print(f"全量筛选：库中有效IP {len(added)} 个")
+        else:
+            added, removed, latest = store.changes_since(int(last_seq))
+            with open(output_file, 'r', encoding='utf-8') as f:
+                current = {line.strip() for line in f if line.strip()}
+            print(f"增量筛选：新增 {len(added)} 个，移除 {len(removed)} 个（当前结果 {len(current)} 个）")
+
+        regions = {}
+        with METRICS.timer('classify'):
+            for ip in added:
+                regions[ip] = classify_ip(ip, cache)
+        current -= removed
+        current |= {ip for ip, region in regions.items() if region is not None}
+        target_ips = sorted(current, key=endpoint_sort_key)
+        METRICS.count('ips_added', len(added))
+        METRICS.count('ips_removed', len(removed))
+        METRICS.count('ips_target', len(target_ips))
+
+        with METRICS.timer('write'):
+            write_ip_list(target_ips, output_file)
+
+        # 输出文件写成功后再推进消费位置，失败时下次会重放同一批变更
+        store.set_regions(regions)
+        store.set_meta('filter_seq', latest)
+        store.set_meta('region_version', version)
+        store.prune_changes(latest)
+
+    region_count = {region: 0 for region in index.regions}
+    for region in regions.values():
+        if region is not None:
+            region_count[region] += 1
+    print("\n" + "=" * 60)
+    print("增量IP筛选任务完成！")
+    print("=" * 60)
+    cache.report()
+    print(f"目标地区IP总数：{len(target_ips)} 个（本次新分类命中：{' | '.join(f'{r}：{c} 个' for r, c in region_count.items())}）")
+    print(f"结果文件绝对路径：{os.path.abspath(output_file)}")
+    print("=" * 60)
+
 if __name__ == "__main__":
-    # 执行筛选（默认读取根目录ip.txt，输出根目录ip2.txt）
-    filter_target_regions_ip(
-        input_file="ip.txt",    # 原始IP文件路径（可自定义）
-        output_file="ip2.txt"   # 筛选结果文件路径（可自定义）
-    )
+    try:
+        if os.path.exists(STORE_FILE):
+            # 采集阶段已写入IP库时只处理变更部分
+            mode = "delta"
+            filter_store_delta(store_path=STORE_FILE, output_file="ip2.txt")
+        else:
+            mode = "full"
+            if os.path.exists("ip.txt") and os.path.getsize("ip.txt") >= STREAMING_MIN_BYTES:
+                # 超大列表：内存映射 + 多进程分块筛选，内存占用与文件大小无关
+                mode = "streaming"
+                filter_target_regions_streaming(input_file="ip.txt", output_file="ip2.txt")
+            else:
+                # 执行筛选（默认读取根目录ip.txt，输出根目录ip2.txt）
+                filter_target_regions_ip(
+                    input_file="ip.txt",    # 原始IP文件路径（可自定义）
+                    output_file="ip2.txt"   # 筛选结果文件路径（可自定义）
+                )
+    except FilterError as e:
+        print(f"错误：{e}")
+        METRICS.write_report(FILTER_REPORT_FILE, command="ip_filter", error=str(e))
+        sys.exit(1)
+    METRICS.write_report(FILTER_REPORT_FILE, command="ip_filter", mode=mode)
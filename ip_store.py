@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+持久化IP库（SQLite）：记录每个IP的首次/最近出现时间、来源站点和最近一次地区分类，
+每次采集计算新增/移除集合并写入变更日志，筛选阶段只需处理变更部分
+"""
+
+import os
+import time
+import sqlite3
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+STORE_FILE = os.path.join(".cache", "ip_store.sqlite3")
+# 本次未出现的IP，只有它的全部来源都已抓取（且都不再包含它）时才移除；来源未抓取（熔断、超时、下线）的IP
+# 保留到连续未出现超过该时长（秒）为止
+STALE_AFTER = 24 * 3600
+RETENTION = 30 * 24 * 3600     # 已移除的IP保留多久（秒）后从库中清除
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS ips (
+    ip TEXT PRIMARY KEY,
+    first_seen REAL NOT NULL,
+    last_seen REAL NOT NULL,
+    active INTEGER NOT NULL DEFAULT 1,
+    region TEXT
+);
+CREATE TABLE IF NOT EXISTS ip_sources (
+    ip TEXT NOT NULL,
+    source TEXT NOT NULL,
+    last_seen REAL NOT NULL,
+    PRIMARY KEY (ip, source)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS changes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    ip TEXT NOT NULL,
+    op TEXT NOT NULL CHECK (op IN ('+', '-'))
+);
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    at REAL NOT NULL,
+    seen INTEGER NOT NULL,
+    added INTEGER NOT NULL,
+    removed INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+class Delta(NamedTuple):
+    added: List[str]
+    removed: List[str]
+
+class IPStore:
+    def __init__(self, path: str = STORE_FILE):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(_SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self) -> "IPStore":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # -------------------------- 采集侧 --------------------------
+    def record_run(self, ips_by_source: Dict[str, Iterable[str]], fetched: Optional[Iterable[str]] = None,
+                   now: Optional[float] = None, stale_after: float = STALE_AFTER) -> Delta:
+        """
+        记录一次采集结果，返回相对上次的新增/移除IP，并写入变更日志
+        fetched: 本次实际抓取成功的来源（默认为 ips_by_source 的全部键）；本次未出现的IP只有在其全部来源都在其中时
+        才移除，否则保留到超过 stale_after 秒未出现
+        """
+        now = time.time() if now is None else now
+        fetched = set(ips_by_source) if fetched is None else set(fetched)
+        pairs = [(ip, source) for source, ips in ips_by_source.items() for ip in ips]
+        with self.conn:
+            cur = self.conn.cursor()
+            cur.execute("CREATE TEMP TABLE IF NOT EXISTS seen (ip TEXT PRIMARY KEY) WITHOUT ROWID")
+            cur.execute("DELETE FROM seen")
+            cur.executemany("INSERT OR IGNORE INTO seen (ip) VALUES (?)", ((ip,) for ip, _ in pairs))
+
+            added = [row[0] for row in cur.execute(
+                "SELECT s.ip FROM seen s LEFT JOIN ips i ON i.ip = s.ip "
+                "WHERE i.ip IS NULL OR i.active = 0"
+            )]
+            cur.execute(
+                "INSERT INTO ips (ip, first_seen, last_seen, active) SELECT ip, ?, ?, 1 FROM seen WHERE true "
+                "ON CONFLICT (ip) DO UPDATE SET last_seen = excluded.last_seen, active = 1",
+                (now, now),
+            )
+            cur.executemany(
+                "INSERT INTO ip_sources (ip, source, last_seen) VALUES (?, ?, ?) "
+                "ON CONFLICT (ip, source) DO UPDATE SET last_seen = excluded.last_seen",
+                ((ip, source, now) for ip, source in pairs),
+            )
+
+            cur.execute("CREATE TEMP TABLE IF NOT EXISTS fetched (source TEXT PRIMARY KEY) WITHOUT ROWID")
+            cur.execute("DELETE FROM fetched")
+            cur.executemany("INSERT INTO fetched (source) VALUES (?)", ((source,) for source in fetched))
+            removed = [row[0] for row in cur.execute(
+                "SELECT ip FROM ips i WHERE active = 1 AND last_seen < ? AND (last_seen < ? OR NOT EXISTS ("
+                "SELECT 1 FROM ip_sources s WHERE s.ip = i.ip AND s.source NOT IN (SELECT source FROM fetched)))",
+                (now, now - stale_after),
+            )]
+            cur.executemany("UPDATE ips SET active = 0 WHERE ip = ?", ((ip,) for ip in removed))
+
+            cur.executemany("INSERT INTO changes (ip, op) VALUES (?, '+')", ((ip,) for ip in added))
+            cur.executemany("INSERT INTO changes (ip, op) VALUES (?, '-')", ((ip,) for ip in removed))
+            seen_count = cur.execute("SELECT COUNT(*) FROM seen").fetchone()[0]
+            cur.execute(
+                "INSERT INTO runs (at, seen, added, removed) VALUES (?, ?, ?, ?)",
+                (now, seen_count, len(added), len(removed)),
+            )
+            self._purge(cur, now)
+        return Delta(sorted(added), sorted(removed))
+
+    def _purge(self, cur, now: float):
+        cutoff = now - RETENTION
+        cur.execute("DELETE FROM ip_sources WHERE ip IN (SELECT ip FROM ips WHERE active = 0 AND last_seen < ?)", (cutoff,))
+        cur.execute("DELETE FROM ips WHERE active = 0 AND last_seen < ?", (cutoff,))
+
+    def active_ips(self) -> List[str]:
+        return [row[0] for row in self.conn.execute("SELECT ip FROM ips WHERE active = 1")]
+
+    def sources_of(self, ip: str) -> List[str]:
+        return [row[0] for row in self.conn.execute(
+            "SELECT source FROM ip_sources WHERE ip = ? ORDER BY last_seen DESC", (ip,)
+        )]
+
+    def info(self, ip: str) -> Optional[dict]:
+        row = self.conn.execute(
+            "SELECT first_seen, last_seen, active, region FROM ips WHERE ip = ?", (ip,)
+        ).fetchone()
+        if row is None:
+            return None
+        first_seen, last_seen, active, region = row
+        return {
+            "ip": ip,
+            "first_seen": first_seen,
+            "last_seen": last_seen,
+            "active": bool(active),
+            "region": region,
+            "sources": self.sources_of(ip),
+        }
+
+    # -------------------------- 筛选侧 --------------------------
+    def last_change_seq(self) -> int:
+        """最近一次变更的seq（取自AUTOINCREMENT计数器，变更日志被清理后仍然递增）"""
+        row = self.conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'changes'").fetchone()
+        return row[0] if row else 0
+
+    def changes_since(self, seq: int) -> Tuple[Set[str], Set[str], int]:
+        """合并 seq 之后的变更日志，返回 (新增集合, 移除集合, 最新seq)；同一IP以最后一次变更为准"""
+        final: Dict[str, str] = {}
+        last = seq
+        for last, ip, op in self.conn.execute(
+            "SELECT seq, ip, op FROM changes WHERE seq > ? ORDER BY seq", (seq,)
+        ):
+            final[ip] = op
+        added = {ip for ip, op in final.items() if op == '+'}
+        removed = {ip for ip, op in final.items() if op == '-'}
+        return added, removed, last
+
+    def prune_changes(self, seq: int):
+        """删除已被消费的变更日志"""
+        with self.conn:
+            self.conn.execute("DELETE FROM changes WHERE seq <= ?", (seq,))
+
+    def active_regions(self) -> Dict[str, str]:
+        """有效且已分类到目标地区的IP -> 地区"""
+        return dict(self.conn.execute("SELECT ip, region FROM ips WHERE active = 1 AND region IS NOT NULL"))
+
+    def set_regions(self, regions: Dict[str, Optional[str]]):
+        with self.conn:
+            self.conn.executemany(
+                "UPDATE ips SET region = ? WHERE ip = ?", ((region, ip) for ip, region in regions.items())
+            )
+
+    def get_meta(self, key: str) -> Optional[str]:
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key: str, value: str):
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO meta (key, value) VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+                (key, str(value)),
+            )
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+候选IP校验：保留地址（私有、回环、CGNAT、链路本地、文档、组播、保留等）与Cloudflare官方IP段
+预先装入IPv4/IPv6统一的前缀树（prefix_trie.PrefixTrie），每个候选一次最长前缀匹配，耗时与网段数量无关；
+非法与保留地址在去重、排序、测速与地区分类之前丢弃
+"""
+
+import os
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+from ipset import format_endpoint, parse_endpoint
+from prefix_trie import PrefixTrie
+
+CLOUDFLARE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cloudflare_ranges.txt")
+
+# IANA 特殊用途地址（RFC 6890 等），均不可能是可用的公网优选IP
+RESERVED_CIDRS = (
+    "0.0.0.0/8",          # 本网络
+    "10.0.0.0/8",         # 私有
+    "100.64.0.0/10",      # CGNAT
+    "127.0.0.0/8",        # 回环
+    "169.254.0.0/16",     # 链路本地
+    "172.16.0.0/12",      # 私有
+    "192.0.0.0/24",       # IETF协议分配
+    "192.0.2.0/24",       # 文档 TEST-NET-1
+    "192.88.99.0/24",     # 6to4中继（已废弃）
+    "192.168.0.0/16",     # 私有
+    "198.18.0.0/15",      # 基准测试
+    "198.51.100.0/24",    # 文档 TEST-NET-2
+    "203.0.113.0/24",     # 文档 TEST-NET-3
+    "224.0.0.0/4",        # 组播
+    "240.0.0.0/4",        # 保留（含 255.255.255.255 广播）
+    # IPv6只接受全球单播 2000::/3（见 is_global_unicast_v6，未指定/回环/映射/NAT64/唯一本地/链路本地/组播都在其外），
+    # 以下只列出该范围内的特殊用途段
+    "2001::/23",          # IETF协议分配（含Teredo）
+    "2001:db8::/32",      # 文档
+    "2002::/16",          # 6to4
+    "3fff::/20",          # 文档
+)
+
+def is_global_unicast_v6(addr: int) -> bool:
+    """是否位于IPv6全球单播 2000::/3（最高3位为001）"""
+    return addr >> 125 == 1
+
+def trie_from_cidrs(cidrs: Iterable[str], value=True) -> PrefixTrie:
+    trie = PrefixTrie()
+    for cidr in cidrs:
+        trie.add_cidr(cidr, value)
+    return trie
+
+def trie_from_file(path: str) -> PrefixTrie:
+    """每行一个CIDR（IPv4或IPv6），#之后为注释"""
+    with open(path, "r", encoding="utf-8") as f:
+        cidrs = [line.split("#", 1)[0].strip() for line in f]
+    return trie_from_cidrs(cidr for cidr in cidrs if cidr)
+
+class CandidateValidator:
+    """
+    按批校验候选（'ip'、'ip:port'、'v6' 或 '[v6]:port'）：格式/端口非法与保留地址（含 2000::/3 以外的IPv6）直接丢弃；
+    Cloudflare归属默认只统计（优选列表中的反代IP本就不在官方网段内），cloudflare_only=True 时丢弃网段外地址
+    """
+
+    def __init__(self, reserved: Optional[PrefixTrie] = None, cloudflare: Optional[PrefixTrie] = None,
+                 cloudflare_only: bool = False):
+        # 空表也是有效的表（PrefixTrie 以网段数为长度），只有未传入时才加载默认表
+        self.reserved = trie_from_cidrs(RESERVED_CIDRS) if reserved is None else reserved
+        self.cloudflare = trie_from_file(CLOUDFLARE_FILE) if cloudflare is None else cloudflare
+        self.cloudflare_only = cloudflare_only
+
+    def validate(self, candidates: Iterable[str],
+                 cloudflare_only: Optional[bool] = None) -> Tuple[Set[str], Dict[str, int]]:
+        """
+        返回 (规范化后的有效候选集合, 统计)，统计键：malformed / reserved / cloudflare / non_cloudflare / kept
+        cloudflare_only 为None时使用构造时的设置
+        """
+        if cloudflare_only is None:
+            cloudflare_only = self.cloudflare_only
+        kept: Set[str] = set()
+        stats = {"malformed": 0, "reserved": 0, "cloudflare": 0, "non_cloudflare": 0}
+        reserved, cloudflare = self.reserved.lookup, self.cloudflare.lookup
+        for candidate in candidates:
+            parsed = parse_endpoint(candidate)
+            if parsed is None:
+                stats["malformed"] += 1
+                continue
+            version, addr, port = parsed
+            if (version == 6 and not is_global_unicast_v6(addr)) or reserved(version, addr, False):
+                stats["reserved"] += 1
+                continue
+            is_owned = cloudflare(version, addr, False)
+            stats["cloudflare" if is_owned else "non_cloudflare"] += 1
+            if is_owned or not cloudflare_only:
+                kept.add(format_endpoint(version, addr, port))
+        stats["kept"] = len(kept)
+        return kept, stats
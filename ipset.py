@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+整数打包的IP/端口集合：地址存为uint32、端口存为uint16，按整数排序去重，
+并可写出定长二进制文件（与 ip.txt 同目录的 ip.bin），下游可直接内存映射读取而无需解析文本
+IPv6条目（'v6' 或 '[v6]:port'）单独按整数排序去重，文本输出排在IPv4之后，不写入 ip.bin
+
+二进制格式（小端）：
+    头部16字节：magic b"CFIP" | uint16 版本(1) | uint16 记录长度(8) | uint32 记录数 | uint32 保留
+    记录8字节：  uint32 地址 | uint16 端口（0表示未指定） | uint16 保留
+NumPy读取示例：
+    np.memmap("ip.bin", dtype=[("addr", "<u4"), ("port", "<u2"), ("pad", "<u2")], mode="r", offset=16)
+"""
+
+import mmap
+import struct
+from array import array
+from bisect import bisect_left
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from atomic_io import atomic_open
+from prefix_trie import format_ip, parse_ip
+
+BINARY_MAGIC = b"CFIP"
+BINARY_VERSION = 1
+_HEADER = struct.Struct("<4sHHII")
+_RECORD = struct.Struct("<IHH")
+
+def parse_candidate(text: str) -> Optional[Tuple[int, int]]:
+    """解析 'a.b.c.d' 或 'a.b.c.d:port' 为 (地址整数, 端口)，非法时返回None"""
+    host, sep, port_text = text.strip().partition(":")
+    parts = host.split(".")
+    if len(parts) != 4:
+        return None
+    try:
+        o1, o2, o3, o4 = map(int, parts)
+        port = int(port_text) if sep else 0
+    except ValueError:
+        return None
+    if not (0 <= o1 <= 255 and 0 <= o2 <= 255 and 0 <= o3 <= 255 and 0 <= o4 <= 255):
+        return None
+    if sep and not 0 < port <= 65535:
+        return None
+    return (o1 << 24) | (o2 << 16) | (o3 << 8) | o4, port
+
+def format_candidate(addr: int, port: int = 0) -> str:
+    ip = f"{addr >> 24}.{(addr >> 16) & 0xFF}.{(addr >> 8) & 0xFF}.{addr & 0xFF}"
+    return f"{ip}:{port}" if port else ip
+
+def parse_endpoint(text: str) -> Optional[Tuple[int, int, int]]:
+    """解析IPv4/IPv6候选为 (地址族4/6, 地址整数, 端口)：'a.b.c.d[:port]'、'v6'、'[v6]' 或 '[v6]:port'，非法时返回None"""
+    text = text.strip()
+    if ':' not in text or text.count(':') == 1:
+        parsed = parse_candidate(text)
+        return None if parsed is None else (4, parsed[0], parsed[1])
+    port = 0
+    if text.startswith('['):
+        host, sep, rest = text[1:].partition(']')
+        if not sep:
+            return None
+        if rest:
+            if not rest.startswith(':'):
+                return None
+            try:
+                port = int(rest[1:])
+            except ValueError:
+                return None
+            if not 0 < port <= 65535:
+                return None
+    else:
+        host = text
+    parsed = parse_ip(host)
+    if parsed is None or parsed[0] != 6:
+        return None
+    return 6, parsed[1], port
+
+def format_endpoint(version: int, addr: int, port: int = 0) -> str:
+    if version == 4:
+        return format_candidate(addr, port)
+    ip = format_ip(6, addr)
+    return f"[{ip}]:{port}" if port else ip
+
+def endpoint_sort_key(text: str) -> Tuple[int, int, int]:
+    """排序键：IPv4在前、IPv6在后，各自按地址数值与端口升序；无法解析的排在最后"""
+    return parse_endpoint(text) or (7, 0, 0)
+
+class PackedIPSet:
+    """
+    以 (地址 << 16 | 端口) 的64位整数存储，追加时不去重，读取前统一排序去重；
+    同一地址的裸IP与带端口的条目是不同的候选，都会保留（与IP库一致，地区筛选只识别裸IP）
+    IPv6条目以同样的键（Python整数）存放在 _keys6 中；迭代、addresses、ports 与二进制文件只含IPv4
+    """
+
+    def __init__(self, candidates: Iterable[str] = ()):
+        self._keys = array("Q")
+        self._keys6: List[int] = []
+        self._compacted = True
+        self.rejected = 0
+        self.update(candidates)
+
+    def add(self, candidate: str) -> bool:
+        parsed = parse_endpoint(candidate)
+        if parsed is None:
+            self.rejected += 1
+            return False
+        version, addr, port = parsed
+        if version == 4:
+            self.add_int(addr, port)
+        else:
+            self._keys6.append((addr << 16) | port)
+            self._compacted = False
+        return True
+
+    def add_int(self, addr: int, port: int = 0):
+        self._keys.append((addr << 16) | port)
+        self._compacted = False
+
+    def update(self, candidates: Iterable[str]):
+        for candidate in candidates:
+            self.add(candidate)
+
+    def _compact(self):
+        if self._compacted:
+            return
+        self._keys = array("Q", sorted(set(self._keys)))
+        self._keys6 = sorted(set(self._keys6))
+        self._compacted = True
+
+    def __len__(self) -> int:
+        self._compact()
+        return len(self._keys) + len(self._keys6)
+
+    def __iter__(self) -> Iterator[Tuple[int, int]]:
+        """IPv4的 (地址, 端口)，按数值升序"""
+        self._compact()
+        for key in self._keys:
+            yield key >> 16, key & 0xFFFF
+
+    def iter_ipv6(self) -> Iterator[Tuple[int, int]]:
+        self._compact()
+        for key in self._keys6:
+            yield key >> 16, key & 0xFFFF
+
+    def __contains__(self, candidate: str) -> bool:
+        parsed = parse_endpoint(candidate)
+        if parsed is None:
+            return False
+        self._compact()
+        version, addr, port = parsed
+        keys = self._keys if version == 4 else self._keys6
+        key = (addr << 16) | port
+        i = bisect_left(keys, key)
+        return i < len(keys) and keys[i] == key
+
+    def addresses(self) -> array:
+        """去重后的地址（uint32，升序）"""
+        self._compact()
+        result = array("I")
+        for key in self._keys:
+            addr = key >> 16
+            if not result or result[-1] != addr:
+                result.append(addr)
+        return result
+
+    def ports(self) -> array:
+        """与迭代顺序对齐的端口（uint16）"""
+        self._compact()
+        return array("H", (key & 0xFFFF for key in self._keys))
+
+    def to_strings(self) -> List[str]:
+        """按地址数值升序输出文本形式（IPv4在前、IPv6在后）"""
+        return ([format_candidate(addr, port) for addr, port in self]
+                + [format_endpoint(6, addr, port) for addr, port in self.iter_ipv6()])
+
+    def write_binary(self, path: str):
+        """原子写出IPv4记录（格式见模块说明；IPv6条目只出现在文本输出中）"""
+        self._compact()
+        with atomic_open(path, "wb") as f:
+            f.write(_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, _RECORD.size, len(self._keys), 0))
+            records = bytearray(_RECORD.size * len(self._keys))
+            for i, key in enumerate(self._keys):
+                _RECORD.pack_into(records, i * _RECORD.size, key >> 16, key & 0xFFFF, 0)
+            f.write(records)
+
+    @classmethod
+    def read_binary(cls, path: str) -> "PackedIPSet":
+        ipset = cls()
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            magic, version, record_size, count, _ = _HEADER.unpack_from(mm, 0)
+            if magic != BINARY_MAGIC or version != BINARY_VERSION or record_size != _RECORD.size:
+                raise ValueError(f"不支持的二进制IP文件：{path}")
+            for addr, port, _ in _RECORD.iter_unpack(mm[_HEADER.size:_HEADER.size + count * record_size]):
+                ipset._keys.append((addr << 16) | port)
+        return ipset
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+本地替身服务：
+- StandInServer：在后台线程提供固定页面，模拟上游IP源（支持ETag/Last-Modified条件请求、
+  注入延迟与失败率；也可作为HTTP代理，把 http://真实主机/路径 映射到 /真实主机/路径 的页面）
+- DelayedListener：注入TLS握手延迟的本地监听器，用于验证测速排序（只对TLS探测有效，见类说明）
+"""
+
+import os
+import ssl
+import time
+import random
+import asyncio
+import hashlib
+import subprocess
+import threading
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple, Union
+from urllib.parse import urlsplit
+
+class StandInServer:
+    """
+    用法：
+        with StandInServer({'/ips': '1.1.1.1\\n2.2.2.2'}) as server:
+            requests.get(server.url('/ips'))
+    latency：每个响应前的延迟秒数，可为 (最小, 最大) 区间
+    failure_rate：以该概率返回503
+    """
+
+    def __init__(self, pages: Optional[Dict[str, str]] = None, host: str = "127.0.0.1", port: int = 0,
+                 latency: Union[float, Tuple[float, float]] = 0.0, failure_rate: float = 0.0,
+                 seed: Optional[int] = None):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self._random = random.Random(seed)
+        self.pages: Dict[str, dict] = {}
+        self.hits: Dict[str, Dict[int, int]] = {}  # 路径 -> {状态码: 次数}
+        self._lock = threading.Lock()
+        for path, body in (pages or {}).items():
+            self.set_page(path, body)
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    def set_page(self, path: str, body: str, etag: bool = True, last_modified: bool = True):
+        """设置/更新页面内容；内容变化时ETag与Last-Modified随之变化"""
+        data = body.encode("utf-8")
+        with self._lock:
+            self.pages[path] = {
+                "body": data,
+                "etag": f'"{hashlib.md5(data).hexdigest()}"' if etag else None,
+                "last_modified": formatdate(usegmt=True) if last_modified else None,
+            }
+
+    def url(self, path: str = "/") -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}{path}"
+
+    def count(self, path: str, status: int) -> int:
+        with self._lock:
+            return self.hits.get(path, {}).get(status, 0)
+
+    def _next_fault(self) -> Tuple[float, bool]:
+        """返回 (本次延迟, 是否注入失败)"""
+        with self._lock:
+            latency = self.latency
+            if isinstance(latency, tuple):
+                latency = self._random.uniform(*latency)
+            return latency, self._random.random() < self.failure_rate
+
+    @staticmethod
+    def _page_key(raw_path: str) -> str:
+        # 代理模式下请求行是绝对URL：http://host/path -> /host/path
+        if raw_path.startswith(("http://", "https://")):
+            parts = urlsplit(raw_path)
+            return f"/{parts.netloc}{parts.path or '/'}" + (f"?{parts.query}" if parts.query else "")
+        return raw_path
+
+    def _record(self, path: str, status: int):
+        with self._lock:
+            per_path = self.hits.setdefault(path, {})
+            per_path[status] = per_path.get(status, 0) + 1
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = server._page_key(self.path)
+                latency, fail = server._next_fault()
+                if latency:
+                    time.sleep(latency)
+                with server._lock:
+                    page = server.pages.get(path)
+                if page is None or fail:
+                    status = 404 if page is None else 503
+                    server._record(path, status)
+                    self.send_error(status)
+                    return
+                inm = self.headers.get("If-None-Match")
+                ims = self.headers.get("If-Modified-Since")
+                if (page["etag"] and inm == page["etag"]) or (
+                    not inm and page["last_modified"] and ims == page["last_modified"]
+                ):
+                    server._record(path, 304)
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                server._record(path, 200)
+                self.send_response(200)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(page["body"])))
+                if page["etag"]:
+                    self.send_header("ETag", page["etag"])
+                if page["last_modified"]:
+                    self.send_header("Last-Modified", page["last_modified"])
+                self.end_headers()
+                self.wfile.write(page["body"])
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self) -> "StandInServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "StandInServer":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+def make_self_signed_cert(directory: str) -> tuple:
+    """用openssl命令生成临时自签名证书，返回 (certfile, keyfile)"""
+    certfile = os.path.join(directory, "cert.pem")
+    keyfile = os.path.join(directory, "key.pem")
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+         "-subj", "/CN=localhost", "-keyout", keyfile, "-out", certfile],
+        check=True, capture_output=True,
+    )
+    return certfile, keyfile
+
+class DelayedListener:
+    """
+    asyncio本地TLS监听器：接受连接后等待delay秒再进行TLS握手
+    用法：
+        async with DelayedListener(0.05, certfile, keyfile) as listener:
+            await probe_once("127.0.0.1", listener.port, 1.0, make_tls_context())
+    只适用于TLS探测：TCP三次握手由内核在accept之前完成，用户态无法推迟，
+    纯TCP探测（probe.py --tcp）测到的是本机回环的连接耗时，与delay无关
+    """
+
+    def __init__(self, delay: float, certfile: str, keyfile: str, host: str = "127.0.0.1"):
+        self.delay = delay
+        self.host = host
+        self.port = 0
+        self._context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        self._context.load_cert_chain(certfile, keyfile)
+        self._server = None
+
+    def _make_protocol(self):
+        listener = self
+
+        class DelayedProtocol(asyncio.Protocol):
+            def connection_made(self, transport):
+                # 立即暂停读取，避免ClientHello在延迟期间被普通读取消费掉
+                transport.pause_reading()
+                self.transport = transport
+                self.task = asyncio.ensure_future(self._handshake())
+
+            async def _handshake(self):
+                try:
+                    await asyncio.sleep(listener.delay)
+                    loop = asyncio.get_running_loop()
+                    self.transport = await loop.start_tls(
+                        self.transport, self, listener._context, server_side=True
+                    )
+                except (OSError, ssl.SSLError, ConnectionError):
+                    self.transport.close()
+
+            def data_received(self, data):
+                pass
+
+        return DelayedProtocol
+
+    async def start(self) -> "DelayedListener":
+        loop = asyncio.get_running_loop()
+        self._server = await loop.create_server(self._make_protocol(), self.host, 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def __aenter__(self) -> "DelayedListener":
+        return await self.start()
+
+    async def __aexit__(self, *exc):
+        await self.stop()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+运行指标：按阶段计时、按来源计数，并在运行结束时写出机器可读的JSON报告；可选cProfile剖析
+
+    from metrics import METRICS
+    with METRICS.timer('fetch_direct', source=url):
+        ...
+    METRICS.count('bytes', len(body), source=url)
+    METRICS.write_report()
+
+阶段耗时按线程累加（并发抓取时各站点耗时之和可能大于总耗时），wall_s 为本次运行的实际耗时
+"""
+
+import os
+import json
+import time
+import logging
+import cProfile
+import pstats
+import threading
+import contextlib
+from typing import Dict, Optional
+
+from atomic_io import write_json
+
+REPORT_FILE = "run_report.json"
+PROFILE_ENV = "YXIP_PROFILE"  # 设置为输出路径（.prof）时对整次运行做cProfile剖析
+
+class RunMetrics:
+    """线程安全的计时器/计数器集合；stages/counters 为全局汇总，sources 为按来源（站点URL）的明细"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started_at = time.time()
+            self._started = time.perf_counter()
+            self.stages: Dict[str, Dict[str, float]] = {}
+            self.counters: Dict[str, int] = {}
+            self.sources: Dict[str, Dict] = {}
+
+    def _source(self, source: str) -> Dict:
+        entry = self.sources.get(source)
+        if entry is None:
+            entry = self.sources[source] = {"timings": {}}
+        return entry
+
+    @staticmethod
+    def _add_timing(timings: Dict, stage: str, seconds: float):
+        timing = timings.get(stage)
+        if timing is None:
+            timing = timings[stage] = {"seconds": 0.0, "count": 0, "max_s": 0.0}
+        timing["seconds"] += seconds
+        timing["count"] += 1
+        timing["max_s"] = max(timing["max_s"], seconds)
+
+    def add_time(self, stage: str, seconds: float, source: Optional[str] = None):
+        with self._lock:
+            self._add_timing(self.stages, stage, seconds)
+            if source is not None:
+                self._add_timing(self._source(source)["timings"], stage, seconds)
+
+    @contextlib.contextmanager
+    def timer(self, stage: str, source: Optional[str] = None):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(stage, time.perf_counter() - start, source)
+
+    def count(self, name: str, n: int = 1, source: Optional[str] = None):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+            if source is not None:
+                entry = self._source(source)
+                entry[name] = entry.get(name, 0) + n
+
+    def report(self, **extra) -> Dict:
+        with self._lock:
+            report = {
+                "started_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started_at)),
+                "wall_s": time.perf_counter() - self._started,
+                "stages": json.loads(json.dumps(self.stages)),
+                "counters": dict(self.counters),
+                "sources": json.loads(json.dumps(self.sources)),
+            }
+        report.update(extra)
+        return report
+
+    def write_report(self, path: str = REPORT_FILE, **extra) -> Dict:
+        """原子写出JSON报告；extra中的键原样并入报告顶层（如命令、输出数量）"""
+        report = self.report(**extra)
+        write_json(path, report, indent=2)
+        logging.info(f"运行报告已保存至 {os.path.abspath(path)}（耗时 {report['wall_s']:.1f} 秒）")
+        return report
+
+METRICS = RunMetrics()
+
+@contextlib.contextmanager
+def profiled(path: Optional[str] = None, top: int = 25):
+    """
+    对代码块做cProfile剖析并把结果写入path（默认取环境变量 YXIP_PROFILE，均为空时不剖析）；
+    只统计调用线程，线程池中的抓取/解析在主线程中表现为等待时间
+    """
+    path = path or os.environ.get(PROFILE_ENV)
+    if not path:
+        yield None
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
+        stats = pstats.Stats(profiler).sort_stats("cumulative")
+        logging.info(f"剖析结果已保存至 {os.path.abspath(path)}（可用 python -m pstats 查看）")
+        stats.print_stats(top)
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""
+采集→筛选一体化流水线：抓取、提取、校验、地区分类、输出按流式生成器串联在同一进程内，
+任一站点抓取完成即开始提取与分类，无需等待全部采集结束再由单独的定时任务筛选
+
+用法：
+    python pipeline.py                                # 全部阶段
+    python pipeline.py --stages fetch,extract,validate,classify
+    python pipeline.py --stages classify,output --input ip.txt   # 只写 ip2.txt，不改动 ip.txt 与IP库
+每个阶段也可以单独导入使用：fetch / extract / validate / classify / output / read_candidates
+"""
+
+import sys
+import time
+import queue
+import asyncio
+import logging
+import argparse
+import threading
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence
+
+import ip_filter
+from ip_store import IPStore, STORE_FILE
+from ipset import endpoint_sort_key
+from collect_ips import (
+    URLS, OUTPUT_FILE, PROBE_ENABLED, RUN_DEADLINE, AsyncFetchEngine, build_engine,
+    _clean_ips, _extract_with_cache, run_with_deadline, write_collection_outputs,
+)
+from metrics import METRICS, REPORT_FILE, profiled
+from probe import probe_and_write
+from source_health import SourceHealth
+
+STAGES = ('fetch', 'extract', 'validate', 'classify', 'output', 'probe')
+DEFAULT_STAGES = STAGES if PROBE_ENABLED else STAGES[:-1]
+TARGET_FILE = "ip2.txt"
+
+class Batch(NamedTuple):
+    """流水线中流动的单元：一个来源（站点URL或输入文件）在当前阶段的结果"""
+    source: str
+    html: str = ""
+    ips: Sequence[str] = ()
+    regions: Optional[Dict[str, Optional[str]]] = None
+
+_DONE = object()
+
+# -------------------------- 各阶段 --------------------------
+def fetch(engine: AsyncFetchEngine, urls: Dict[str, List[str]] = URLS,
+          deadline: Optional[float] = None) -> Iterator[Batch]:
+    """
+    在后台线程运行异步抓取引擎，每个站点完成即产出，不等待其他站点（熔断中的站点不抓取）；
+    镜像组中较慢的站点会被对冲，Batch.source 为实际提供页面的站点；deadline 到达后不再等待剩余站点
+    """
+    jobs = engine.schedule(urls)
+    results: "queue.Queue" = queue.Queue()
+
+    async def fetch_one(url: str, risk_level: str):
+        try:
+            served, html = await engine.fetch_hedged(url, risk_level)
+        except Exception as e:
+            logging.error(f"[{url}] 抓取失败：{e}")
+            served, html = url, ""
+        results.put(Batch(served, html=html))
+
+    async def fetch_all():
+        await run_with_deadline(engine, jobs, fetch_one, deadline)
+
+    def run():
+        try:
+            asyncio.run(fetch_all())
+        finally:
+            results.put(_DONE)
+
+    logging.info(f"=== 并发抓取 {len(jobs)} 个站点 ===")
+    threading.Thread(target=run, name="fetch-stage", daemon=True).start()
+    while True:
+        batch = results.get()
+        if batch is _DONE:
+            return
+        yield batch
+
+def extract(batches: Iterable[Batch], cache=None) -> Iterator[Batch]:
+    """从页面提取原始IP（命中条件请求缓存时直接复用）"""
+    for batch in batches:
+        try:
+            ips = _extract_with_cache(batch.html, batch.source, cache)
+        except Exception as e:
+            logging.error(f"[{batch.source}] 提取失败：{e}")
+            ips = []
+        yield batch._replace(html="", ips=ips)
+
+def validate(batches: Iterable[Batch], health: Optional[SourceHealth] = None) -> Iterator[Batch]:
+    """格式校验、过滤保留地址并规范化；传入站点健康模型时记录各站点的有效IP数"""
+    for batch in batches:
+        with METRICS.timer('validate', source=batch.source):
+            ips = sorted(_clean_ips(batch.ips, batch.source))
+        METRICS.count('ips_kept', len(ips), source=batch.source)
+        if health is not None:
+            health.record_result(batch.source, len(ips))
+        logging.info(f"[{batch.source}] 有效IP：{len(ips)} 个")
+        yield batch._replace(ips=ips)
+
+def classify(batches: Iterable[Batch], index: Optional[ip_filter.RegionIndex] = None) -> Iterator[Batch]:
+    """
+    按地区IP段分类（IPv4经/24分类缓存，IPv6查前缀树），
+    regions中非目标地区（或带端口的条目）为None
+    """
+    cache = ip_filter.open_prefix_cache(index)
+    for batch in batches:
+        regions = {}
+        with METRICS.timer('classify', source=batch.source):
+            for ip in batch.ips:
+                regions[ip] = ip_filter.classify_ip(ip, cache)
+        METRICS.count('ips_target', sum(region is not None for region in regions.values()), source=batch.source)
+        yield batch._replace(regions=regions)
+    cache.report(logging.info)
+
+def output(batches: Iterable[Batch], store_path: str = STORE_FILE, target_file: str = TARGET_FILE,
+           record: bool = True) -> List[str]:
+    """
+    汇总各来源结果，经过分类阶段时写出 ip2.txt；返回排序后的有效IP
+    record为True（本次经过抓取阶段）时同时入库并写出 ip.txt / ip.bin / ip_delta.txt，
+    并推进IP库的筛选位置（ip_filter 增量筛选不会重复处理）；
+    record为False（候选来自文件）时只写 ip2.txt：文件内容不是一次采集结果，入库会把其余IP误判为移除
+    """
+    ips_by_source: Dict[str, Sequence[str]] = {}
+    regions: Dict[str, Optional[str]] = {}
+    classified = False
+    for batch in batches:
+        ips_by_source[batch.source] = batch.ips
+        if batch.regions is not None:
+            classified = True
+            regions.update(batch.regions)
+
+    if not record:
+        with METRICS.timer('output'):
+            targets = sorted((ip for ip, region in regions.items() if region is not None), key=endpoint_sort_key)
+            if classified:
+                ip_filter.write_ip_list(targets, target_file)
+                logging.info(f"目标地区IP：{len(targets)} 个，保存至 {target_file}")
+        return sorted({ip for ips in ips_by_source.values() for ip in ips}, key=endpoint_sort_key)
+
+    with IPStore(store_path) as store, METRICS.timer('output'):
+        sorted_ips = write_collection_outputs(store, ips_by_source)
+        if classified:
+            store.set_regions(regions)
+            targets = store.active_regions()
+            ip_filter.write_ip_list(sorted(targets, key=endpoint_sort_key), target_file)
+            store.set_meta('filter_seq', store.last_change_seq())
+            store.set_meta('region_version', ip_filter.region_version())
+            store.prune_changes(store.last_change_seq())
+            logging.info(f"目标地区IP：{len(targets)} 个，保存至 {target_file}")
+    return sorted_ips
+
+def read_candidates(input_file: str = OUTPUT_FILE) -> Iterator[Batch]:
+    """从文件读取候选IP（跳过抓取/提取阶段时作为流水线输入）"""
+    with open(input_file, "r", encoding="utf8") as f:
+        yield Batch(f"file:{input_file}", ips=[line.strip() for line in f if line.strip()])
+
+# -------------------------- 编排 --------------------------
+def parse_stages(text: str) -> List[str]:
+    """校验阶段选择：必须按顺序且连续（probe除外）；不含fetch时不能从extract开始"""
+    stages = [s.strip() for s in text.split(",") if s.strip()]
+    unknown = [s for s in stages if s not in STAGES]
+    if unknown:
+        raise ValueError(f"未知阶段：{unknown}，可选：{','.join(STAGES)}")
+    core = [s for s in stages if s != 'probe']
+    positions = [STAGES.index(s) for s in core]
+    if not stages:
+        raise ValueError("至少选择一个阶段")
+    if positions and positions != list(range(positions[0], positions[0] + len(positions))):
+        raise ValueError(f"阶段必须按顺序且连续：{','.join(STAGES[:-1])}")
+    if core and core[0] == 'extract':
+        raise ValueError("extract 阶段需要页面内容，不能脱离 fetch 单独运行")
+    return stages
+
+def run(stages: Sequence[str] = DEFAULT_STAGES, input_file: str = OUTPUT_FILE,
+        urls: Dict[str, List[str]] = URLS, run_deadline: Optional[float] = RUN_DEADLINE) -> List[str]:
+    """按选定阶段运行流水线，返回最终的候选IP；run_deadline 为抓取阶段的总时限（秒，None表示不限）"""
+    engine = None
+    if 'fetch' in stages:
+        engine = build_engine()
+        deadline = None if run_deadline is None else time.monotonic() + run_deadline
+        stream: Iterable[Batch] = fetch(engine, urls, deadline)
+        if 'extract' in stages:
+            stream = extract(stream, engine.fetcher.cache)
+    else:
+        stream = read_candidates(input_file)
+
+    try:
+        if 'validate' in stages:
+            stream = validate(stream, engine.health if engine is not None else None)
+        # 不含fetch时输出阶段只负责写 ip2.txt，因此总要先分类
+        if 'classify' in stages or ('output' in stages and engine is None):
+            stream = classify(stream)
+        if 'output' in stages:
+            ips = output(stream, record=engine is not None)
+        else:
+            ips = []
+            for batch in stream:
+                for ip in batch.ips:
+                    region = batch.regions.get(ip) if batch.regions is not None else None
+                    print(f"{ip}\t{region}" if batch.regions is not None else ip)
+                    ips.append(ip)
+    finally:
+        if engine is not None:
+            engine.fetcher.close()
+            engine.fetcher.cache.save()
+            engine.health.save()
+
+    if 'probe' in stages and ips:
+        logging.info("=== 候选IP测速 ===")
+        with METRICS.timer('probe'):
+            probe_and_write(ips)
+    return ips
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Cloudflare优选IP 采集→筛选一体化流水线")
+    parser.add_argument("--stages", default=",".join(DEFAULT_STAGES),
+                        help=f"逗号分隔的阶段（按顺序且连续），可选：{','.join(STAGES)}")
+    parser.add_argument("--input", default=OUTPUT_FILE, help="不含fetch阶段时读取的候选文件")
+    parser.add_argument("--deadline", type=float, default=RUN_DEADLINE,
+                        help="抓取阶段总时限（秒），到达后放弃未完成的站点，0表示不限")
+    parser.add_argument("--report", default=REPORT_FILE, help="JSON运行报告路径（空字符串表示不写）")
+    parser.add_argument("--profile", default=None, help="cProfile结果输出路径（.prof），默认不剖析")
+    args = parser.parse_args(argv)
+    try:
+        stages = parse_stages(args.stages)
+    except ValueError as e:
+        parser.error(str(e))
+    status, error, ips = 0, None, []
+    with profiled(args.profile):
+        try:
+            ips = run(stages, input_file=args.input, run_deadline=args.deadline or None)
+        except (ip_filter.FilterError, OSError) as e:
+            logging.error(f"流水线失败：{e}")
+            status, error = 1, str(e)
+    if args.report:
+        METRICS.write_report(args.report, command="pipeline", selected_stages=list(stages), total_ips=len(ips), error=error)
+    return status
+
+if __name__ == "__main__":
+    sys.exit(main())
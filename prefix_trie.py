@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+IPv4/IPv6 统一的最长前缀匹配：每个地址族一棵路径压缩的二进制基数树（Patricia trie），键为整数地址
+查找最多走过地址位宽（32/128）位、只在分叉处停留，耗时与网段数量无关；
+任意 [起, 止] 区间先拆成对齐的CIDR块再插入，因此区间表（地区IP段、保留地址、官方网段）都可直接装入
+
+    trie = PrefixTrie()
+    trie.add_cidr("2606:4700::/32", "cloudflare")
+    trie.lookup(*parse_ip("2606:4700:3030::6815:1a0b"))   # -> "cloudflare"
+"""
+
+import ipaddress
+from typing import Iterator, Optional, Tuple
+
+WIDTH = {4: 32, 6: 128}
+
+# 节点为list：[边标签位, 标签位数, 标签掩码, 值, 0号子节点, 1号子节点]；
+# 边标签为从父节点到本节点经过的地址位（含分叉位），根节点标签为空
+_BITS, _LEN, _MASK, _VALUE, _CHILD = 0, 1, 2, 3, 4
+_EMPTY = object()
+
+def _node(bits: int, length: int, value=_EMPTY) -> list:
+    return [bits, length, (1 << length) - 1, value, None, None]
+
+def parse_ip(text: str) -> Optional[Tuple[int, int]]:
+    """解析IPv4点分十进制或IPv6文本为 (地址族4/6, 整数地址)，非法时返回None"""
+    if ':' not in text:
+        parts = text.split('.')
+        # 每段1~3位ASCII数字（int() 还会接受正负号、下划线、空白与全角数字）
+        if len(parts) != 4 or not text.isascii() or not all(p.isdigit() and len(p) <= 3 for p in parts):
+            return None
+        o1, o2, o3, o4 = map(int, parts)
+        if not (0 <= o1 <= 255 and 0 <= o2 <= 255 and 0 <= o3 <= 255 and 0 <= o4 <= 255):
+            return None
+        return 4, (o1 << 24) | (o2 << 16) | (o3 << 8) | o4
+    try:
+        return 6, int(ipaddress.IPv6Address(text))
+    except ValueError:
+        return None
+
+def format_ip(version: int, addr: int) -> str:
+    if version == 4:
+        return f"{addr >> 24}.{(addr >> 16) & 0xFF}.{(addr >> 8) & 0xFF}.{addr & 0xFF}"
+    return ipaddress.IPv6Address(addr).compressed
+
+def parse_network(cidr: str) -> Tuple[int, int, int]:
+    """CIDR -> (地址族, 网络地址整数, 前缀长度)，主机位非零时按网段对齐"""
+    network = ipaddress.ip_network(cidr.strip(), strict=False)
+    return network.version, int(network.network_address), network.prefixlen
+
+def range_to_prefixes(start: int, end: int, width: int) -> Iterator[Tuple[int, int]]:
+    """把 [start, end] 拆成最少的对齐CIDR块，逐个产出 (网络地址, 前缀长度)"""
+    while start <= end:
+        size = (start & -start).bit_length() - 1 if start else width
+        while size and start + (1 << size) - 1 > end:
+            size -= 1
+        yield start, width - size
+        start += 1 << size
+
+class PrefixTrie:
+    """最长前缀匹配表：值可以是任意对象（地区名、True等），后插入的相同前缀覆盖先插入的值"""
+
+    def __init__(self):
+        self._roots = {version: _node(0, 0) for version in WIDTH}
+        self.prefixes = {version: 0 for version in WIDTH}
+
+    def __len__(self) -> int:
+        return sum(self.prefixes.values())
+
+    def insert(self, version: int, network: int, prefix_len: int, value=True):
+        width = WIDTH[version]
+        key = network >> (width - prefix_len) if prefix_len else 0  # 前缀位（高位在前）
+        node, depth = self._roots[version], 0
+        while depth < prefix_len:
+            rest = prefix_len - depth
+            slot = _CHILD + ((key >> (rest - 1)) & 1)
+            child = node[slot]
+            if child is None:
+                node[slot] = _node(key & ((1 << rest) - 1), rest, value)
+                self.prefixes[version] += 1
+                return
+            clen = child[_LEN]
+            n = min(clen, rest)
+            kbits = (key >> (rest - n)) & ((1 << n) - 1)
+            cbits = child[_BITS] >> (clen - n)
+            if kbits == cbits and n == clen:
+                node, depth = child, depth + clen
+                continue
+            # 在公共部分之后拆分子节点的边：common >= 1（分叉位相同才会进入同一子节点）
+            common = n - (kbits ^ cbits).bit_length()
+            mid = _node(child[_BITS] >> (clen - common), common)
+            tail_len = clen - common
+            child[_BITS] &= (1 << tail_len) - 1
+            child[_LEN], child[_MASK] = tail_len, (1 << tail_len) - 1
+            mid[_CHILD + ((child[_BITS] >> (tail_len - 1)) & 1)] = child
+            node[slot] = mid
+            if common == rest:
+                mid[_VALUE] = value
+            else:
+                leaf_len = rest - common
+                leaf = _node(key & ((1 << leaf_len) - 1), leaf_len, value)
+                mid[_CHILD + ((leaf[_BITS] >> (leaf_len - 1)) & 1)] = leaf
+            self.prefixes[version] += 1
+            return
+        if node[_VALUE] is _EMPTY:
+            self.prefixes[version] += 1
+        node[_VALUE] = value
+
+    def add_cidr(self, cidr: str, value=True):
+        self.insert(*parse_network(cidr), value)
+
+    def add_range(self, version: int, start: int, end: int, value=True):
+        for network, prefix_len in range_to_prefixes(start, end, WIDTH[version]):
+            self.insert(version, network, prefix_len, value)
+
+    def lookup(self, version: int, addr: int, default=None):
+        """最长前缀匹配，未命中返回default"""
+        # 热路径：节点字段用字面下标（_BITS=0, _LEN=1, _MASK=2, _VALUE=3, _CHILD=4），避免逐次查全局名
+        empty = _EMPTY
+        node = self._roots[version]
+        pos = WIDTH[version]
+        best = default
+        while True:
+            length = node[1]
+            if length:
+                pos -= length
+                if (addr >> pos) & node[2] != node[0]:
+                    return best
+            if node[3] is not empty:
+                best = node[3]
+            if not pos:
+                return best
+            node = node[4 + ((addr >> (pos - 1)) & 1)]
+            if node is None or node[1] > pos:
+                return best
+
+    def lookup_ip(self, text: str, default=None):
+        parsed = parse_ip(text)
+        return default if parsed is None else self.lookup(*parsed, default)
+
+    def __contains__(self, item: Tuple[int, int]) -> bool:
+        return self.lookup(*item, default=_EMPTY) is not _EMPTY
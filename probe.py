@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+候选IP延迟探测：并发进行TCP连接或TLS握手，按中位延迟/抖动/丢包排序，输出测速排名与前N名优选IP
+"""
+
+import ssl
+import time
+import asyncio
+import argparse
+import logging
+import statistics
+from typing import Iterable, List, NamedTuple, Optional, Tuple
+
+from atomic_io import atomic_open
+
+DEFAULT_PORT = 443
+DEFAULT_SNI = "speed.cloudflare.com"  # 按IP连接Cloudflare时必须带SNI，否则握手被拒绝
+PROBE_CONCURRENCY = 200
+PROBE_TIMEOUT = 2.0
+PROBE_SAMPLES = 3
+PROBE_TOP_N = 20
+RANKED_FILE = "ip_latency.txt"
+TOP_FILE = "ip_top.txt"
+
+class ProbeResult(NamedTuple):
+    candidate: str           # 原始候选（ip 或 ip:port）
+    host: str
+    port: int
+    samples: List[float]     # 成功样本的延迟（毫秒）
+    attempts: int
+
+    @property
+    def loss(self) -> float:
+        return 1 - len(self.samples) / self.attempts if self.attempts else 1.0
+
+    @property
+    def median(self) -> Optional[float]:
+        return statistics.median(self.samples) if self.samples else None
+
+    @property
+    def jitter(self) -> Optional[float]:
+        """相邻样本差值绝对值的平均数；单样本时为0"""
+        if not self.samples:
+            return None
+        if len(self.samples) == 1:
+            return 0.0
+        diffs = [abs(b - a) for a, b in zip(self.samples, self.samples[1:])]
+        return sum(diffs) / len(diffs)
+
+    def sort_key(self) -> Tuple:
+        if not self.samples:
+            return (1, 1.0, float("inf"), float("inf"))
+        return (0, round(self.loss, 3), self.median, self.jitter)
+
+def split_candidate(candidate: str, default_port: int = DEFAULT_PORT) -> Tuple[str, int]:
+    """'ip'、'ip:port'、'v6' 或 '[v6]:port' -> (主机, 端口)"""
+    candidate = candidate.strip()
+    if candidate.startswith("["):
+        host, _, rest = candidate[1:].partition("]")
+        return host, int(rest[1:]) if rest.startswith(":") else default_port
+    if candidate.count(":") > 1:
+        return candidate, default_port
+    host, _, port = candidate.partition(":")
+    return host, int(port) if port else default_port
+
+def make_tls_context() -> ssl.SSLContext:
+    # 只测握手耗时，不校验证书（按IP直连时证书域名本就不匹配）
+    context = ssl.create_default_context()
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    return context
+
+async def probe_once(host: str, port: int, timeout: float,
+                     tls_context: Optional[ssl.SSLContext] = None, sni: str = DEFAULT_SNI) -> Optional[float]:
+    """一次TCP连接（tls_context不为None时含TLS握手），返回耗时毫秒，失败返回None"""
+    start = time.perf_counter()
+    writer = None
+    try:
+        _, writer = await asyncio.wait_for(
+            asyncio.open_connection(host, port, ssl=tls_context,
+                                    server_hostname=sni if tls_context else None),
+            timeout,
+        )
+        return (time.perf_counter() - start) * 1000
+    except (OSError, asyncio.TimeoutError, ssl.SSLError):
+        return None
+    finally:
+        if writer is not None:
+            writer.close()
+
+async def probe_candidate(candidate: str, semaphore: asyncio.Semaphore, samples: int, timeout: float,
+                          tls_context: Optional[ssl.SSLContext] = None, sni: str = DEFAULT_SNI) -> ProbeResult:
+    host, port = split_candidate(candidate)
+    results = []
+    for _ in range(samples):
+        # 每个样本单独占用并发名额，慢IP不会长期霸占信号量
+        async with semaphore:
+            latency = await probe_once(host, port, timeout, tls_context, sni)
+        if latency is not None:
+            results.append(latency)
+    return ProbeResult(candidate, host, port, results, samples)
+
+async def probe_all(candidates: Iterable[str], concurrency: int = PROBE_CONCURRENCY,
+                    timeout: float = PROBE_TIMEOUT, samples: int = PROBE_SAMPLES,
+                    tls: bool = True, sni: str = DEFAULT_SNI) -> List[ProbeResult]:
+    """并发探测全部候选，返回按（丢包, 中位延迟, 抖动）排序的结果"""
+    semaphore = asyncio.Semaphore(concurrency)
+    tls_context = make_tls_context() if tls else None
+    results = await asyncio.gather(*(
+        probe_candidate(candidate, semaphore, samples, timeout, tls_context, sni)
+        for candidate in dict.fromkeys(candidates)
+    ))
+    return sorted(results, key=ProbeResult.sort_key)
+
+def write_results(results: List[ProbeResult], ranked_file: str = RANKED_FILE,
+                  top_file: str = TOP_FILE, top_n: int = PROBE_TOP_N):
+    """排名文件：候选\t中位延迟ms\t抖动ms\t丢包率；前N文件：每行一个可用候选（均原子替换，serve.py 不会读到半个文件）"""
+    with atomic_open(ranked_file) as f:
+        f.write("# candidate\tmedian_ms\tjitter_ms\tloss\n")
+        for r in results:
+            if r.samples:
+                f.write(f"{r.candidate}\t{r.median:.1f}\t{r.jitter:.1f}\t{r.loss:.0%}\n")
+            else:
+                f.write(f"{r.candidate}\t-\t-\t100%\n")
+    reachable = [r.candidate for r in results if r.samples]
+    with atomic_open(top_file) as f:
+        f.write("\n".join(reachable[:top_n]))
+
+def probe_and_write(candidates: Iterable[str], **kwargs) -> List[ProbeResult]:
+    """同步入口：探测并写出排名/前N文件（供collect_ips.main调用）"""
+    write_kwargs = {k: kwargs.pop(k) for k in ("ranked_file", "top_file", "top_n") if k in kwargs}
+    start = time.perf_counter()
+    results = asyncio.run(probe_all(candidates, **kwargs))
+    write_results(results, **write_kwargs)
+    reachable = sum(1 for r in results if r.samples)
+    logging.info(f"测速完成：{len(results)} 个候选，可用 {reachable} 个，耗时 {time.perf_counter() - start:.1f} 秒")
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="候选IP并发测速（TCP连接/TLS握手）")
+    parser.add_argument("--input", default="ip.txt", help="候选文件，每行 ip 或 ip:port")
+    parser.add_argument("--ranked", default=RANKED_FILE, help="测速排名输出文件")
+    parser.add_argument("--top-file", default=TOP_FILE, help="前N名输出文件")
+    parser.add_argument("--top", type=int, default=PROBE_TOP_N, help="前N名数量")
+    parser.add_argument("--concurrency", type=int, default=PROBE_CONCURRENCY)
+    parser.add_argument("--timeout", type=float, default=PROBE_TIMEOUT, help="单次探测超时（秒）")
+    parser.add_argument("--samples", type=int, default=PROBE_SAMPLES, help="每个IP的采样次数")
+    parser.add_argument("--tcp", action="store_true", help="只测TCP连接，不做TLS握手")
+    parser.add_argument("--sni", default=DEFAULT_SNI)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="[%(asctime)s] %(levelname)s - %(message)s", datefmt="%H:%M:%S")
+    with open(args.input, "r", encoding="utf8") as f:
+        candidates = [line.strip() for line in f if line.strip()]
+    probe_and_write(
+        candidates,
+        concurrency=args.concurrency,
+        timeout=args.timeout,
+        samples=args.samples,
+        tls=not args.tcp,
+        sni=args.sni,
+        ranked_file=args.ranked,
+        top_file=args.top_file,
+        top_n=args.top,
+    )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+"""
+IP列表HTTP服务：把 ip.txt / ip2.txt 常驻内存，加载时即构建好全部响应（正文、gzip压缩正文、ETag与完整响应头），
+请求路径上只做查表与一次写出，不读文件、不格式化、不压缩
+
+    GET /ip2.txt                      整个列表（与文件内容一致）
+    GET /ip2.txt?region=香港          只含该地区的条目（按 region_ranges.txt 分类，与 ip2.txt 一样不含带端口的条目）
+    GET /ip.txt?top=50                测速排名前50（按 ip_latency.txt 排序，未测速的排在最后）
+    GET /ip.txt?region=日本&top=10    两者可以组合
+    GET /healthz                      当前快照的加载时间与各列表/地区条目数（JSON）
+
+支持 If-None-Match / If-Modified-Since 条件请求（304）与 Accept-Encoding: gzip；
+源文件变化（流水线以原子替换写出）时后台重新加载，新快照构建完成后整体替换，请求不会看到半新半旧的内容
+"""
+
+import os
+import sys
+import gzip
+import json
+import time
+import signal
+import hashlib
+import logging
+import argparse
+import threading
+from array import array
+from collections import OrderedDict
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import ip_filter
+from probe import RANKED_FILE
+
+SERVE_LISTS = ("ip.txt", "ip2.txt")  # 对外提供的列表文件，URL路径为 /文件名
+HOST = "0.0.0.0"
+PORT = 8080
+RELOAD_INTERVAL = 2.0  # 检查源文件变化的间隔（秒）
+TOP_PRESETS = (10, 20, 50, 100)  # 加载时预先构建的 top 取值，其余取值首次请求时构建并缓存
+MAX_CACHED_RESPONSES = 1024  # 按需构建的响应最多缓存数量（每个快照单独计算）
+GZIP_LEVEL = 6
+CACHE_CONTROL = "public, max-age=60"
+
+class Representation(NamedTuple):
+    """一种编码下的完整响应：head 为状态行与响应头，GET 写出 head + body，HEAD 只写 head"""
+    etag: str
+    head: bytes
+    body: bytes
+    not_modified: bytes  # 条件请求命中时的完整304响应
+
+class Response(NamedTuple):
+    identity: Representation
+    gzip: Optional[Representation]  # 压缩后不比原文小时为None
+    last_modified: str
+
+def _head(status: str, headers: Sequence[Tuple[str, str]]) -> bytes:
+    lines = [f"HTTP/1.1 {status}"] + [f"{name}: {value}" for name, value in headers]
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1", "strict")
+
+def _representation(body: bytes, etag: str, content_type: str, last_modified: str,
+                    encoding: Optional[str] = None) -> Representation:
+    common = [("ETag", etag), ("Last-Modified", last_modified), ("Cache-Control", CACHE_CONTROL),
+              ("Vary", "Accept-Encoding")]
+    headers = [("Content-Type", content_type), ("Content-Length", str(len(body)))]
+    if encoding:
+        headers.append(("Content-Encoding", encoding))
+    return Representation(
+        etag=etag,
+        head=_head("200 OK", headers + common),
+        body=body,
+        not_modified=_head("304 Not Modified", common),
+    )
+
+def build_response(body: bytes, last_modified: str,
+                   content_type: str = "text/plain; charset=utf-8") -> Response:
+    """预先构建一个资源的全部表示：ETag取正文摘要，gzip表示使用独立的ETag"""
+    digest = hashlib.blake2b(body, digest_size=12).hexdigest()
+    identity = _representation(body, f'"{digest}"', content_type, last_modified)
+    compressed = gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+    gzipped = None
+    if len(compressed) < len(body):
+        gzipped = _representation(compressed, f'"{digest}-gz"', content_type, last_modified, encoding="gzip")
+    return Response(identity, gzipped, last_modified)
+
+def _error_response(status: str, message: str) -> bytes:
+    body = message.encode("utf-8")
+    return _head(status, [("Content-Type", "text/plain; charset=utf-8"), ("Content-Length", str(len(body)))]) + body
+
+BAD_REQUEST = _error_response("400 Bad Request", "top 必须是正整数")
+NOT_FOUND = _error_response("404 Not Found", "未找到该列表或地区")
+
+# -------------------------- 快照 --------------------------
+def load_ranking(path: str = RANKED_FILE) -> Dict[str, int]:
+    """测速排名文件 -> {候选: 名次}（文件已按延迟排序，丢包100%的排在最后）；文件不存在时为空"""
+    ranking: Dict[str, int] = {}
+    if not path or not os.path.exists(path):
+        return ranking
+    with open(path, "r", encoding="utf8") as f:
+        for line in f:
+            if line.startswith("#") or not line.strip():
+                continue
+            ranking.setdefault(line.split("\t", 1)[0].strip(), len(ranking))
+    return ranking
+
+class ListView:
+    """一个列表（或其中某地区）的条目：正文按文件顺序，另存按测速名次排列的正文与逐行结束偏移（供 top-N 切片）"""
+
+    def __init__(self, entries: List[str], ranking: Dict[str, int]):
+        self.count = len(entries)
+        self.body = "\n".join(entries).encode("utf-8")
+        unranked = len(ranking)
+        ranked = sorted(entries, key=lambda entry: ranking.get(entry, unranked))  # 稳定排序，未测速的保持文件顺序
+        self.ranked_body = "\n".join(ranked).encode("utf-8")
+        self.ranked_ends = array('I')
+        offset = 0
+        for entry in ranked:
+            offset += len(entry.encode("utf-8"))
+            self.ranked_ends.append(offset)
+            offset += 1
+
+    def top(self, n: int) -> bytes:
+        return self.ranked_body[:self.ranked_ends[n - 1]] if n > 0 else b""
+
+class Snapshot:
+    """某一时刻全部列表的只读视图与预构建响应；重新加载时整体替换，不在原对象上修改"""
+
+    def __init__(self, views: Dict[Tuple[str, Optional[str]], ListView], last_modified: Dict[str, str],
+                 signature: tuple):
+        self.views = views
+        self.last_modified = last_modified
+        self.signature = signature
+        self.loaded_at = time.time()
+        self.responses: Dict[tuple, Response] = {}
+        self._extra: "OrderedDict[tuple, Response]" = OrderedDict()
+        self._lock = threading.Lock()
+        for (name, region), view in views.items():
+            for n in (None,) + TOP_PRESETS:
+                key = self._key(name, region, n, view)
+                if key not in self.responses:
+                    self.responses[key] = self._build(key, view)
+        self.health = build_response(json.dumps(self.summary(), ensure_ascii=False).encode("utf-8"),
+                                     formatdate(self.loaded_at, usegmt=True), "application/json; charset=utf-8")
+
+    @staticmethod
+    def _key(name: str, region: Optional[str], top: Optional[int], view: ListView) -> tuple:
+        # top 超过条目数时等同于完整的排名列表，归一化后共用同一份响应
+        return name, region, None if top is None else min(top, view.count)
+
+    def _build(self, key: tuple, view: ListView) -> Response:
+        name, _, top = key
+        body = view.body if top is None else view.top(top)
+        return build_response(body, self.last_modified[name])
+
+    def response(self, name: str, region: Optional[str] = None, top: Optional[int] = None) -> Optional[Response]:
+        """查找（必要时构建并缓存）响应；列表或地区不存在时返回None"""
+        view = self.views.get((name, region))
+        if view is None:
+            return None
+        key = self._key(name, region, top, view)
+        response = self.responses.get(key)
+        if response is not None:
+            return response
+        with self._lock:
+            response = self._extra.get(key)
+            if response is not None:
+                self._extra.move_to_end(key)
+                return response
+        response = self._build(key, view)
+        with self._lock:
+            self._extra[key] = response
+            while len(self._extra) > MAX_CACHED_RESPONSES:
+                self._extra.popitem(last=False)
+        return response
+
+    def summary(self) -> Dict:
+        lists: Dict[str, Dict] = {}
+        for (name, region), view in self.views.items():
+            entry = lists.setdefault(name, {"count": 0, "regions": {}})
+            if region is None:
+                entry["count"] = view.count
+            else:
+                entry["regions"][region] = view.count
+        return {"loaded_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.loaded_at)), "lists": lists}
+
+def file_signature(paths: Sequence[str]) -> tuple:
+    """源文件的 (路径, inode, 大小, 修改时间) 组合，任一变化即需要重新加载（文件不存在记为None）"""
+    signature = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except OSError:
+            signature.append((path, None))
+            continue
+        signature.append((path, st.st_ino, st.st_size, st.st_mtime_ns))
+    return tuple(signature)
+
+def load_snapshot(lists: Sequence[str] = SERVE_LISTS, ranked_file: Optional[str] = RANKED_FILE,
+                  region_file: str = ip_filter.REGION_FILE) -> Snapshot:
+    """读取列表文件并分类、排序、构建全部预置响应；不存在的列表文件跳过"""
+    signature = file_signature(list(lists) + [p for p in (ranked_file, region_file) if p])
+    index = ip_filter.RegionIndex.from_file(region_file)
+    cache = ip_filter.PrefixCache(index)
+    ranking = load_ranking(ranked_file)
+    views: Dict[Tuple[str, Optional[str]], ListView] = {}
+    last_modified: Dict[str, str] = {}
+    for path in lists:
+        if not os.path.exists(path):
+            logging.warning(f"列表文件不存在，暂不提供：{path}")
+            continue
+        name = os.path.basename(path)
+        with open(path, "r", encoding="utf8") as f:
+            last_modified[name] = formatdate(os.fstat(f.fileno()).st_mtime, usegmt=True)
+            entries = [line.strip() for line in f if line.strip()]
+        by_region: Dict[str, List[str]] = {region: [] for region in index.regions}
+        for entry in entries:
+            # 与 ip2.txt 相同的规则（ip_filter.classify_ip）：带端口的条目不归入任何地区
+            region = ip_filter.classify_ip(entry, cache)
+            if region is not None:
+                by_region[region].append(entry)
+        views[(name, None)] = ListView(entries, ranking)
+        for region, region_entries in by_region.items():
+            views[(name, region)] = ListView(region_entries, ranking)
+    return Snapshot(views, last_modified, signature)
+
+# -------------------------- 服务 --------------------------
+class ListServer:
+    """
+    用法：
+        with ListServer(port=8080) as server:
+            ...                      # server.url('/ip2.txt')
+    后台线程每隔 reload_interval 秒检查源文件，变化时构建新快照并整体替换（也可调用 reload()）
+    """
+
+    def __init__(self, lists: Sequence[str] = SERVE_LISTS, host: str = HOST, port: int = PORT,
+                 ranked_file: Optional[str] = RANKED_FILE, region_file: str = ip_filter.REGION_FILE,
+                 reload_interval: float = RELOAD_INTERVAL):
+        self.lists = tuple(lists)
+        self.ranked_file = ranked_file
+        self.region_file = region_file
+        self.reload_interval = reload_interval
+        self.reloads = 0
+        self.snapshot = self._load()
+        self._names = {os.path.basename(path) for path in self.lists}
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    def _load(self) -> Snapshot:
+        start = time.perf_counter()
+        snapshot = load_snapshot(self.lists, self.ranked_file, self.region_file)
+        counts = ", ".join(f"{name} {info['count']} 条" for name, info in snapshot.summary()["lists"].items())
+        logging.info(f"列表已加载：{counts or '无'}（预构建 {len(snapshot.responses)} 个响应，"
+                     f"耗时 {time.perf_counter() - start:.2f} 秒）")
+        return snapshot
+
+    def reload(self, force: bool = False) -> bool:
+        """源文件有变化（或force）时重新加载；加载失败保留旧快照。返回是否替换了快照"""
+        paths = list(self.lists) + [p for p in (self.ranked_file, self.region_file) if p]
+        if not force and file_signature(paths) == self.snapshot.signature:
+            return False
+        try:
+            snapshot = self._load()
+        except (OSError, ValueError) as e:
+            logging.error(f"重新加载失败，继续使用旧列表：{e}")
+            return False
+        self.snapshot = snapshot  # 引用替换是原子的：进行中的请求继续使用旧快照
+        self.reloads += 1
+        return True
+
+    def _watch(self):
+        while not self._stop.wait(self.reload_interval):
+            self.reload()
+
+    def url(self, path: str = "/") -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}{path}"
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                self._serve(send_body=True)
+
+            def do_HEAD(self):
+                self._serve(send_body=False)
+
+            def _serve(self, send_body: bool):
+                snapshot = server.snapshot
+                parts = urlsplit(self.path)
+                name = unquote(parts.path).lstrip("/")
+                if name == "healthz":
+                    response = snapshot.health
+                elif name in server._names:
+                    query = parse_qs(parts.query) if parts.query else {}
+                    top = None
+                    if "top" in query:
+                        try:
+                            top = int(query["top"][0])
+                        except ValueError:
+                            top = 0
+                        if top <= 0:
+                            self.wfile.write(BAD_REQUEST)
+                            return
+                    response = snapshot.response(name, query.get("region", [None])[0], top)
+                else:
+                    response = None
+                if response is None:
+                    self.wfile.write(NOT_FOUND)
+                    return
+
+                rep = response.identity
+                if response.gzip is not None and "gzip" in self.headers.get("Accept-Encoding", ""):
+                    rep = response.gzip
+                inm = self.headers.get("If-None-Match")
+                if inm is not None:
+                    fresh = inm.strip() == "*" or rep.etag in inm
+                else:
+                    fresh = self.headers.get("If-Modified-Since") == response.last_modified
+                if fresh:
+                    self.wfile.write(rep.not_modified)
+                elif send_body:
+                    self.wfile.write(rep.head + rep.body)
+                else:
+                    self.wfile.write(rep.head)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self) -> "ListServer":
+        self._threads = [threading.Thread(target=self._server.serve_forever, daemon=True)]
+        if self.reload_interval:
+            self._threads.append(threading.Thread(target=self._watch, name="list-reload", daemon=True))
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "ListServer":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="以HTTP提供IP列表（预构建响应，源文件变化时自动重新加载）")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--lists", default=",".join(SERVE_LISTS), help="逗号分隔的列表文件")
+    parser.add_argument("--ranked", default=RANKED_FILE, help="测速排名文件（决定 top 的顺序）")
+    parser.add_argument("--reload-interval", type=float, default=RELOAD_INTERVAL, help="检查源文件的间隔（秒），0表示不检查")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="[%(asctime)s] %(levelname)s - %(message)s", datefmt="%H:%M:%S")
+    lists = [p.strip() for p in args.lists.split(",") if p.strip()]
+    try:
+        server = ListServer(lists, args.host, args.port, args.ranked, reload_interval=args.reload_interval)
+    except (OSError, ValueError) as e:
+        logging.error(f"启动失败：{e}")
+        return 1
+    if hasattr(signal, "SIGHUP"):
+        signal.signal(signal.SIGHUP, lambda *_: server.reload(force=True))
+    with server:
+        logging.info(f"正在提供 {', '.join(server.url('/' + os.path.basename(p)) for p in lists)}")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+上游IP源的健康模型：按URL持久化成功率、耗时、产出IP数与上次成功的抓取方式（直连/浏览器），
+调度时据此直接使用上次有效的方式、对连续失败的站点熔断，并按预期产出速率（IP/秒）排序
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from atomic_io import write_json
+
+HEALTH_FILE = os.path.join(".cache", "source_health.json")
+EWMA_ALPHA = 0.3                  # 滑动平均中本次结果的权重
+FAILURE_THRESHOLD = 3             # 连续失败达到该次数后熔断
+COOLDOWN = 6 * 3600               # 首次熔断时长（秒），之后每多失败一次翻倍
+MAX_COOLDOWN = 7 * 24 * 3600
+RELEARN_AFTER = 24 * 3600         # 记为"需要浏览器"的站点，每隔该时长重新尝试一次直连
+FORGET_AFTER = 30 * 24 * 3600     # 超过该时长未调度的站点从模型中移除
+LATENCY_HISTORY = 20              # 保留最近多少次抓取耗时（用于计算分位数）
+
+def _ewma(old: Optional[float], value: float) -> float:
+    return value if old is None else old + EWMA_ALPHA * (value - old)
+
+class SourceHealth:
+    """按URL记录的站点健康状况（JSON落盘，线程安全）"""
+
+    def __init__(self, path: str = HEALTH_FILE):
+        self.path = path
+        self.entries: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.warning(f"站点健康文件损坏，已忽略：{e}")
+            self.entries = {}
+
+    def save(self):
+        with self._lock:
+            now = time.time()
+            self.entries = {url: e for url, e in self.entries.items() if now - e["updated_at"] <= FORGET_AFTER}
+            write_json(self.path, self.entries, indent=1)
+
+    def _entry(self, url: str) -> dict:
+        entry = self.entries.get(url)
+        if entry is None:
+            entry = self.entries[url] = {
+                "success_rate": None,
+                "latency": None,
+                "yield": None,
+                "needs_browser": False,
+                "direct_checked_at": 0.0,
+                "failures": 0,
+                "open_until": 0.0,
+                "updated_at": time.time(),
+            }
+        return entry
+
+    # -------------------------- 调度 --------------------------
+    def allow(self, url: str, now: Optional[float] = None) -> bool:
+        """熔断期内返回False；熔断到期后放行一次（半开），成功即恢复，失败则熔断时长翻倍"""
+        now = time.time() if now is None else now
+        with self._lock:
+            entry = self.entries.get(url)
+            return entry is None or now >= entry["open_until"]
+
+    def preferred_method(self, url: str, now: Optional[float] = None) -> str:
+        """'browser'：上次只有浏览器成功且近期验证过直连无效；否则 'direct'"""
+        now = time.time() if now is None else now
+        with self._lock:
+            entry = self.entries.get(url)
+            if entry and entry["needs_browser"] and now - entry["direct_checked_at"] < RELEARN_AFTER:
+                return 'browser'
+        return 'direct'
+
+    def expected_rate(self, url: str) -> float:
+        """预期产出速率（IP/秒）= 成功率 × 平均产出 / 平均耗时；从未调度过的站点优先（用于学习）"""
+        with self._lock:
+            entry = self.entries.get(url)
+            if entry is None or entry["success_rate"] is None or entry["latency"] is None:
+                return float("inf")
+            return entry["success_rate"] * (entry["yield"] or 0.0) / max(entry["latency"], 0.1)
+
+    def latency_percentile(self, url: str, q: float) -> Optional[float]:
+        """最近若干次抓取耗时的q分位数（0~1），没有记录时返回None"""
+        with self._lock:
+            entry = self.entries.get(url)
+            history = sorted(entry.get("latencies", [])) if entry else []
+        if not history:
+            return None
+        return history[min(len(history) - 1, int(q * len(history)))]
+
+    def order(self, jobs: Sequence[Tuple[str, str]]) -> List[Tuple[str, str]]:
+        """按预期产出速率从高到低排列 (url, risk_level)，速率相同时保持原顺序"""
+        return sorted(jobs, key=lambda job: -self.expected_rate(job[0]))
+
+    # -------------------------- 记录 --------------------------
+    def record_fetch(self, url: str, method: str, ok: bool, latency: float, probed_direct: bool):
+        """
+        记录一次抓取：method为最终返回内容的方式，probed_direct表示本次尝试过直连
+        （直连成功即清除"需要浏览器"标记；直连失败、浏览器成功则置位）
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entry(url)
+            entry["latency"] = _ewma(entry["latency"], latency)
+            history = entry.setdefault("latencies", [])
+            history.append(round(latency, 3))
+            del history[:-LATENCY_HISTORY]
+            entry["updated_at"] = now
+            if probed_direct:
+                entry["direct_checked_at"] = now
+            if ok:
+                entry["needs_browser"] = method == 'browser' and (probed_direct or entry["needs_browser"])
+
+    def record_result(self, url: str, ip_count: int):
+        """记录本次有效IP数：为0视为失败，连续失败达到阈值后熔断"""
+        now = time.time()
+        ok = ip_count > 0
+        with self._lock:
+            entry = self._entry(url)
+            entry["success_rate"] = _ewma(entry["success_rate"], 1.0 if ok else 0.0)
+            entry["yield"] = _ewma(entry["yield"], float(ip_count)) if ok else entry["yield"]
+            entry["updated_at"] = now
+            if ok:
+                entry["failures"] = 0
+                entry["open_until"] = 0.0
+                return
+            entry["failures"] += 1
+            if entry["failures"] >= FAILURE_THRESHOLD:
+                cooldown = min(MAX_COOLDOWN, COOLDOWN * 2 ** (entry["failures"] - FAILURE_THRESHOLD))
+                entry["open_until"] = now + cooldown
+                logging.warning(f"[{url}] 连续失败 {entry['failures']} 次，熔断 {cooldown / 3600:.0f} 小时")
+
+    def summary(self) -> Dict[str, dict]:
+        with self._lock:
+            return json.loads(json.dumps(self.entries))
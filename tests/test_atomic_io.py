@@ -0,0 +1,30 @@
+"""原子写文件：成功时整体替换，出错时保留原文件且不留下临时文件"""
+
+import json
+
+import pytest
+
+from atomic_io import atomic_open, write_json
+
+def test_write_json_creates_directory_and_keeps_unicode(tmp_path):
+    path = tmp_path / "sub" / "data.json"
+    write_json(str(path), {"地区": "香港"}, indent=1)
+    assert json.loads(path.read_text(encoding="utf-8")) == {"地区": "香港"}
+    assert "香港" in path.read_text(encoding="utf-8")
+    assert [p.name for p in path.parent.iterdir()] == ["data.json"]
+
+def test_failed_write_keeps_original(tmp_path):
+    path = tmp_path / "ip.txt"
+    path.write_text("old", encoding="utf-8")
+    with pytest.raises(RuntimeError):
+        with atomic_open(str(path)) as f:
+            f.write("new partial")
+            raise RuntimeError("disk full")
+    assert path.read_text(encoding="utf-8") == "old"
+    assert [p.name for p in tmp_path.iterdir()] == ["ip.txt"]
+
+def test_binary_mode(tmp_path):
+    path = tmp_path / "ip.bin"
+    with atomic_open(str(path), "wb") as f:
+        f.write(b"\x00\x01")
+    assert path.read_bytes() == b"\x00\x01"
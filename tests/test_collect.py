@@ -0,0 +1,183 @@
+"""异步抓取引擎：镜像对冲与失效主站点的降级、熔断后改用镜像；浏览器会话池与表格渲染等待（假驱动）"""
+
+import asyncio
+import threading
+import time
+
+import pytest
+from selenium.common.exceptions import TimeoutException
+from selenium.webdriver.support.ui import WebDriverWait
+
+from collect_ips import (AntiBlockTool, AsyncFetchEngine, BrowserPool, HostRateLimiter, SmartFetcher,
+                         _RowCountSettled, collect_by_source)
+from local_server import StandInServer
+from source_health import FAILURE_THRESHOLD, SourceHealth
+
+FAST_LIMITS = {'low': (100.0, 1), 'medium': (100.0, 1), 'high': (100.0, 1)}
+
+class NoBrowserFetcher(SmartFetcher):
+    """测试环境不启动Chrome：浏览器兜底只计数"""
+
+    def __init__(self):
+        super().__init__(AntiBlockTool())
+        self.browser_fallbacks = 0
+
+    def _fetch_with_browser(self, url: str, quick_mode: bool = False) -> str:
+        self.browser_fallbacks += 1
+        return ""
+
+@pytest.fixture
+def server():
+    with StandInServer({"/mirror": "<pre>104.16.0.1\n104.16.0.2</pre>"}) as server:
+        yield server
+
+def make_engine(server, tmp_path):
+    primary, mirror = server.url("/dead"), server.url("/mirror")
+    engine = AsyncFetchEngine(NoBrowserFetcher(), HostRateLimiter(FAST_LIMITS),
+                              SourceHealth(str(tmp_path / "health.json")), mirror_groups=[(primary, mirror)])
+    return engine, primary, mirror
+
+def test_dead_primary_is_demoted_after_mirror_wins(server, tmp_path):
+    engine, primary, mirror = make_engine(server, tmp_path)
+    urls = {'low': [primary, mirror]}
+    for _ in range(5):
+        result = asyncio.run(collect_by_source(engine, urls))
+        assert result == {mirror: {"104.16.0.1", "104.16.0.2"}}
+
+    # 只有第一次运行尝试了失效的主站点（直连2次 + 浏览器兜底），之后镜像优先、无需对冲
+    assert server.count("/dead", 404) == 2 and engine.fetcher.browser_fallbacks == 1
+    entry = engine.health.entries[primary]
+    assert entry["failures"] == 1 and entry["success_rate"] == 0.0
+    assert engine.schedule(urls) == [(mirror, 'low')] and engine.mirrors == {mirror: [(primary, 'low')]}
+
+def test_open_circuit_falls_back_to_mirror(server, tmp_path):
+    engine, primary, mirror = make_engine(server, tmp_path)
+    for _ in range(FAILURE_THRESHOLD):
+        engine.health.record_result(primary, 0)
+    assert not engine.health.allow(primary)
+    # 熔断中的主站点不调度、也不作为对冲目标
+    assert engine.schedule({'low': [primary, mirror]}) == [(mirror, 'low')] and engine.mirrors == {}
+    result = asyncio.run(collect_by_source(engine, {'low': [primary, mirror]}))
+    assert result == {mirror: {"104.16.0.1", "104.16.0.2"}} and server.count("/dead", 404) == 0
+
+class FakeDriver:
+    """只实现会话池与表格等待用到的接口；rows为每次查询依次返回的行数（用完后保持最后一个值）"""
+
+    def __init__(self, rows=(0,)):
+        self.rows = list(rows)
+        self.quit_calls = 0
+
+    def find_elements(self, by, selector):
+        count = self.rows.pop(0) if len(self.rows) > 1 else self.rows[0]
+        return [object()] * count
+
+    def quit(self):
+        self.quit_calls += 1
+
+class CountingFactory:
+    """记录创建次数与并发会话数的假驱动工厂"""
+
+    def __init__(self, fail_first=0):
+        self.created = []
+        self.fail_first = fail_first
+
+    def __call__(self):
+        if self.fail_first:
+            self.fail_first -= 1
+            raise RuntimeError("chrome failed to start")
+        driver = FakeDriver()
+        self.created.append(driver)
+        return driver
+
+def test_pool_reuses_drivers():
+    factory = CountingFactory()
+    pool = BrowserPool(factory, size=2)
+    for _ in range(3):
+        with pool.session() as driver:
+            pass
+    assert factory.created == [driver]
+    with pool.session() as first, pool.session() as second:
+        assert first is not second
+    assert len(factory.created) == 2
+    pool.close()
+    assert [d.quit_calls for d in factory.created] == [1, 1]
+
+def test_pool_size_bounds_concurrent_sessions():
+    factory = CountingFactory()
+    pool = BrowserPool(factory, size=2)
+    active, peak = 0, 0
+    lock = threading.Lock()
+
+    def borrow():
+        nonlocal active, peak
+        with pool.session():
+            with lock:
+                active += 1
+                peak = max(peak, active)
+            time.sleep(0.02)
+            with lock:
+                active -= 1
+
+    threads = [threading.Thread(target=borrow) for _ in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert peak == 2 and len(factory.created) == 2
+
+def test_failing_factory_and_errors_release_the_slot():
+    factory = CountingFactory(fail_first=2)
+    pool = BrowserPool(factory, size=1)
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            with pool.session():
+                pass
+    # 出错的会话被丢弃（quit）而不归还，名额照常释放
+    with pytest.raises(ValueError):
+        with pool.session() as broken:
+            raise ValueError("page crashed")
+    assert broken.quit_calls == 1 and pool._all == [] and pool._idle == []
+    with pool.session() as driver:
+        assert driver is not broken
+    assert len(factory.created) == 2
+
+def test_driver_creation_is_serialized(monkeypatch):
+    import undetected_chromedriver as uc
+    active, peak = 0, 0
+    lock = threading.Lock()
+
+    class FakeChrome(FakeDriver):
+        def __init__(self, options=None):
+            nonlocal active, peak
+            with lock:
+                active += 1
+                peak = max(peak, active)
+            time.sleep(0.02)
+            with lock:
+                active -= 1
+            super().__init__()
+
+        def execute_cdp_cmd(self, cmd, params):
+            pass
+
+    monkeypatch.setattr(uc, "Chrome", FakeChrome)
+    fetcher = SmartFetcher(AntiBlockTool())
+    threads = [threading.Thread(target=fetcher._create_driver) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert peak == 1
+
+def test_row_count_settles_after_rows_stop_changing():
+    driver = FakeDriver(rows=[0, 0, 3, 7, 12])
+    settled = _RowCountSettled("div.row", settle=0.05)
+    assert WebDriverWait(driver, 2, poll_frequency=0.01).until(settled)
+    assert settled.count == 12 and driver.rows == [12]
+
+@pytest.mark.parametrize("rows", [[0], list(range(1, 1000))])
+def test_row_count_times_out_when_empty_or_still_changing(rows):
+    # 一直没有行，或行数每次轮询都在变化：都等不到稳定，WebDriverWait 超时
+    settled = _RowCountSettled("div.row", settle=0.05)
+    with pytest.raises(TimeoutException):
+        WebDriverWait(FakeDriver(rows=rows), 0.3, poll_frequency=0.01).until(settled)
@@ -0,0 +1,61 @@
+"""按主机编译的提取规则：部分解析的起点、规则命中与回退"""
+
+from extractor import CompiledRule, ExtractionEngine
+
+NAV = '<div class="nav-item"><a href="/x">9.9.9.9 menu</a></div>\n' * 50
+
+def test_partial_parse_starts_at_target_element():
+    rule = CompiledRule("h", {'tag': 'div', 'attrs': {'class': 'ip-list'}})
+    html = f"<html><body>{NAV}<div class=\"ip-list\">1.1.1.1\n2.2.2.2</div></body></html>"
+    assert rule.open_re.search(html).start() == html.index('<div class="ip-list"')
+    assert rule.apply(html) == ["1.1.1.1", "2.2.2.2"]
+
+def test_open_tag_accepts_attribute_variants():
+    rule = CompiledRule("h", {'tag': 'div', 'attrs': {'class': 'tabulator-cell', 'tabulator-field': 'ip'}})
+    for tag in (
+        '<div class="tabulator-cell" tabulator-field="ip">',
+        "<DIV tabulator-field='ip' role=\"gridcell\" class='tabulator-cell tabulator-frozen'>",
+        '<div class=tabulator-cell tabulator-field=ip>',
+    ):
+        assert rule.open_re.search(tag), tag
+    for tag in (
+        '<div class="tabulator-cell" tabulator-field="latency">',
+        '<div class="tabulator-cell-x" tabulator-field="ip">',
+        '<divider class="tabulator-cell" tabulator-field="ip">',
+    ):
+        assert not rule.open_re.search(tag), tag
+
+def test_id_rule_and_rule_miss_fallback():
+    engine = ExtractionEngine({'example.com': {'tag': 'div', 'attrs': {'id': 'ip-content'}}})
+    html = f"<html>{NAV}<div id=\"ip-content\"><p>3.3.3.3</p></div></html>"
+    result = engine.extract(html, "https://example.com/")
+    assert result.matched and result.ips == ["3.3.3.3"]
+
+    missed = engine.extract(f"<html>{NAV}<div id=\"other\">4.4.4.4</div></html>", "https://example.com/")
+    assert not missed.matched and "4.4.4.4" in missed.ips
+    assert engine.stats["example.com"] == {'matched': 1, 'missed': 1}
+
+def test_ipv6_pattern_ignores_css_pseudo_elements_and_hex_words():
+    from extractor import IP_PATTERN
+
+    css = "li a::before{} .dead:beef::after{} ab::cd h1::after e2::before{} 12:30:45 00:1a:2b:3c:4d:5e"
+    assert IP_PATTERN.findall(css) == []
+    text = "2606:4700::6815:1a0b [2a06:98c0::1]:443 2606:4700:3030:0:0:0:6815:1a0b. 104.16.0.1"
+    assert IP_PATTERN.findall(text) == ["2606:4700::6815:1a0b", "2a06:98c0::1", "2606:4700:3030:0:0:0:6815:1a0b", "104.16.0.1"]
+
+def test_ports_are_kept_in_generic_extraction():
+    from extractor import find_ips
+
+    text = ("104.16.0.1:443 [2606:4700::1]:2053 [2606:4700::2] 2606:4700::3 [104.16.0.4]:80 "
+            "104.16.0.2:8443/path 104.16.0.3:123456 time 12:30:45")
+    expected = ["104.16.0.1:443", "[2606:4700::1]:2053", "2606:4700::2", "2606:4700::3", "104.16.0.4",
+                "104.16.0.2:8443", "104.16.0.3"]
+    assert find_ips(text) == expected
+    assert find_ips(text.replace("[", "(")) == [ip.replace("[", "").replace("]:2053", "") for ip in expected]
+    engine = ExtractionEngine({})
+    assert engine.extract(f"<pre>{text}</pre>", "https://example.com/").ips == expected
+
+def test_css_before_target_does_not_extend_the_parsed_slice():
+    rule = CompiledRule("h", {'tag': 'pre', 'attrs': {}})
+    html = "<html><pre>1.1.1.1</pre><style>a::before{} .dead:beef::after{}</style></html>"
+    assert rule.apply(html) == ["1.1.1.1"]
@@ -0,0 +1,65 @@
+"""条件请求缓存：经 SmartFetcher 的直连请求对本地替身服务器演练 200 / 304 / 内容未变 / 内容变化"""
+
+import time
+
+import pytest
+
+from collect_ips import AntiBlockTool, SmartFetcher, _extract_with_cache
+from http_cache import MAX_AGE, SourceCache
+from local_server import StandInServer
+
+@pytest.fixture
+def server():
+    with StandInServer({"/ips": "<pre>1.1.1.1</pre>"}) as server:
+        yield server
+
+def make_fetcher(path) -> SmartFetcher:
+    return SmartFetcher(AntiBlockTool(), cache=SourceCache(str(path)))
+
+def fetch_and_store(fetcher: SmartFetcher, url: str):
+    page = fetcher._fetch_direct_once(url, 0)
+    return page, _extract_with_cache(page, url, fetcher.cache)
+
+def test_not_modified_reuses_cached_ips(tmp_path, server):
+    url = server.url("/ips")
+    fetcher = make_fetcher(tmp_path / "cache.json")
+    page, ips = fetch_and_store(fetcher, url)
+    assert page.ips is None and page.etag and ips == ["1.1.1.1"]
+    fetcher.cache.save()
+
+    # 重新加载缓存（跨运行）：条件请求得到304，空正文仍视为抓取成功并直接带回IP
+    fetcher = make_fetcher(tmp_path / "cache.json")
+    page = fetcher._fetch_direct_once(url, 0)
+    assert server.count("/ips", 304) == 1
+    assert page == "" and bool(page) and page.ips == ["1.1.1.1"]
+    assert _extract_with_cache(page, url, fetcher.cache) == ["1.1.1.1"]
+
+def test_unchanged_body_reuses_ips_and_refreshes_entry(tmp_path, server):
+    url = server.url("/ips")
+    fetcher = make_fetcher(tmp_path / "cache.json")
+    fetch_and_store(fetcher, url)
+
+    # 服务器不支持条件请求：内容哈希一致时复用IP，并刷新条目存活时间
+    server.set_page("/ips", "<pre>1.1.1.1</pre>", etag=False, last_modified=False)
+    fetcher.cache.entries[url]["stored_at"] = time.time() - MAX_AGE + 5
+    page = fetcher._fetch_direct_once(url, 0)
+    assert server.count("/ips", 200) == 2
+    assert page.ips == ["1.1.1.1"]
+    assert fetcher.cache.entries[url]["stored_at"] > time.time() - 5
+
+def test_changed_body_is_downloaded_again(tmp_path, server):
+    url = server.url("/ips")
+    fetcher = make_fetcher(tmp_path / "cache.json")
+    fetch_and_store(fetcher, url)
+
+    server.set_page("/ips", "<pre>2.2.2.2</pre>")
+    page, ips = fetch_and_store(fetcher, url)
+    assert page.ips is None and ips == ["2.2.2.2"]
+    assert fetcher.cache.cached_ips(url) == ["2.2.2.2"]
+
+def test_eviction_keeps_most_recently_used(tmp_path):
+    cache = SourceCache(str(tmp_path / "small.json"), max_entries=1)
+    cache.store("a", "x", [])
+    cache.store("b", "y", [])
+    cache.evict()
+    assert list(cache.entries) == ["b"]
@@ -0,0 +1,291 @@
+"""地区筛选：地区IP段文件解析、区间边界与重叠优先级，/24分类缓存，NumPy批量路径与纯Python逐行路径对照，流式筛选，IP库增量筛选"""
+
+import os
+import random
+
+import pytest
+
+import ip_filter
+from ip_filter import (PrefixCache, RegionIndex, classify_batch, classify_ip, filter_store_delta, filter_target_regions_ip,
+                       filter_target_regions_streaming, get_default_index, int_to_ip, ip_to_int, iter_ipv4_chunks,
+                       open_prefix_cache, parse_ip, parse_ipv4_bytes, region_output_path)
+from ipset import endpoint_sort_key
+from ip_store import IPStore
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+requires_numpy = pytest.mark.skipif(np is None, reason="未安装NumPy")
+
+def write_regions(tmp_path, text):
+    path = tmp_path / "region_ranges.txt"
+    path.write_text(text, encoding="utf-8")
+    return str(path)
+
+def test_from_file_skips_comments_and_blank_lines(tmp_path):
+    path = write_regions(tmp_path, (
+        "# 注释行\n"
+        "\n"
+        "   \n"
+        "47.57.128.0/17   香港  # 行尾注释\n"
+        "\t13.112.0.0/14 日本\n"
+        "2406:da14::/32   日本\n"
+    ))
+    index = RegionIndex.from_file(path)
+    assert index.regions == ("香港", "日本")
+    assert len(index) == 3 and index.has_ipv6
+    assert index.lookup("47.57.200.1") == "香港" and index.lookup("13.115.1.1") == "日本"
+    assert index.lookup("2406:da14::1") == "日本" and index.lookup("8.8.8.8") is None
+
+@pytest.mark.parametrize("line, message", [
+    ("47.57.128.0/17\n", "格式错误"),
+    ("47.57.128.0/17 香港 多余字段\n", "格式错误"),
+    ("47.57.300.0/17 香港\n", "非法网段"),
+    ("47.57.128.0/33 香港\n", "非法网段"),
+])
+def test_from_file_rejects_malformed_lines(tmp_path, line, message):
+    path = write_regions(tmp_path, "# 头部\n" + line)
+    with pytest.raises(ValueError, match=f":2 {message}"):
+        RegionIndex.from_file(path)
+
+def test_range_boundaries():
+    start, end = ip_to_int("47.57.128.0"), ip_to_int("47.57.255.255")
+    index = RegionIndex([(start, end, "香港")])
+    assert index.lookup_int(start - 1) is None
+    assert index.lookup_int(start) == "香港" and index.lookup_int(end) == "香港"
+    assert index.lookup_int(end + 1) is None
+    assert index.lookup("47.57.127.255") is None and index.lookup("47.57.128.0") == "香港"
+    assert index.lookup("47.57.255.255") == "香港" and index.lookup("47.58.0.0") is None
+    full = RegionIndex([(0, 0xFFFFFFFF, "全部")])
+    assert full.lookup_int(0) == "全部" and full.lookup_int(0xFFFFFFFF) == "全部"
+
+def test_overlap_goes_to_higher_priority_region(tmp_path):
+    # 日本的/16包含香港的/24，新加坡与日本部分重叠；优先级按首次出现：香港 > 日本 > 新加坡
+    path = write_regions(tmp_path, (
+        "10.1.2.0/24 香港\n"
+        "10.1.0.0/16 日本\n"
+        "10.1.128.0/17 新加坡\n"
+        "10.2.0.0/16 新加坡\n"
+        "10.1.255.0/24 香港\n"
+    ))
+    index = RegionIndex.from_file(path)
+    assert index.lookup("10.1.1.255") == "日本"
+    assert index.lookup("10.1.2.0") == "香港" and index.lookup("10.1.2.255") == "香港"
+    assert index.lookup("10.1.3.0") == "日本" and index.lookup("10.1.200.1") == "日本"
+    assert index.lookup("10.1.255.0") == "香港" and index.lookup("10.2.0.0") == "新加坡"
+    # 拍平后的区间有序且互不重叠，二分查找与前缀树结果一致
+    assert all(e < s for e, s in zip(index.ends, index.starts[1:]))
+    for addr in range(ip_to_int("10.0.255.0"), ip_to_int("10.3.0.255"), 97):
+        assert index.lookup_int(addr) == index.lookup_addr(4, addr)
+
+def test_explicit_priority_overrides_file_order():
+    low, high = ip_to_int("10.0.0.0"), ip_to_int("10.0.0.255")
+    ranges = [(low, high, "香港"), (low + 16, low + 31, "日本")]
+    assert RegionIndex(ranges).lookup_int(low + 20) == "香港"
+    index = RegionIndex(ranges, regions=["日本", "香港"])
+    assert index.lookup_int(low + 15) == "香港" and index.lookup_int(low + 16) == "日本"
+    assert index.lookup_int(low + 31) == "日本" and index.lookup_int(low + 32) == "香港"
+
+def test_prefix_cache_matches_index_including_mixed_prefixes():
+    # 区间边界落在/24网段内部（混合网段）、整段命中、整段未命中
+    base = ip_to_int("10.0.0.0")
+    index = RegionIndex([(base + 10, base + 0x1FF, "香港"), (base + 0x200, base + 0x2FF, "日本")])
+    cache = PrefixCache(index)
+    for _ in range(2):
+        for addr in range(base - 256, base + 0x400):
+            assert cache.lookup_int(addr) == index.lookup_int(addr), int_to_ip(addr)
+    stats = cache.stats()
+    assert stats["misses"] == 5 and stats["hits"] == 2 * 0x500 - 5 and stats["entries"] == 5
+    assert cache.entries[base >> 8] == "*" and cache.entries[(base >> 8) + 1] == "香港"
+    assert cache.entries[(base >> 8) + 3] is None
+
+def test_prefix_cache_evicts_least_recently_used():
+    index = RegionIndex([(0, 0xFFFF, "香港")])
+    cache = PrefixCache(index, max_entries=2)
+    cache.lookup_int(0x0000)
+    cache.lookup_int(0x0100)
+    cache.lookup_int(0x0001)  # 网段0重新变为最近使用
+    cache.lookup_int(0x0200)  # 淘汰网段1
+    assert list(cache.entries) == [0, 2]
+    assert cache.lookup_int(0x0100) == "香港" and cache.stats()["misses"] == 4
+    assert cache.stats()["entries"] == 2
+
+# 覆盖各类边界写法的候选行（不含换行符）
+EDGE_LINES = [
+    b"1.2.3.4", b"  1.2.3.4", b"1.2.3.4  ", b"\t1.2.3.4\t", b"1.2.3.4\r", b"", b"   ", b"\r",
+    b"47.57.130.1:443", b"[2606:4700::1]:443", b"2606:4700::1", b"::1",
+    b"1.2.3.256", b"256.0.0.1", b"999.1.1.1", b"255.255.255.255", b"0.0.0.0",
+    b"01.2.3.4", b"001.002.003.004", b"0001.2.3.4", b"1.2.3.04",
+    b"1.2.3", b"1.2.3.4.5", b"1..2.3", b".1.2.3", b"1.2.3.", b"1. 2.3.4", b"1.2 .3.4",
+    b"+1.2.3.4", b"-1.2.3.4", b"1_0.2.3.4", b"a.b.c.d", b"1.2.3.4#x", b"\xef\xbc\x91.2.3.4",
+]
+
+def python_parse(data):
+    """纯Python逐行路径的解析结果：(非空行数, 合法IPv4整数列表)"""
+    lines = [line.strip() for line in data.decode("utf-8", "replace").split("\n") if line.strip()]
+    parsed = [parse_ip(line) for line in lines]
+    return len(lines), [addr for p in parsed if p is not None and p[0] == 4 for addr in [p[1]]]
+
+def numpy_parse(data):
+    ips, valid, spans = parse_ipv4_bytes(data)
+    return len(ips), ips[valid].tolist()
+
+def random_lines(rng, n):
+    lines = []
+    for _ in range(n):
+        roll = rng.random()
+        if roll < 0.6:
+            line = ".".join(str(rng.randrange(256)) for _ in range(4)).encode()
+        else:
+            line = rng.choice(EDGE_LINES)
+        lines.append(rng.choice([b"", b" ", b"\t"]) + line + rng.choice([b"", b" ", b"\r"]))
+    return lines
+
+@requires_numpy
+@pytest.mark.parametrize("line", EDGE_LINES)
+def test_parse_ipv4_bytes_matches_python_per_line(line):
+    for data in (line + b"\n", line):  # 含/不含末尾换行
+        n_py, ips_py = python_parse(data)
+        n_np, ips_np = numpy_parse(data)
+        assert (n_np, ips_np) == (n_py, ips_py), line
+        assert ip_to_int(line.decode("utf-8", "replace").strip()) == (ips_py[0] if ips_py else None)
+
+@requires_numpy
+def test_parse_ipv4_bytes_matches_python_on_mixed_file():
+    rng = random.Random(2)
+    data = b"\n".join(random_lines(rng, 3000))  # 混合CRLF、空行、首尾空白，且无末尾换行
+    assert not data.endswith(b"\n")
+    assert numpy_parse(data) == python_parse(data)
+
+@requires_numpy
+def test_chunks_split_mid_line_match_whole_file(tmp_path):
+    rng = random.Random(3)
+    data = b"\n".join(random_lines(rng, 2000)) + b"\n" + b"9.9.9.9"
+    path = tmp_path / "ip.txt"
+    path.write_bytes(data)
+    n_py, ips_py = python_parse(data)
+    for chunk_size in (1, 7, 64, 1000, len(data) + 1):
+        n_lines, ips = 0, []
+        for chunk, chunk_ips, valid, spans in iter_ipv4_chunks(str(path), chunk_size):
+            assert chunk.endswith(b"\n") or chunk.endswith(b"9.9.9.9")
+            n_lines += len(chunk_ips)
+            ips += chunk_ips[valid].tolist()
+        assert (n_lines, ips) == (n_py, ips_py), chunk_size
+
+@requires_numpy
+def test_classify_batch_matches_classify_ip():
+    index = RegionIndex.from_file()
+    cache = open_prefix_cache(index)
+    rng = random.Random(4)
+    # 地区IP段的首尾及其相邻地址，加上IP段内外的随机地址
+    probes = {v for s, e in zip(index.starts, index.ends) for v in (s - 1, s, e, e + 1) if 0 <= v <= 0xFFFFFFFF}
+    probes |= {rng.randrange(s, e + 1) for s, e in zip(index.starts, index.ends)}
+    probes |= {rng.getrandbits(32) for _ in range(5000)}
+    ips = np.array(sorted(probes), dtype=np.uint32)
+    for block in (1, 333, len(ips)):
+        masks, counts = classify_batch(ips, index, block=block)
+        expected = {region: 0 for region in index.regions}
+        for i, ip in enumerate(ips.tolist()):
+            region = classify_ip(int_to_ip(ip), cache)
+            assert [r for r, mask in masks.items() if mask[i]] == ([region] if region else []), int_to_ip(ip)
+            if region:
+                expected[region] += 1
+        assert counts == expected
+
+def streaming_input(path, n=20000, seed=5):
+    """目标地区内外的IPv4（含重复、空白与无效行），不含前导零写法（全量纯Python路径按原字符串去重输出）"""
+    index = get_default_index()
+    rng = random.Random(seed)
+    ranges = list(zip(index.starts, index.ends))
+    lines = []
+    for _ in range(n):
+        roll = rng.random()
+        if roll < 0.5:
+            start, end = rng.choice(ranges)
+            ip = int_to_ip(rng.choice([start, end, rng.randrange(start, end + 1)]))
+        elif roll < 0.9:
+            ip = int_to_ip(rng.getrandbits(32))
+        else:
+            ip = rng.choice(["", "  ", "1.2.3.256", "bad", "2606:4700::1", "47.57.130.1:443"])
+        lines.append(rng.choice(["", " "]) + ip + rng.choice(["", "\r"]))
+        if rng.random() < 0.1:
+            lines.append(lines[-1])
+    path.write_text("\n".join(lines), encoding="utf-8")  # 无末尾换行
+    return str(path)
+
+@pytest.mark.parametrize("use_numpy, workers", [
+    pytest.param(True, 3, marks=requires_numpy),
+    pytest.param(True, 1, marks=requires_numpy),
+    (False, 2),
+])
+def test_streaming_matches_full_filter(tmp_path, monkeypatch, use_numpy, workers):
+    monkeypatch.chdir(tmp_path)
+    input_file = streaming_input(tmp_path / "ip.txt")
+    filter_target_regions_ip(input_file, str(tmp_path / "full.txt"), use_numpy=False)
+    expected = sorted(read_lines(tmp_path / "full.txt"), key=endpoint_sort_key)
+    assert expected
+
+    # 4KB分块几乎总是落在行中间，由 _chunk_bounds 对齐到行尾
+    output = tmp_path / "ip2.txt"
+    filter_target_regions_streaming(input_file, str(output), workers=workers, chunk_size=4096, use_numpy=use_numpy)
+    assert read_lines(output) == expected
+    index = get_default_index()
+    per_region = {region: read_lines(tmp_path / os.path.basename(region_output_path(str(output), region)))
+                  for region in index.regions}
+    assert sorted((ip for ips in per_region.values() for ip in ips), key=endpoint_sort_key) == expected
+    assert all(index.lookup(ip) == region for region, ips in per_region.items() for ip in ips)
+
+HK, HK2, JP, OTHER = "47.57.130.1", "47.57.130.2", "52.192.0.1", "8.8.8.8"
+
+def read_lines(path):
+    return path.read_text(encoding="utf-8").split()
+
+@pytest.fixture
+def delta_env(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # 分类缓存写入 ./.cache
+    return str(tmp_path / "store.sqlite3"), tmp_path / "ip2.txt"
+
+def test_store_delta_patches_output_from_change_log(delta_env, capsys):
+    store_path, output = delta_env
+    with IPStore(store_path) as store:
+        store.record_run({"a": [HK, OTHER]}, now=100)
+    filter_store_delta(store_path, str(output))
+    assert "全量筛选" in capsys.readouterr().out and read_lines(output) == [HK]
+
+    with IPStore(store_path) as store:
+        store.record_run({"a": [HK2, JP, OTHER]}, now=200)
+    # 增量路径只修补变更部分：手工加入的行保留，说明没有全量重建
+    output.write_text(f"{HK}\n1.2.3.4", encoding="utf-8")
+    filter_store_delta(store_path, str(output))
+    assert "增量筛选：新增 2 个，移除 1 个" in capsys.readouterr().out
+    assert read_lines(output) == ["1.2.3.4", HK2, JP]
+    with IPStore(store_path) as store:
+        assert store.active_regions() == {HK2: "香港", JP: "日本"}
+        assert store.get_meta("filter_seq") == str(store.last_change_seq())
+        assert store.changes_since(0)[0] == set()  # 已消费的变更日志被清理
+
+    # 没有新变更时输出不变
+    filter_store_delta(store_path, str(output))
+    assert "新增 0 个，移除 0 个" in capsys.readouterr().out and read_lines(output) == ["1.2.3.4", HK2, JP]
+
+@pytest.mark.parametrize("trigger", ["missing_output", "region_version"])
+def test_store_delta_falls_back_to_full_rebuild(delta_env, monkeypatch, capsys, trigger):
+    store_path, output = delta_env
+    with IPStore(store_path) as store:
+        store.record_run({"a": [HK, JP, OTHER]}, now=100)
+    filter_store_delta(store_path, str(output))
+    output.write_text("1.2.3.4", encoding="utf-8")
+    capsys.readouterr()
+
+    if trigger == "missing_output":
+        output.unlink()
+    else:
+        version = ip_filter.region_version()
+        monkeypatch.setattr(ip_filter, "region_version", lambda path=None: version[::-1])
+    filter_store_delta(store_path, str(output))
+    assert "全量筛选：库中有效IP 3 个" in capsys.readouterr().out
+    assert read_lines(output) == [HK, JP]
+    with IPStore(store_path) as store:
+        assert store.get_meta("region_version") == ip_filter.region_version()
@@ -0,0 +1,77 @@
+"""持久化IP库：新增/移除集合、未抓取来源的IP保留、来源记录、变更日志的合并与清理"""
+
+import pytest
+
+from collect_ips import write_collection_outputs
+from ip_store import STALE_AFTER, IPStore
+
+@pytest.fixture
+def store(tmp_path):
+    with IPStore(str(tmp_path / "store.sqlite3")) as store:
+        yield store
+
+def test_record_run_reports_added_and_removed(store):
+    delta = store.record_run({"a": ["1.1.1.1", "2.2.2.2"], "b": ["2.2.2.2"]}, now=100)
+    assert delta.added == ["1.1.1.1", "2.2.2.2"] and delta.removed == []
+    assert sorted(store.sources_of("2.2.2.2")) == ["a", "b"]
+
+    delta = store.record_run({"a": ["2.2.2.2", "3.3.3.3"]}, now=200)
+    assert delta.added == ["3.3.3.3"] and delta.removed == ["1.1.1.1"]
+    assert sorted(store.active_ips()) == ["2.2.2.2", "3.3.3.3"]
+    info = store.info("1.1.1.1")
+    assert info["active"] is False and info["first_seen"] == 100 and info["last_seen"] == 100
+
+    # 重新出现的IP再次计为新增，首次出现时间保持不变
+    delta = store.record_run({"a": ["1.1.1.1", "2.2.2.2", "3.3.3.3"]}, now=300)
+    assert delta.added == ["1.1.1.1"] and delta.removed == []
+    assert store.info("1.1.1.1")["first_seen"] == 100 and store.info("1.1.1.1")["last_seen"] == 300
+
+def test_ips_of_unfetched_sources_are_kept(store):
+    store.record_run({"a": ["1.1.1.1", "3.3.3.3"], "b": ["2.2.2.2", "3.3.3.3"]}, now=100)
+    # b 本次未抓取（熔断/超时）：只有 a 的IP会因未出现而移除；a、b 共有的IP也要等 b 确认
+    delta = store.record_run({"a": ["4.4.4.4"]}, now=200)
+    assert delta.removed == ["1.1.1.1"] and delta.added == ["4.4.4.4"]
+    assert sorted(store.active_ips()) == ["2.2.2.2", "3.3.3.3", "4.4.4.4"]
+
+    # b 抓取成功但列表为空：同样视为已抓取
+    delta = store.record_run({"a": ["4.4.4.4"], "b": []}, now=300)
+    assert delta.removed == ["2.2.2.2", "3.3.3.3"]
+
+def test_unfetched_sources_expire_after_stale_window(store):
+    store.record_run({"a": ["1.1.1.1"], "b": ["2.2.2.2"]}, now=100)
+    assert store.record_run({"a": ["1.1.1.1"]}, now=100 + STALE_AFTER).removed == []
+    assert store.record_run({"a": ["1.1.1.1"]}, now=101 + STALE_AFTER).removed == ["2.2.2.2"]
+
+def test_failed_sources_do_not_count_as_fetched(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with IPStore("store.sqlite3") as store:
+        write_collection_outputs(store, {"a": {"1.1.1.1"}, "b": {"2.2.2.2"}})
+        # b 抓取失败（返回空集合），它的IP不应被移除
+        assert write_collection_outputs(store, {"a": {"1.1.1.1"}, "b": set()}) == ["1.1.1.1", "2.2.2.2"]
+    assert (tmp_path / "ip_delta.txt").read_text(encoding="utf8") == ""
+
+def test_changes_since_collapses_to_last_op(store):
+    store.record_run({"a": ["1.1.1.1", "2.2.2.2"]}, now=100)
+    seq = store.last_change_seq()
+    assert store.changes_since(0) == ({"1.1.1.1", "2.2.2.2"}, set(), seq)
+
+    store.record_run({"a": ["2.2.2.2"]}, now=200)          # 1.1.1.1 移除
+    store.record_run({"a": ["1.1.1.1", "2.2.2.2"]}, now=300)  # 1.1.1.1 又出现
+    store.record_run({"a": ["1.1.1.1", "4.4.4.4"]}, now=400)  # 2.2.2.2 移除，4.4.4.4 新增
+    added, removed, latest = store.changes_since(seq)
+    assert added == {"1.1.1.1", "4.4.4.4"} and removed == {"2.2.2.2"}
+    assert latest == store.last_change_seq() > seq
+
+    # 没有新变更时返回空集合与传入的seq
+    assert store.changes_since(latest) == (set(), set(), latest)
+    store.prune_changes(latest)
+    assert store.changes_since(0) == (set(), set(), 0)
+
+def test_regions_and_meta(store):
+    store.record_run({"a": ["1.1.1.1", "2.2.2.2"]}, now=100)
+    store.set_regions({"1.1.1.1": "香港", "2.2.2.2": None})
+    assert store.active_regions() == {"1.1.1.1": "香港"}
+    assert store.get_meta("filter_seq") is None
+    store.set_meta("filter_seq", 5)
+    store.set_meta("filter_seq", 7)
+    assert store.get_meta("filter_seq") == "7"
@@ -0,0 +1,41 @@
+"""候选IP校验：格式/端口、保留地址、Cloudflare官方网段归属"""
+
+from ip_validate import CandidateValidator, trie_from_cidrs
+
+def test_drops_malformed_and_reserved_and_normalizes():
+    kept, stats = CandidateValidator().validate([
+        "104.16.1.1", "104.16.1.1:443", "172.20.1.1", "127.0.0.1", "100.64.3.4", "224.0.0.1",
+        "255.255.255.255", "999.1.1.1", "1.2.3.4:70000", "8.8.8.8", "47.57.130.1:8443", "10.1.1.1",
+        "2606:4700:3030:0::6815:1a0b", "[2606:4700::1]:2053", "2001:db8::1", "fe80::1", "::1",
+        "2a01:4f8::1", "[2606:4700::1]:0", "2606:4700:::1",
+    ])
+    assert kept == {"104.16.1.1", "104.16.1.1:443", "8.8.8.8", "47.57.130.1:8443",
+                    "2606:4700:3030::6815:1a0b", "[2606:4700::1]:2053", "2a01:4f8::1"}
+    assert stats == {"malformed": 4, "reserved": 9, "cloudflare": 4, "non_cloudflare": 3, "kept": 7}
+
+def test_cloudflare_only_keeps_official_ranges():
+    kept, stats = CandidateValidator(cloudflare_only=True).validate(["104.16.1.1", "8.8.8.8", "2a06:98c0::1"])
+    assert kept == {"104.16.1.1", "2a06:98c0::1"}
+    assert stats["non_cloudflare"] == 1
+
+def test_custom_tables():
+    validator = CandidateValidator(reserved=trie_from_cidrs(["1.0.0.0/8"]), cloudflare=trie_from_cidrs(["2.0.0.0/8"]))
+    kept, stats = validator.validate(["1.1.1.1", "2.2.2.2", "10.0.0.1"])
+    assert kept == {"2.2.2.2", "10.0.0.1"} and stats["reserved"] == 1 and stats["cloudflare"] == 1
+
+def test_empty_tables_are_not_replaced_by_defaults():
+    empty = trie_from_cidrs([])
+    kept, stats = CandidateValidator(reserved=empty, cloudflare=empty).validate(["10.0.0.1"], cloudflare_only=False)
+    assert kept == {"10.0.0.1"} and stats["reserved"] == 0
+
+def test_collect_ips_reads_cloudflare_only_at_call_time(monkeypatch):
+    import collect_ips
+
+    candidates = ["104.16.1.1", "8.8.8.8"]
+    assert collect_ips._clean_ips(candidates) == {"104.16.1.1", "8.8.8.8"}
+    monkeypatch.setattr(collect_ips, "CLOUDFLARE_ONLY", True)
+    assert collect_ips._clean_ips(candidates) == {"104.16.1.1"}
+
+def test_ipv6_outside_global_unicast_is_dropped():
+    kept, stats = CandidateValidator().validate(["dead:beef::af", "ab::cd", "a::bef", "fc00::1", "ff02::1", "2a01:4f8::1"])
+    assert kept == {"2a01:4f8::1"} and stats["reserved"] == 5
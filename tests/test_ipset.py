@@ -0,0 +1,22 @@
+"""整数打包的IP/端口集合：去重排序、IPv6、二进制文件往返"""
+
+from ipset import PackedIPSet, endpoint_sort_key, parse_endpoint
+
+def test_bare_and_ported_forms_are_both_kept():
+    ipset = PackedIPSet(["47.57.130.1:443", "47.57.130.1", "1.1.1.1", "47.57.130.1:443"])
+    assert ipset.to_strings() == ["1.1.1.1", "47.57.130.1", "47.57.130.1:443"]
+    assert "47.57.130.1" in ipset and "47.57.130.1:443" in ipset and "47.57.130.1:80" not in ipset
+    assert list(ipset.addresses()) == [0x01010101, (47 << 24) | (57 << 16) | (130 << 8) | 1]
+
+def test_ipv6_after_ipv4_and_invalid_rejected():
+    ipset = PackedIPSet(["[2606:4700::1]:443", "2606:4700::1", "9.9.9.9", "300.1.1.1", "1.1.1.1:0"])
+    assert ipset.to_strings() == ["9.9.9.9", "2606:4700::1", "[2606:4700::1]:443"]
+    assert len(ipset) == 3 and ipset.rejected == 2
+    assert parse_endpoint("[2606:4700::1]") == (6, 0x26064700 << 96 | 1, 0)
+    assert sorted(["2606:4700::1", "bad", "1.1.1.1"], key=endpoint_sort_key) == ["1.1.1.1", "2606:4700::1", "bad"]
+
+def test_binary_round_trip_is_ipv4_only(tmp_path):
+    ipset = PackedIPSet(["2.2.2.2:2053", "2.2.2.2", "1.1.1.1", "2606:4700::1"])
+    path = str(tmp_path / "ip.bin")
+    ipset.write_binary(path)
+    assert PackedIPSet.read_binary(path).to_strings() == ["1.1.1.1", "2.2.2.2", "2.2.2.2:2053"]
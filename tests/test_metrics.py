@@ -0,0 +1,62 @@
+"""运行指标与JSON报告、cProfile剖析开关，以及重量级依赖的延迟导入"""
+
+import json
+import os
+import pstats
+import subprocess
+import sys
+
+import pytest
+
+from metrics import PROFILE_ENV, RunMetrics, profiled
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def test_report_has_documented_keys(tmp_path):
+    metrics = RunMetrics()
+    with metrics.timer('fetch_direct', source="https://a"):
+        pass
+    with pytest.raises(RuntimeError):
+        with metrics.timer('parse'):  # 出错时同样计时
+            raise RuntimeError
+    metrics.add_time('fetch_direct', 2.0, source="https://a")
+    metrics.count('bytes', 100, source="https://a")
+    metrics.count('hedged')
+
+    path = tmp_path / "reports" / "run_report.json"
+    returned = metrics.write_report(str(path), command="test", total_ips=3)
+    report = json.loads(path.read_text(encoding="utf8"))
+    assert report == returned and not (tmp_path / "reports" / "run_report.json.tmp").exists()
+    assert set(report) == {"started_at", "wall_s", "stages", "counters", "sources", "command", "total_ips"}
+    assert report["command"] == "test" and report["total_ips"] == 3 and report["wall_s"] >= 0
+    assert set(report["stages"]) == {"fetch_direct", "parse"}
+    fetch = report["stages"]["fetch_direct"]
+    assert set(fetch) == {"seconds", "count", "max_s"} and fetch["count"] == 2 and fetch["max_s"] == 2.0
+    assert report["counters"] == {"bytes": 100, "hedged": 1}
+    source = report["sources"]["https://a"]
+    assert source["bytes"] == 100 and source["timings"]["fetch_direct"]["count"] == 2
+
+    metrics.reset()
+    assert metrics.report()["stages"] == {} and metrics.report()["sources"] == {}
+
+def test_profiled_is_off_by_default(monkeypatch):
+    monkeypatch.delenv(PROFILE_ENV, raising=False)
+    with profiled() as profiler:
+        assert profiler is None
+
+def test_profiled_writes_stats(tmp_path, monkeypatch):
+    path = tmp_path / "run.prof"
+    monkeypatch.setenv(PROFILE_ENV, str(path))
+    with profiled(top=1) as profiler:
+        sorted(range(1000), key=lambda x: -x)
+    assert profiler is not None
+    assert any("sorted" in func[2] for func in pstats.Stats(str(path)).stats)
+
+@pytest.mark.parametrize("module", ["collect_ips", "pipeline"])
+def test_heavy_dependencies_are_imported_lazily(module):
+    # 新解释器中导入：本进程里其他测试可能已经导入过这些依赖
+    code = (f"import sys, {module}\n"
+            "print(','.join(sorted({m.split('.')[0] for m in sys.modules}"
+            " & {'selenium', 'undetected_chromedriver', 'bs4'})))")
+    result = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == ""
@@ -0,0 +1,78 @@
+"""一体化流水线：阶段选择校验、只对文件筛选时不改动采集产物、经本地替身服务器的完整运行"""
+
+import os
+
+import pytest
+
+import pipeline
+from collect_ips import SmartFetcher
+from ip_store import IPStore, STORE_FILE
+from local_server import StandInServer
+
+HK, JP, OTHER = "47.57.130.1", "52.192.0.1", "104.16.0.1"
+
+@pytest.mark.parametrize("text, expected", [
+    ("fetch,extract,validate,classify,output,probe", list(pipeline.STAGES)),
+    (" classify , output ", ["classify", "output"]),
+    ("output", ["output"]),
+    ("classify,output,probe", ["classify", "output", "probe"]),
+    ("probe", ["probe"]),
+])
+def test_parse_stages_accepts_contiguous_selections(text, expected):
+    assert pipeline.parse_stages(text) == expected
+
+@pytest.mark.parametrize("text, message", [
+    ("", "至少选择一个阶段"),
+    (" , ", "至少选择一个阶段"),
+    ("fetch,parse", "未知阶段"),
+    ("fetch,validate", "按顺序且连续"),
+    ("fetch,extract,classify", "按顺序且连续"),
+    ("classify,validate", "按顺序且连续"),
+    ("fetch,output", "按顺序且连续"),
+    ("extract,validate", "不能脱离 fetch"),
+])
+def test_parse_stages_rejects_invalid_selections(text, message):
+    with pytest.raises(ValueError, match=message):
+        pipeline.parse_stages(text)
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # ip.txt / ip2.txt / .cache 等都写到临时目录
+    return tmp_path
+
+@pytest.mark.parametrize("stages", [["classify", "output"], ["output"]])
+def test_file_input_only_writes_target_file(workdir, stages):
+    (workdir / "candidates.txt").write_text(f"{OTHER}\n{JP}\n\n{HK}\n{HK}:443\n", encoding="utf-8")
+    (workdir / "ip.txt").write_text("1.1.1.1", encoding="utf-8")
+    ips = pipeline.run(stages, input_file="candidates.txt")
+    assert ips == [HK, f"{HK}:443", JP, OTHER]
+    # 带端口的条目不计入地区结果（与 ip_filter 一致）
+    assert (workdir / "ip2.txt").read_text(encoding="utf-8").split() == [HK, JP]
+    # 采集产物与IP库都不受影响
+    assert (workdir / "ip.txt").read_text(encoding="utf-8") == "1.1.1.1"
+    assert not (workdir / "ip.bin").exists() and not (workdir / "ip_delta.txt").exists()
+    assert not os.path.exists(STORE_FILE)
+
+def test_full_run_over_local_server(workdir, monkeypatch):
+    browser_calls = []
+    monkeypatch.setattr(SmartFetcher, "_fetch_with_browser",
+                        lambda self, url, quick_mode=False: browser_calls.append(url) or "")
+    with StandInServer({"/list": f"<pre>{HK}\n{OTHER}\n10.0.0.1\n</pre>"}) as server:
+        urls = {'low': [server.url("/list")]}
+        stages = pipeline.parse_stages("fetch,extract,validate,classify,output")
+        assert pipeline.run(stages, urls=urls, run_deadline=30) == [HK, OTHER]
+
+        server.set_page("/list", f"<pre>{JP}\n{OTHER}</pre>")
+        assert pipeline.run(stages, urls=urls, run_deadline=30) == [JP, OTHER]
+
+    assert browser_calls == []
+    assert (workdir / "ip.txt").read_text(encoding="utf-8").split() == [JP, OTHER]
+    assert (workdir / "ip2.txt").read_text(encoding="utf-8").split() == [JP]
+    assert (workdir / "ip_delta.txt").read_text(encoding="utf-8").split() == [f"+{JP}", f"-{HK}"]
+    assert (workdir / "ip.bin").exists()
+    with IPStore(STORE_FILE) as store:
+        assert store.active_regions() == {JP: "日本"}
+        assert store.sources_of(OTHER) == [urls['low'][0]]
+        # 分类结果已随输出入库，增量筛选没有待处理的变更
+        assert store.get_meta("filter_seq") == str(store.last_change_seq())
+        assert store.changes_since(int(store.get_meta("filter_seq")))[:2] == (set(), set())
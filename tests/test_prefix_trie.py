@@ -0,0 +1,52 @@
+"""IPv4/IPv6统一前缀树：最长前缀匹配、区间拆分，并与逐区间线性查找对照"""
+
+import random
+import ipaddress
+
+from prefix_trie import PrefixTrie, format_ip, parse_ip, parse_network, range_to_prefixes
+
+def test_longest_prefix_match_both_families():
+    trie = PrefixTrie()
+    trie.add_cidr("10.0.0.0/8", "a")
+    trie.add_cidr("10.1.0.0/16", "b")
+    trie.add_cidr("10.1.2.0/24", "c")
+    trie.add_cidr("0.0.0.0/0", "default")
+    trie.add_cidr("2606:4700::/32", "cf")
+    trie.add_cidr("2606:4700:10::/48", "cf-10")
+    assert trie.lookup_ip("10.1.2.3") == "c" and trie.lookup_ip("10.1.3.3") == "b"
+    assert trie.lookup_ip("10.2.0.0") == "a" and trie.lookup_ip("11.0.0.0") == "default"
+    assert trie.lookup_ip("2606:4700:10::1") == "cf-10" and trie.lookup_ip("2606:4700::6815:1a0b") == "cf"
+    assert trie.lookup_ip("2606:4701::1") is None and trie.lookup_ip("not-an-ip") is None
+    assert (6, int(ipaddress.IPv6Address("2606:4700::1"))) in trie and len(trie) == 6
+
+def test_reinsert_overwrites_without_growing():
+    trie = PrefixTrie()
+    trie.add_cidr("1.2.3.0/24", "x")
+    trie.add_cidr("1.2.3.0/24", "y")
+    assert len(trie) == 1 and trie.lookup_ip("1.2.3.4") == "y"
+
+def test_parse_and_format():
+    assert parse_ip("1.2.3.4") == (4, 0x01020304) and parse_ip("1.2.3.256") is None
+    assert parse_ip("::1") == (6, 1) and parse_ip("1::2::3") is None
+    assert format_ip(6, parse_ip("2606:4700:0::1")[1]) == "2606:4700::1"
+    assert parse_network("10.1.2.3/8") == (4, 10 << 24, 8)
+
+def test_range_to_prefixes():
+    assert list(range_to_prefixes(1, 6, 32)) == [(1, 32), (2, 31), (4, 31), (6, 32)]
+    assert list(range_to_prefixes(0, 0xFFFFFFFF, 32)) == [(0, 0)]
+
+def test_random_ranges_match_linear_scan():
+    rng = random.Random(0)
+    ranges = []
+    trie = PrefixTrie()
+    for i in range(300):
+        start = rng.getrandbits(32)
+        end = min(0xFFFFFFFF, start + rng.getrandbits(rng.randrange(4, 20)))
+        if any(s <= end and start <= e for s, e, _ in ranges):
+            continue
+        ranges.append((start, end, i))
+        trie.add_range(4, start, end, i)
+    probes = [rng.getrandbits(32) for _ in range(5000)] + [s for s, _, _ in ranges] + [e for _, e, _ in ranges]
+    for addr in probes:
+        expected = next((label for s, e, label in ranges if s <= addr <= e), None)
+        assert trie.lookup(4, addr) == expected, (addr, expected)
@@ -0,0 +1,43 @@
+"""候选IP测速：对注入握手延迟的本地TLS监听器探测，验证排序与不可达候选的处理"""
+
+import shutil
+import socket
+import asyncio
+
+import pytest
+
+from local_server import DelayedListener, make_self_signed_cert
+from probe import probe_all, split_candidate
+
+def test_split_candidate():
+    assert split_candidate("1.2.3.4") == ("1.2.3.4", 443)
+    assert split_candidate("1.2.3.4:2053") == ("1.2.3.4", 2053)
+    assert split_candidate("2606:4700::1") == ("2606:4700::1", 443)
+    assert split_candidate("[2606:4700::1]:8443") == ("2606:4700::1", 8443)
+
+def _closed_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+@pytest.mark.skipif(shutil.which("openssl") is None, reason="需要openssl命令生成自签名证书")
+def test_probe_all_ranks_by_handshake_latency(tmp_path):
+    certfile, keyfile = make_self_signed_cert(str(tmp_path))
+    delays = (0.12, 0.02, 0.06)
+
+    async def run():
+        listeners = [await DelayedListener(delay, certfile, keyfile).start() for delay in delays]
+        try:
+            candidates = [f"127.0.0.1:{listener.port}" for listener in listeners]
+            candidates.append(f"127.0.0.1:{_closed_port()}")
+            return candidates, await probe_all(candidates, samples=2, timeout=1.0, tls=True)
+        finally:
+            for listener in listeners:
+                await listener.stop()
+
+    candidates, results = asyncio.run(run())
+    by_delay = [candidates[i] for i in sorted(range(len(delays)), key=delays.__getitem__)]
+    assert [r.candidate for r in results] == by_delay + [candidates[-1]]
+    for result, delay in zip(results, sorted(delays)):
+        assert result.loss == 0 and result.median >= delay * 1000
+    assert results[-1].loss == 1.0 and results[-1].median is None
@@ -0,0 +1,128 @@
+"""IP列表HTTP服务：按地区的视图、条件请求、gzip协商、HEAD、top查询、错误响应与重新加载"""
+
+import gzip
+import http.client
+import json
+import os
+import time
+from urllib.parse import quote, urlsplit
+
+import pytest
+
+from serve import ListServer, load_snapshot
+
+HK, HK2, JP = "47.57.130.1", "47.57.130.2", "52.192.0.1"
+
+def write_list(path, entries):
+    path.write_text("\n".join(entries), encoding="utf-8")
+    return str(path)
+
+def test_region_views_exclude_ported_entries_like_ip_filter(tmp_path):
+    path = write_list(tmp_path / "ip.txt", [HK, f"{HK2}:443", JP, "[2606:4700::1]:443", "8.8.8.8"])
+    snapshot = load_snapshot([path], ranked_file=None)
+    assert snapshot.views[("ip.txt", "香港")].body == HK.encode()
+    assert snapshot.views[("ip.txt", "日本")].body == JP.encode()
+    assert snapshot.views[("ip.txt", None)].count == 5
+
+def write_ranking(path, entries):
+    path.write_text("# candidate\tmedian_ms\tjitter_ms\tloss\n"
+                    + "".join(f"{entry}\t{i}.0\t0.0\t0%\n" for i, entry in enumerate(entries, 1)), encoding="utf-8")
+    return str(path)
+
+@pytest.fixture
+def lists(tmp_path):
+    # 足够长的列表，gzip后一定更小
+    entries = [HK, JP, HK2] + [f"8.8.{i // 256}.{i % 256}" for i in range(300)]
+    return write_list(tmp_path / "ip2.txt", entries), entries
+
+def start_server(tmp_path, path, reload_interval=0.0):
+    ranked = write_ranking(tmp_path / "ip_latency.txt", [JP, HK2])
+    return ListServer([path], host="127.0.0.1", port=0, ranked_file=ranked, reload_interval=reload_interval)
+
+def request(server, path, method="GET", headers=None):
+    parts = urlsplit(server.url())
+    conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=5)
+    try:
+        conn.request(method, path, headers=headers or {})
+        response = conn.getresponse()
+        return response.status, dict(response.getheaders()), response.read()
+    finally:
+        conn.close()
+
+def test_get_conditional_and_head(tmp_path, lists):
+    path, entries = lists
+    with start_server(tmp_path, path) as server:
+        status, headers, body = request(server, "/ip2.txt")
+        assert status == 200 and body == "\n".join(entries).encode()
+        assert headers["Content-Length"] == str(len(body)) and "Content-Encoding" not in headers
+        etag = headers["ETag"]
+
+        status, not_modified, body = request(server, "/ip2.txt", headers={"If-None-Match": etag})
+        assert status == 304 and body == b"" and not_modified["ETag"] == etag
+        assert request(server, "/ip2.txt", headers={"If-None-Match": '"other"'})[0] == 200
+        assert request(server, "/ip2.txt", headers={"If-None-Match": "*"})[0] == 304
+        assert request(server, "/ip2.txt", headers={"If-Modified-Since": headers["Last-Modified"]})[0] == 304
+
+        status, head_headers, body = request(server, "/ip2.txt", method="HEAD")
+        assert status == 200 and body == b"" and head_headers["ETag"] == etag
+        assert head_headers["Content-Length"] == headers["Content-Length"]
+
+def test_gzip_negotiation(tmp_path, lists):
+    path, entries = lists
+    with start_server(tmp_path, path) as server:
+        status, headers, body = request(server, "/ip2.txt", headers={"Accept-Encoding": "gzip, deflate"})
+        assert status == 200 and headers["Content-Encoding"] == "gzip" and headers["Vary"] == "Accept-Encoding"
+        assert gzip.decompress(body) == "\n".join(entries).encode()
+        identity_etag = request(server, "/ip2.txt")[1]["ETag"]
+        assert headers["ETag"] != identity_etag
+        # 压缩表示的ETag只对压缩请求有效
+        assert request(server, "/ip2.txt", headers={"Accept-Encoding": "gzip", "If-None-Match": headers["ETag"]})[0] == 304
+        assert request(server, "/ip2.txt", headers={"If-None-Match": headers["ETag"]})[0] == 200
+
+def test_region_and_top_queries(tmp_path, lists):
+    path, entries = lists
+    with start_server(tmp_path, path) as server:
+        assert request(server, "/ip2.txt?region=" + quote("香港"))[2] == f"{HK}\n{HK2}".encode()
+        # 按测速名次排列，未测速的保持文件顺序
+        assert request(server, "/ip2.txt?top=3")[2] == f"{JP}\n{HK2}\n{HK}".encode()
+        assert request(server, "/ip2.txt?region=" + quote("香港") + "&top=1")[2] == HK2.encode()
+        assert request(server, "/ip2.txt?top=7")[2].split(b"\n")[3:] == [b"8.8.0.0", b"8.8.0.1", b"8.8.0.2", b"8.8.0.3"]
+        status, _, body = request(server, "/ip2.txt?top=100000")
+        assert status == 200 and len(body.split(b"\n")) == len(entries)
+
+        status, _, body = request(server, "/healthz")
+        summary = json.loads(body)
+        assert status == 200 and summary["lists"]["ip2.txt"] == {"count": len(entries),
+                                                               "regions": {"香港": 2, "日本": 1, "新加坡": 0}}
+
+@pytest.mark.parametrize("path, status", [
+    ("/missing.txt", 404),
+    ("/ip2.txt?region=" + quote("火星"), 404),
+    ("/ip2.txt?top=0", 400),
+    ("/ip2.txt?top=-1", 400),
+    ("/ip2.txt?top=abc", 400),
+])
+def test_error_responses(tmp_path, lists, path, status):
+    with start_server(tmp_path, lists[0]) as server:
+        got, headers, body = request(server, path)
+        assert got == status and headers["Content-Length"] == str(len(body)) and body
+        assert request(server, path, method="HEAD")[0] == status
+
+def test_reload_after_source_is_replaced(tmp_path, lists):
+    path, entries = lists
+    with start_server(tmp_path, path, reload_interval=0.05) as server:
+        etag = request(server, "/ip2.txt")[1]["ETag"]
+        # 与流水线相同：写临时文件后原子替换
+        tmp = write_list(tmp_path / "ip2.txt.tmp", [JP, "54.238.0.1"])
+        os.replace(tmp, path)
+        deadline = time.monotonic() + 5
+        while server.reloads == 0 and time.monotonic() < deadline:
+            time.sleep(0.02)
+        assert server.reloads == 1
+        status, headers, body = request(server, "/ip2.txt", headers={"If-None-Match": etag})
+        assert status == 200 and body == f"{JP}\n54.238.0.1".encode() and headers["ETag"] != etag
+        assert request(server, "/ip2.txt?region=" + quote("日本"))[2] == f"{JP}\n54.238.0.1".encode()
+        assert request(server, "/ip2.txt?region=" + quote("香港"))[2] == b""
+
+        # 文件未变化时不重新加载
+        assert server.reload() is False and server.reloads == 1
@@ -0,0 +1,47 @@
+"""站点健康模型：学习抓取方式、熔断与半开恢复、耗时分位数、按预期产出速率排序、落盘"""
+
+import time
+
+import pytest
+
+from source_health import COOLDOWN, FAILURE_THRESHOLD, RELEARN_AFTER, SourceHealth
+
+@pytest.fixture
+def health(tmp_path):
+    return SourceHealth(str(tmp_path / "health.json"))
+
+def test_learns_browser_and_relearns_direct(health):
+    assert health.preferred_method("a") == 'direct' and health.allow("a")
+    # 直连失败、浏览器成功 → 下次直接用浏览器；到期重试直连，直连恢复后清除
+    health.record_fetch("a", 'browser', True, 8.0, probed_direct=True)
+    health.record_result("a", 50)
+    assert health.preferred_method("a") == 'browser'
+    assert health.preferred_method("a", now=time.time() + RELEARN_AFTER + 1) == 'direct'
+    health.record_fetch("a", 'direct', True, 1.0, probed_direct=True)
+    assert health.preferred_method("a") == 'direct'
+
+def test_circuit_opens_and_half_open_success_closes(health):
+    for _ in range(FAILURE_THRESHOLD):
+        health.record_fetch("b", 'browser', False, 20.0, probed_direct=True)
+        health.record_result("b", 0)
+    assert not health.allow("b")
+    assert health.allow("b", now=time.time() + COOLDOWN + 1)
+    health.record_result("b", 10)
+    assert health.allow("b")
+
+def test_latency_percentile_and_order(health):
+    health.record_fetch("a", 'direct', True, 8.0, probed_direct=True)
+    health.record_result("a", 50)
+    health.record_fetch("b", 'direct', False, 20.0, probed_direct=True)
+    health.record_result("b", 0)
+    health.record_fetch("c", 'direct', True, 0.5, probed_direct=True)
+    health.record_result("c", 100)
+    assert health.latency_percentile("a", 0.9) == 8.0 and health.latency_percentile("new", 0.9) is None
+    jobs = [("a", "low"), ("b", "low"), ("c", "low"), ("new", "low")]
+    assert [url for url, _ in health.order(jobs)] == ["new", "c", "a", "b"]
+
+def test_save_and_reload(health):
+    health.record_fetch("a", 'direct', True, 1.0, probed_direct=True)
+    health.record_result("a", 5)
+    health.save()
+    assert SourceHealth(health.path).entries == health.entries